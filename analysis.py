@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import asyncio
+import collections
+import concurrent.futures
+import deepfakeecg
+import numpy
+import renderer
+import threading
+import time
+import typing
+
+from metrics import Metrics
+from typing import Any, Final
+from utilities import importModule, log, startWorkerPool, waitForWorkerPool
+
+# Type of the analysis figures. matplotlib is not imported at runtime here
+# (see renderer.py), so the type is only known to the type checker:
+if typing.TYPE_CHECKING:
+   import matplotlib.figure
+   Figure : typing.TypeAlias = matplotlib.figure.Figure
+else:
+   Figure = Any
+
+
+# ###### Measurements of one ECG ############################################
+# The signals are a pandas DataFrame from neurokit2.ecg_process(), or, for
+# long ECGs, a dictionary of NumPy arrays. Background analyses only keep the
+# measurements; the figure is plotted from them when it is needed.
+class AnalysisData:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                signals : Any,
+                info    : dict[str,Any]) -> None:
+      self.Signals : Final[Any]           = signals
+      self.Info    : Final[dict[str,Any]] = info
+
+   # ###### Memory usage of the signals in bytes ############################
+   def memoryBytes(self) -> int:
+      if isinstance(self.Signals, dict):
+         return sum(numpy.asarray(signal).nbytes for signal in self.Signals.values())
+      return int(self.Signals.memory_usage().sum())
+
+
+# ###### Analysis result of one ECG, with its figure ########################
+class AnalysisResult(AnalysisData):
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                signals : Any,
+                info    : dict[str,Any],
+                figure  : Figure) -> None:
+      super().__init__(signals, info)
+      self.Figure : Final[Figure] = figure
+
+   # ###### Release the figure ##############################################
+   def close(self) -> None:
+      import matplotlib.pyplot
+      matplotlib.pyplot.close(self.Figure)
+
+
+# Long ECGs are analysed in windows of this length, which overlap by
+# AnalysisOverlapInSeconds on each side, so that R-peaks at the window
+# borders are found:
+AnalysisWindowInSeconds  : Final[int] = 60
+AnalysisOverlapInSeconds : Final[int] = 2
+
+# Bins of the RR interval histogram of long ECGs (ms):
+RRHistogramBins : Final[numpy.ndarray] = numpy.arange(300, 2020, 20)
+
+
+# ###### Streaming heart rate variability statistics ########################
+# The R-peaks are added window by window. Only the sums for the statistics,
+# the RR histogram and the mean heart rate per window are kept, i.e. the
+# memory needed does not grow with the length of the ECG.
+class StreamingHRV:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      self.Peaks           : int          = 0
+      self.LastPeak        : int | None   = None
+      self.LastRR          : float | None = None
+      self.Intervals       : int          = 0
+      self.SumRR           : float        = 0.0
+      self.SumSquaredRR    : float        = 0.0
+      self.Differences     : int          = 0
+      self.SumSquaredDiffs : float        = 0.0
+      self.NN50            : int          = 0
+      self.Histogram       : numpy.ndarray = numpy.zeros(len(RRHistogramBins) - 1, dtype = numpy.int64)
+      self.TrendTimes      : list[float]  = [ ]
+      self.TrendRates      : list[float]  = [ ]
+
+   # ###### Add the R-peaks of a window #####################################
+   # peaks are the sample numbers in the ECG, in ascending order.
+   def add(self, peaks : numpy.ndarray, windowStart : int) -> None:
+      self.Peaks = self.Peaks + len(peaks)
+      if self.LastPeak is not None:
+         peaks = numpy.concatenate( ([ self.LastPeak ], peaks) )
+      if len(peaks) > 0:
+         self.LastPeak = int(peaks[-1])
+      rr = numpy.diff(peaks) * (1000.0 / deepfakeecg.ECG_SAMPLING_RATE)
+      if len(rr) == 0:
+         return
+
+      self.Intervals    = self.Intervals + len(rr)
+      self.SumRR        = self.SumRR + float(rr.sum())
+      self.SumSquaredRR = self.SumSquaredRR + float(numpy.square(rr).sum())
+      self.Histogram    = self.Histogram + numpy.histogram(rr, bins = RRHistogramBins)[0]
+      self.TrendTimes.append(windowStart / deepfakeecg.ECG_SAMPLING_RATE / 60.0)
+      self.TrendRates.append(60000.0 / float(rr.mean()))
+
+      if self.LastRR is not None:
+         differences = numpy.diff(numpy.concatenate( ([ self.LastRR ], rr) ))
+      else:
+         differences = numpy.diff(rr)
+      self.LastRR          = float(rr[-1])
+      self.Differences     = self.Differences + len(differences)
+      self.SumSquaredDiffs = self.SumSquaredDiffs + float(numpy.square(differences).sum())
+      self.NN50            = self.NN50 + int((numpy.abs(differences) > 50).sum())
+
+   # ###### Get the statistics ##############################################
+   # Time-domain HRV indices, with the names of neurokit2.hrv_time().
+   def info(self) -> dict[str,Any]:
+      info : dict[str,Any] = { 'R_Peaks': self.Peaks }
+      if self.Intervals > 0:
+         meanRR = self.SumRR / self.Intervals
+         info['ECG_Rate_Mean'] = 60000.0 / meanRR
+         info['HRV_MeanNN']    = meanRR
+         info['HRV_SDNN']      = max(0.0, self.SumSquaredRR / self.Intervals - meanRR * meanRR) ** 0.5
+      if self.Differences > 0:
+         info['HRV_RMSSD'] = (self.SumSquaredDiffs / self.Differences) ** 0.5
+         info['HRV_pNN50'] = 100.0 * self.NN50 / self.Differences
+      return info
+
+
+# ###### Analyze a long ECG, window by window ###############################
+# The R-peaks are detected in each window, and only the peaks of the window
+# itself (not of the overlap) are used. The signals are the heart rate over
+# time and the RR interval histogram, instead of the signal.
+def measureLongECG(leadI : numpy.ndarray) -> AnalysisData:
+
+   # neurokit2 is only imported when needed, since it takes long to import:
+   import neurokit2
+
+   rate    = deepfakeecg.ECG_SAMPLING_RATE
+   window  = AnalysisWindowInSeconds * rate
+   overlap = AnalysisOverlapInSeconds * rate
+   hrv     = StreamingHRV()
+   for windowStart in range(0, len(leadI), window):
+      first   = max(0, windowStart - overlap)
+      last    = min(len(leadI), windowStart + window + overlap)
+      cleaned = neurokit2.ecg_clean(leadI[first:last], sampling_rate = rate)
+      _, peakInfo = neurokit2.ecg_peaks(cleaned, sampling_rate = rate)
+      peaks = numpy.asarray(peakInfo['ECG_R_Peaks'], dtype = numpy.int64) + first
+      hrv.add(peaks[(peaks >= windowStart) & (peaks < windowStart + window)], windowStart)
+   info = hrv.info()
+   info['ECG_Duration'] = len(leadI) / rate
+
+   signals = {
+      'Time':         numpy.array(hrv.TrendTimes),
+      'ECG_Rate':     numpy.array(hrv.TrendRates),
+      'RR_Histogram': hrv.Histogram
+   }
+   return AnalysisData(signals, info)
+
+
+# ###### Plot the analysis of a long ECG ####################################
+# The plot shows the heart rate over time and the RR interval histogram.
+# The caller must hold renderer.PyplotLock.
+def plotLongAnalysis(data : AnalysisData) -> Figure:
+
+   # pyplot is only imported when needed, since it takes long to import:
+   import matplotlib.pyplot
+
+   signals = data.Signals
+   info    = data.Info
+   figure  = matplotlib.pyplot.figure(figsize = (508/25.4, 122/25.4))
+   trend, histogram = figure.subplots(1, 2, width_ratios = [ 3, 1 ])
+   trend.plot(signals['Time'], signals['ECG_Rate'], color = '#F15D22', marker = '.')
+   trend.set_xlabel('Time (min)')
+   trend.set_ylabel('Heart rate (bpm)')
+   trend.set_title(f'Heart rate per {AnalysisWindowInSeconds} s window')
+   trend.grid(True)
+   histogram.stairs(signals['RR_Histogram'], RRHistogramBins, fill = True, color = '#241363')
+   histogram.set_xlabel('RR interval (ms)')
+   histogram.set_ylabel('Intervals')
+   histogram.set_title('RR intervals')
+   figure.suptitle(f'{info["ECG_Duration"] / 60:.1f} min, {info["R_Peaks"]} R-peaks' +
+                   (f', {info["ECG_Rate_Mean"]:.1f} bpm, SDNN {info["HRV_SDNN"]:.1f} ms'
+                    if 'ECG_Rate_Mean' in info else '') +
+                   (f', RMSSD {info["HRV_RMSSD"]:.1f} ms, pNN50 {info["HRV_pNN50"]:.1f} %'
+                    if 'HRV_RMSSD' in info else ''))
+   figure.tight_layout()
+   return figure
+
+
+# ###### Analyze lead I of an ECG ###########################################
+# leadI is the signal of lead I in mV. ECGs longer than one analysis window
+# are analysed by measureLongECG().
+def measureECG(leadI : numpy.ndarray) -> AnalysisData:
+
+   if len(leadI) > AnalysisWindowInSeconds * deepfakeecg.ECG_SAMPLING_RATE:
+      return measureLongECG(leadI)
+
+   # neurokit2 is only imported when needed, since it takes long to import:
+   import neurokit2
+
+   signals, info = neurokit2.ecg_process(leadI, sampling_rate = deepfakeecg.ECG_SAMPLING_RATE)
+   return AnalysisData(signals, info)
+
+
+# ###### Plot the analysis of an ECG ########################################
+def plotAnalysis(data : AnalysisData) -> AnalysisResult:
+
+   # neurokit2 and pyplot are only imported when needed, since they take
+   # long to import:
+   import matplotlib.pyplot
+   import neurokit2
+
+   with renderer.PyplotLock:
+      if isinstance(data.Signals, dict):
+         figure = plotLongAnalysis(data)
+      else:
+         neurokit2.ecg_plot(data.Signals, data.Info)
+
+         # DIN A4 landscape: w=11.7, h=8.27
+         w = 508/25.4   # mm to inch
+         h = 122/25.4   # mm to inch
+         figure = matplotlib.pyplot.gcf()
+         figure.set_size_inches(w, h, forward=True)
+
+   return AnalysisResult(data.Signals, data.Info, figure)
+
+
+# ###### Analyze lead I of an ECG and plot the analysis #####################
+def analyzeECG(leadI : numpy.ndarray) -> AnalysisResult:
+   return plotAnalysis(measureECG(leadI))
+
+
+# ###### Analyze an ECG in a worker process #################################
+# The figure is detached from pyplot, so that it is not kept by the worker
+# after being pickled back. Returns the result and the analysis duration.
+def runAnalysis(leadI : numpy.ndarray) -> tuple[AnalysisResult,float]:
+   startTime = time.monotonic()
+   result    = analyzeECG(leadI)
+   result.close()
+   return (result, time.monotonic() - startTime)
+
+
+# ###### Analyze an ECG in a worker process, without figure #################
+def runMeasurement(leadI : numpy.ndarray) -> tuple[AnalysisData,float]:
+   startTime = time.monotonic()
+   data      = measureECG(leadI)
+   return (data, time.monotonic() - startTime)
+
+
+# ###### Plot an analysis in a worker process ###############################
+def runPlot(data : AnalysisData) -> tuple[AnalysisResult,float]:
+   startTime = time.monotonic()
+   result    = plotAnalysis(data)
+   result.close()
+   return (result, time.monotonic() - startTime)
+
+
+# Result of the functions run by the worker pool:
+ResultType = typing.TypeVar('ResultType', bound = AnalysisData)
+
+
+# ###### Analysis worker pool ###############################################
+# The ECGs are analysed by worker processes, to keep the server process free
+# for the GUI. At most "workers" background analyses run at the same time;
+# the pool has one more process, so that an analysis requested by a user
+# does not wait for the queued background analyses.
+class AnalysisWorkers:
+
+   # ###### Constructor #####################################################
+   def __init__(self, workers : int) -> None:
+      self.Workers  : Final[int] = workers
+      self.Lock     = threading.RLock()   # done() may be called by execute()
+      self.Queue    : collections.deque[tuple[int,numpy.ndarray,concurrent.futures.Future[AnalysisData]]] = \
+                         collections.deque()
+      self.Queued   : int = 0
+      self.Running  : int = 0
+      self.Executor : concurrent.futures.ProcessPoolExecutor | None = None
+
+   # ###### Start the worker processes ######################################
+   # Like for the rendering workers, this should be done early. Each worker
+   # imports neurokit2 when it starts.
+   def start(self) -> None:
+      self.Executor = startWorkerPool(self.Workers + 1, importModule, ('neurokit2', ))
+      log(f'Started {self.Workers + 1} analysis worker processes')
+
+   # ###### Stop the workers ################################################
+   def shutdown(self) -> None:
+      with self.Lock:
+         queue = list(self.Queue)
+         self.Queue.clear()
+         self.Queued = self.Queued - len(queue)
+         executor      = self.Executor
+         self.Executor = None
+      for index, data, future in queue:
+         future.cancel()
+      if executor is not None:
+         executor.shutdown(wait = True, cancel_futures = True)
+
+   # ###### Wait until the worker processes have imported neurokit2 #########
+   def warmUp(self) -> None:
+      with self.Lock:
+         executor = self.Executor
+      if executor is not None:
+         waitForWorkerPool(executor)
+
+   # ###### Run a request of a user now #####################################
+   # It runs in the additional worker process, i.e. it does not wait for the
+   # background analyses. Without worker processes, it runs in the calling
+   # thread.
+   def request(self,
+               function : typing.Callable[[Any], tuple[ResultType,float]],
+               argument : Any,
+               stage    : str) -> concurrent.futures.Future[ResultType]:
+      future : concurrent.futures.Future[ResultType] = concurrent.futures.Future()
+      future.set_running_or_notify_cancel()
+      with self.Lock:
+         if self.Executor is not None:
+            self.execute(None, function, argument, stage, future)
+            return future
+      result, duration = function(argument)
+      Metrics.observe(stage, duration)
+      future.set_result(result)
+      return future
+
+   # ###### Analyse an ECG now ##############################################
+   def analyze(self, data : numpy.ndarray) -> concurrent.futures.Future[AnalysisResult]:
+      return self.request(runAnalysis, data, 'analysis')
+
+   # ###### Plot an analysis now ############################################
+   def plot(self, data : AnalysisData) -> concurrent.futures.Future[AnalysisResult]:
+      return self.request(runPlot, data, 'analysis_plot')
+
+   # ###### Queue an ECG for background analysis ############################
+   # Only the measurements are made, without figure.
+   def submit(self,
+              index : int,
+              data  : numpy.ndarray) -> concurrent.futures.Future[AnalysisData] | None:
+      if self.Workers < 1:
+         return None
+      future : concurrent.futures.Future[AnalysisData] = concurrent.futures.Future()
+      with self.Lock:
+         if self.Executor is None:
+            return None
+         self.Queue.append( (index, data, future) )
+         self.Queued = self.Queued + 1
+         self.dispatch()
+      return future
+
+   # ###### Start queued background analyses (Lock must be held) ############
+   def dispatch(self) -> None:
+      while (self.Running < self.Workers) and (len(self.Queue) > 0):
+         index, data, future = self.Queue.popleft()
+         if not future.set_running_or_notify_cancel():
+            self.Queued = self.Queued - 1   # Cancelled in the meantime
+            continue
+         self.Running = self.Running + 1
+         self.execute(index, runMeasurement, data, 'analysis', future)
+
+   # ###### Run a function in a worker process (Lock must be held) ##########
+   # index is None for a request of a user.
+   def execute(self,
+               index    : int | None,
+               function : typing.Callable[[Any], tuple[ResultType,float]],
+               argument : Any,
+               stage    : str,
+               future   : concurrent.futures.Future[ResultType]) -> None:
+      work = typing.cast(concurrent.futures.ProcessPoolExecutor,
+                         self.Executor).submit(function, argument)
+      work.add_done_callback(lambda work: self.done(index, stage, future, work))
+
+   # ###### Pass on the result of a finished function #######################
+   def done(self,
+            index  : int | None,
+            stage  : str,
+            future : concurrent.futures.Future[ResultType],
+            work   : concurrent.futures.Future[tuple[ResultType,float]]) -> None:
+      if work.cancelled():
+         future.set_exception(concurrent.futures.CancelledError())
+      elif work.exception() is not None:
+         future.set_exception(typing.cast(BaseException, work.exception()))
+      else:
+         result, duration = work.result()
+         Metrics.observe(stage, duration)
+         future.set_result(result)
+         if index is not None:
+            log(f'Background analysis of ECG #{index + 1} done in ' +
+                f'{duration:.3f} s, {self.Queued - 1} queued')
+      if index is not None:
+         with self.Lock:
+            self.Queued  = self.Queued - 1
+            self.Running = self.Running - 1
+            if self.Executor is not None:
+               self.dispatch()
+
+
+# ###### Per-session cache of analysis results ##############################
+# The background analyses of a batch are kept as measurements (AnalysisData),
+# for all ECGs of the batch, so that any ECG selected by the user is already
+# analysed. The figures are only plotted for the selected ECGs, and kept for
+# the "capacity" most recently used ECGs.
+class AnalysisCache:
+
+   # ###### Constructor #####################################################
+   def __init__(self, capacity : int = 16) -> None:
+      self.Lock     = threading.Lock()
+      self.Capacity : Final[int] = capacity
+      self.Results  : collections.OrderedDict[int,AnalysisResult] = collections.OrderedDict()
+      self.Measured : dict[int,AnalysisData] = { }
+      self.Pending  : dict[int,concurrent.futures.Future[AnalysisData]] = { }
+
+   # ###### Get the cached result for an ECG ################################
+   # If the ECG has only been measured (or is being measured) in the
+   # background, the figure is plotted by the workers. Returns None if the
+   # ECG has not been analysed.
+   async def get(self,
+                 workers : AnalysisWorkers,
+                 index   : int) -> AnalysisResult | None:
+      with self.Lock:
+         result = self.Results.get(index)
+         if result is not None:
+            self.Results.move_to_end(index)
+            Metrics.increment('analysis_cache_hits')
+            return result
+         data    = self.Measured.get(index)
+         pending = self.Pending.get(index)
+      if (data is None) and (pending is not None):
+         try:
+            # Shielded, so that a cancelled handler does not cancel the analysis:
+            data = await asyncio.shield(asyncio.wrap_future(pending))
+         except asyncio.CancelledError:
+            if not pending.cancelled():
+               raise   # The handler itself has been cancelled
+         except Exception:
+            pass       # Failed; it is analysed again
+      if data is None:
+         Metrics.increment('analysis_cache_misses')
+         return None
+      Metrics.increment('analysis_cache_hits')
+      result = await asyncio.wrap_future(workers.plot(data))
+      self.put(index, result)
+      return result
+
+   # ###### Analyse an ECG in the background ################################
+   def prefetch(self,
+                workers : AnalysisWorkers,
+                index   : int,
+                data    : numpy.ndarray) -> None:
+      with self.Lock:
+         if (index in self.Results) or (index in self.Measured) or (index in self.Pending):
+            return
+         future = workers.submit(index, data)
+         if future is not None:
+            self.Pending[index] = future
+      if future is not None:
+         future.add_done_callback(lambda future: self.store(index, future))
+
+   # ###### Store a finished background analysis ############################
+   def store(self,
+             index  : int,
+             future : concurrent.futures.Future[AnalysisData]) -> None:
+      with self.Lock:
+         if self.Pending.get(index) is not future:
+            return   # The cache has been cleared in the meantime
+         del self.Pending[index]
+         if (not future.cancelled()) and (future.exception() is not None):
+            log(f'Background analysis of ECG #{index + 1} failed: {future.exception()}')
+         elif not future.cancelled():
+            self.Measured[index] = future.result()
+
+   # ###### Add a result, evicting the least-recently used figures ##########
+   # The measurements of evicted results are kept.
+   def put(self, index : int, result : AnalysisResult) -> None:
+      with self.Lock:
+         previous = self.Results.pop(index, None)
+         if (previous is not None) and (previous is not result):
+            previous.close()
+         self.Results[index]  = result
+         self.Measured[index] = AnalysisData(result.Signals, result.Info)
+         while len(self.Results) > self.Capacity:
+            self.Results.popitem(last = False)[1].close()
+
+   # ###### Memory usage of the measurements in bytes #######################
+   def memoryBytes(self) -> int:
+      with self.Lock:
+         measured = list(self.Measured.values())
+      return sum(data.memoryBytes() for data in measured)
+
+   # ###### Drop all results, cancel background analyses ####################
+   def clear(self) -> None:
+      with self.Lock:
+         pending = list(self.Pending.values())
+         self.Pending.clear()
+         for result in self.Results.values():
+            result.close()
+         self.Results.clear()
+         self.Measured.clear()
+      # Cancelling runs the done callbacks, which need the lock:
+      for future in pending:
+         future.cancel()
@@ -33,20 +33,31 @@
 # * Vajira Thambawita <vajira@simula.no>
 # * Thomas Dreibholz <dreibh@simula.no>
 
-import datetime
+import time
+StartupTime = time.monotonic()   # For the startup timing report
+
+import analysis
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import deepfakeecg
-import ecg_plot
+import ecgresults
+import export
 import getopt
 import gradio
-import io
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.ticker
-import neurokit2
+import metrics
+import modelpool
 import numpy
+import os
 import pathlib
 import random
+import renderer
+import resultcache
+import scheduler
+import sessionmanager
+import sessionstore
+import shutil
 import sys
 import tempfile
 import threading
@@ -56,13 +67,12 @@ import version
 import PIL
 import PIL.Image
 
+from metrics import Metrics
 from typing import Any, Final
+from utilities import directorySize, importModule, log
 
-
-# ###### Print log message ##################################################
-def log(logstring : str) -> None:
-   print(('\x1b[34m' + datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f') +
-          ': ' + logstring + '\x1b[0m'));
+Startup : Final[metrics.StartupTimer] = metrics.StartupTimer(StartupTime)
+Startup.phase('imports')
 
 
 
@@ -70,53 +80,253 @@ def log(logstring : str) -> None:
 class Session:
 
    # ###### Constructor #####################################################
-   def __init__(self) -> None:
-      self.Lock = threading.Lock()
+   def __init__(self, sessionID : str) -> None:
+      self.ID            : Final[str]                      = sessionID
+      self.Lock = asyncio.Lock()
+      self.Users         : int                             = 0
       self.Counter       : int                             = 0
       self.Selected      : int                             = 0
-      self.Results       : list[Any]                       = [ ]
-      self.Analysis      : matplotlib.figure.Figure | None = None
-      self.Type          : int | None                      = None
+      self.ImageLock     = threading.Lock()
+      self.Images        : collections.OrderedDict[tuple[int,int],PIL.Image.Image] = \
+         collections.OrderedDict()
+      self.CacheKeys     : list[str] | None                = None
+      self.Results       : ecgresults.ECGResults           = \
+         ecgresults.ECGResults(deepfakeecg.DATA_ECG12, 0, 0)
+      self.Analysis      : analysis.AnalysisCache          = \
+         analysis.AnalysisCache(AnalysisCacheSize)
       self.TempDirectory : tempfile.TemporaryDirectory     = \
          tempfile.TemporaryDirectory(dir = TempDirectory.name)
       log(f'Prepared temporary directory {self.TempDirectory.name}')
 
-   # ###### Destructor ######################################################
-   def __del__(self) -> None:
+   # ###### Get the export directory of the current batch of results ########
+   def exportDirectory(self) -> pathlib.Path:
+      directory = pathlib.Path(self.TempDirectory.name) / ('Batch-' + str(self.Counter))
+      directory.mkdir(exist_ok = True)
+      return directory
+
+   # ###### Start a new batch of results ####################################
+   # The files exported from the previous batch are outdated now.
+   def newBatch(self) -> None:
+      shutil.rmtree(pathlib.Path(self.TempDirectory.name) / ('Batch-' + str(self.Counter)),
+                    ignore_errors = True)
+      self.Counter = self.Counter + 1
+
+   # ###### Check whether a request is working on the session ###############
+   def busy(self) -> bool:
+      return self.Lock.locked() or (self.Users > 0)
+
+   # ###### Memory usage of the results, images and analyses ################
+   # The results of the demo batch are shared by the sessions, and not
+   # counted. Long ECGs are memory-mapped from the temporary directory, and
+   # counted as disk usage.
+   def memoryUsage(self) -> int:
+      with self.ImageLock:
+         imageBytes = sum(image.width * image.height * len(image.getbands())
+                          for image in self.Images.values())
+      resultBytes = self.Results.memoryBytes() if demoBatch(self) is None else 0
+      return resultBytes + imageBytes + self.Analysis.memoryBytes()
+
+   # ###### Size of the temporary files #####################################
+   def diskUsage(self) -> int:
+      return directorySize(self.TempDirectory.name)
+
+   # ###### Release the figures, results and temporary files ################
+   # Called by the session manager, when the session is removed.
+   def close(self) -> None:
+      self.Analysis.clear()
+      with self.ImageLock:
+         self.Images.clear()
+      self.Results   = ecgresults.ECGResults(deepfakeecg.DATA_ECG12, 0, 0)
+      self.CacheKeys = None
+      Scheduler.removeSession(self.ID)
       log(f'Cleaning up temporary directory {self.TempDirectory.name}')
       self.TempDirectory.cleanup()
 
 
+# ###### Demo batch, shown on page load #####################################
+# It is generated once, by the warm-up, and shared by all sessions. The
+# results and analyses must therefore not be modified or closed.
+class DemoBatch:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                results   : ecgresults.ECGResults,
+                cacheKeys : list[str] | None,
+                gallery   : list[tuple[PIL.Image.Image,str]],
+                analyses  : list[analysis.AnalysisResult]) -> None:
+      self.Results   : Final[ecgresults.ECGResults]             = results
+      self.CacheKeys : Final[list[str] | None]                  = cacheKeys
+      self.Gallery   : Final[list[tuple[PIL.Image.Image,str]]]  = gallery
+      self.Analyses  : Final[list[analysis.AnalysisResult]]     = analyses
+
+
+# ###### Get the demo batch, if a session is showing it #####################
+def demoBatch(session: Session) -> DemoBatch | None:
+   if Demo.done() and (Demo.exception() is None) and \
+      (session.Results is Demo.result().Results):
+      return Demo.result()
+   return None
+
+
 TempDirectory : tempfile.TemporaryDirectory[Any]
-Sessions      : dict[str,Session] = { }
+Models        : modelpool.ModelPool = modelpool.ModelPool()
+Cache         : resultcache.ResultCache | None = None
+Store         : sessionstore.SessionStore | None = None
+RestoreLock   = threading.Lock()
+
+# Number of ECGs per gallery update of predict():
+StreamChunkSize   : Final[int] = 8
+# Number of cached analysis figures per session (the measurements of the
+# background analyses are kept for all ECGs of the batch):
+AnalysisCacheSize : Final[int] = 16
+# Number of cached full-resolution images per session:
+ImageCacheSize    : Final[int] = 16
+# Number of ECGs and seed of the demo batch, shown on page load:
+DemoNumberOfECGs  : Final[int] = 4
+DemoSeed          : Final[int] = 0
+
+# Update of the gallery, analysis, selected image and position slider:
+GalleryUpdate : typing.TypeAlias = \
+   tuple[list[tuple[PIL.Image.Image,str]] | dict[str,Any],analysis.Figure | dict[str,Any] | None,dict[str,Any] | None,Any]
 
 
 # ###### Initialize a new session ###########################################
+# The handlers of the page load may have created the session already. Then,
+# it is kept.
 def initializeSession(request: gradio.Request) -> None:
-   Sessions[request.session_hash] = Session()
+   if Sessions.get(request.session_hash) is not None:
+      return
+   with Metrics.span('session_init'):
+      Sessions.add(request.session_hash, Session(request.session_hash))
    log(f'Session "{request.session_hash}" initialized => {len(Sessions)} active sessions')
 
 
 # ###### Clean up a session #################################################
 def cleanUpSession(request: gradio.Request) -> None:
-   if request.session_hash in Sessions:
-      if Sessions[request.session_hash].Analysis:
-         matplotlib.pyplot.close(Sessions[request.session_hash].Analysis)
-      del Sessions[request.session_hash]
+   with Metrics.span('session_cleanup'):
+      Sessions.remove(request.session_hash)
+      if Store is not None:
+         Store.remove(request.session_hash)
    log(f'Session "{request.session_hash}" cleaned up => {len(Sessions)} active sessions')
 
 
+# ###### Get the session of a request #######################################
+# Sessions may have been closed by the session manager in the meantime, or
+# they may have been started by another server process. Then, they are
+# restored from the session store.
+async def getSession(request: gradio.Request) -> Session:
+   session = Sessions.get(request.session_hash)
+   if session is None:
+      session = await asyncio.to_thread(restoreSession, request.session_hash)
+   if session is None:
+      raise gradio.Error('The session has expired. Please reload the page!')
+   return session
+
+
+# ###### Use the session of a request #######################################
+# While a request uses the session, it is busy, so that the session manager
+# does not close it. If the session manager has closed it before it became
+# busy, it is got again.
+@contextlib.asynccontextmanager
+async def usingSession(request: gradio.Request) -> typing.AsyncIterator[Session]:
+   while True:
+      session = await getSession(request)
+      session.Users = session.Users + 1
+      if Sessions.get(session.ID) is session:
+         break
+      session.Users = session.Users - 1
+   try:
+      yield session
+   finally:
+      session.Users = session.Users - 1
+
+
+# ###### Save a session to the session store ################################
+# Without withResults, only the selection is updated. The results of the
+# demo batch are not stored with every session.
+def storeSession(session: Session, withResults: bool) -> None:
+   if Store is not None:
+      results = None if demoBatch(session) is not None else session.Results
+      Store.save(session.ID,
+                 sessionstore.SessionState(session.Counter, session.Selected,
+                                           session.CacheKeys, results),
+                 withResults)
+
+
+# ###### Restore a session from the session store ###########################
+# Returns None if the session is not in the store (or without store).
+def restoreSession(sessionID: str) -> Session | None:
+   if Store is None:
+      return None
+   with RestoreLock:
+      session = Sessions.get(sessionID)
+      if session is not None:
+         return session   # Restored by another request in the meantime
+
+      state = Store.load(sessionID)
+      if state is None:
+         return None
+      results = state.Results
+      if results is None:
+         try:
+            results = Demo.result().Results   # Waits for the warm-up
+         except Exception:
+            return None
+      session = Session(sessionID)
+      session.Counter   = state.Counter
+      session.Selected  = state.Selected
+      session.CacheKeys = state.CacheKeys
+      session.Results   = results
+      Sessions.add(sessionID, session)
+   Metrics.increment('sessions_restored')
+   log(f'Session "{sessionID}" restored from session store with ' +
+       f'{len(session.Results)} ECGs => {len(Sessions)} active sessions')
+   return session
+
+
+# ###### Merge cached and generated ECGs ####################################
+# Returns the ECGs in order, in chunks of StreamChunkSize ECGs. The ECGs not
+# in cached come from the generation job.
+async def mergeCachedECGs(job:          scheduler.GenerationJob | None,
+                          cached:       dict[int,torch.Tensor],
+                          numberOfECGs: int) -> typing.AsyncIterator[list[torch.Tensor]]:
+
+   generated : collections.deque[torch.Tensor]          = collections.deque()
+   chunks    : typing.AsyncIterator[list[torch.Tensor]] | None = \
+      aiter(job) if job is not None else None
+   for firstECG in range(0, numberOfECGs, StreamChunkSize):
+      results : list[torch.Tensor] = [ ]
+      for index in range(firstECG, min(firstECG + StreamChunkSize, numberOfECGs)):
+         if index in cached:
+            results.append(cached[index])
+         else:
+            if len(generated) == 0:
+               generated.extend(await anext(typing.cast(typing.AsyncIterator[list[torch.Tensor]], chunks)))
+            results.append(generated.popleft())
+      yield results
+
+
 # ###### Generate ECGs ######################################################
-def predict(numberOfECGs:         int = 1,
-            # ecgLengthInSeconds: int = 10,
+# This is a generator: the gallery is updated after each chunk of
+# StreamChunkSize ECGs, so the first images appear after a constant time,
+# regardless of the number of ECGs. The analysis of ECG #1 follows, when it
+# is ready.
+# The handlers are coroutines: they wait for the generation by the scheduler
+# and for the rendering, analysis and export worker processes, without
+# occupying a thread of Gradio.
+async def predict(numberOfECGs:         int = 1,
+            ecgLengthInSeconds:   int = 10,
             ecgTypeString:        str = 'ECG-12',
             generatorModel:       str = 'Default',
-            request:              gradio.Request = None) -> tuple[list[tuple[PIL.Image.Image,str]],matplotlib.figure.Figure]:
+            seed:                 float | None = None,
+            request:              gradio.Request = None) -> typing.AsyncIterator[GalleryUpdate]:
 
-   ecgLengthInSeconds = 10
+   ecgLengthInSeconds = max(1, min(int(ecgLengthInSeconds), maxECGLength))
 
    log(f'Session "{request.session_hash}": Generate EGCs!')
-
+   if Sessions.get(request.session_hash) is None:
+      # The session has expired, but generating starts from scratch anyway:
+      initializeSession(request)
 
    # ====== Set ECG type ====================================================
    ecgType = deepfakeecg.DATA_ECG12
@@ -127,152 +337,533 @@ def predict(numberOfECGs:         int = 1,
    else:
       sys.stderr.write(f'WARNING: Invalid ecgTypeString {ecgTypeString}, using ECG-12!\n')
 
-   # ====== Raise Locator.MAXTICKS, if necessary ============================
-   matplotlib.ticker.Locator.MAXTICKS = \
-       max(1000, ecgLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE)
-   # print(matplotlib.ticker.Locator.MAXTICKS)
-
-   # ====== Generate the ECGs ===============================================
-   Sessions[request.session_hash].Results = \
-      deepfakeecg.generateDeepfakeECGs(numberOfECGs,
-                                       ecgType            = ecgType,
-                                       ecgLengthInSeconds = ecgLengthInSeconds,
-                                       ecgScaleFactor     = deepfakeecg.ECG_DEFAULT_SCALE_FACTOR,
-                                       outputFormat       = deepfakeecg.OUTPUT_TENSOR,
-                                       showProgress       = False,
-                                       runOnDevice        = runOnDevice)
-   Sessions[request.session_hash].Type = ecgType
-
-   # ====== Create a list of image/label tuples for gradio.Gallery ==========
-   plotList  : list[tuple[PIL.Image.Image,str]] = [ ]
-   ecgNumber : int                              = 1
-   info      : Final[str]                       = '25 mm/sec, 1 mV/10 mm'
-   for result in Sessions[request.session_hash].Results:
-
-      # ====== Plot ECG =====================================================
-      # 1. Convert to NumPy
-      # 2. Remove the Timestamp column (0)
-      # 3. Convert from µV to mV
-      result = result.t().detach().cpu().numpy()[1:] / 1000
-      # print(result)
-
-      # ------ ECG-12 -------------------------------------------------------
-      if ecgType == deepfakeecg.DATA_ECG12:
-         ecg_plot.plot(result,
-                       title       = 'ECG-12 – ' + info,
-                       sample_rate = deepfakeecg.ECG_SAMPLING_RATE,
-                       lead_index  = [ 'I', 'II', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6', 'III', 'aVR', 'aVL', 'aVF' ],
-                       lead_order  = [0, 1, 8, 9, 10, 11, 2, 3, 4, 5, 6, 7],
-                       show_grid   = True)
-      # ------ ECG-8 --------------------------------------------------------
-      else:
-         ecg_plot.plot(result,
-                       title       = 'ECG-8 – ' + info,
-                       sample_rate = deepfakeecg.ECG_SAMPLING_RATE,
-                       lead_index  = [ 'I', 'II', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6' ],
-                       lead_order  = [0, 1, 2, 3, 4, 5, 6, 7],
-                       show_grid   = True)
-
-      # ====== Generate WebP output =========================================
-      imageBuffer = io.BytesIO()
-      plt.savefig(imageBuffer, format = 'webp')
-      plt.close()
-      image : PIL.Image.Image = PIL.Image.open(imageBuffer)
-      plotList.append( (image, f'ECG Number {ecgNumber}') )
-
-      ecgNumber = ecgNumber + 1
-
-   # ====== Prepare analysis results for first ECG ==========================
-   Sessions[request.session_hash].Analysis = \
-      plotAnalysis(Sessions[request.session_hash].Results[0])
-
-   return (plotList, Sessions[request.session_hash].Analysis)
-
-
-# ###### Plot the analysis ##################################################
-def plotAnalysis(data : torch.Tensor) -> matplotlib.figure.Figure:
-
-   data = data.t().detach().cpu().numpy()[1:] / 1000
-   leadI = data[0]
-
-   signals, info = neurokit2.ecg_process(leadI, sampling_rate = deepfakeecg.ECG_SAMPLING_RATE)
-   neurokit2.ecg_plot(signals, info)
-
-   # DIN A4 landscape: w=11.7, h=8.27
-   w = 508/25.4   # mm to inch
-   h = 122/25.4   # mm to inch
-   matplotlib.pyplot.gcf().set_size_inches(w, h, forward=True)
-
-   return matplotlib.pyplot.gcf()
+   # ====== Set generator model =============================================
+   if not generatorModel in modelpool.GeneratorModels:
+      sys.stderr.write(f'WARNING: Invalid generatorModel {generatorModel}, using Default!\n')
+      generatorModel = 'Default'
+
+   async with usingSession(request) as session:
+      async for update in generateECGs(session, numberOfECGs, ecgLengthInSeconds,
+                                       ecgType, generatorModel, seed):
+         yield update
+      await asyncio.to_thread(storeSession, session, True)
+
+
+# ###### Show the demo batch on page load ###################################
+# The demo batch is prepared once, by the warm-up, instead of generating a
+# new batch for every visitor.
+async def loadDemo(request: gradio.Request) -> typing.AsyncIterator[GalleryUpdate]:
+
+   if Sessions.get(request.session_hash) is None:
+      initializeSession(request)
+
+   try:
+      # Shielded, so that a client going away does not cancel the warm-up:
+      demo = await asyncio.shield(asyncio.wrap_future(Demo))
+   except Exception as error:
+      log(f'Session "{request.session_hash}": No demo batch ({error}), generating ECGs!')
+      async for update in predict(DemoNumberOfECGs, 10, 'ECG-12', 'Default', None, request):
+         yield update
+      return
+
+   log(f'Session "{request.session_hash}": Show demo batch!')
+   async with usingSession(request) as session:
+      async with session.Lock:
+         session.Analysis.clear()
+         await asyncio.to_thread(session.newBatch)
+         session.Selected  = 0
+         session.Results   = demo.Results
+         session.CacheKeys = demo.CacheKeys
+         with session.ImageLock:
+            session.Images.clear()
+      await asyncio.to_thread(storeSession, session, True)
+   yield (list(demo.Gallery), demo.Analyses[0].Figure, None, gradio.Slider(value = 0, visible = False))
+
+
+# ###### Get the analysis figure of the first ECG of a new batch ############
+# The analysis is cached. The figure is skipped, if the user has selected
+# another ECG in the meantime, so that this selection is not overwritten.
+def firstAnalysisFigure(session : Session,
+                        result  : analysis.AnalysisResult) -> analysis.Figure | dict[str,Any]:
+   session.Analysis.put(0, result)
+   figure : analysis.Figure | dict[str,Any] = result.Figure
+   if session.Selected != 0:
+      figure = gradio.skip()
+   return figure
+
+
+# ###### Generate ECGs for a session ########################################
+# Yields the gallery updates of predict(). Also used for the demo batch.
+# ECGs longer than modelpool.SegmentLengthInSeconds are generated as
+# segments, which are appended to results memory-mapped from the export
+# directory. The gallery is then updated whenever ECGs are complete.
+async def generateECGs(session:            Session,
+                       numberOfECGs:       int,
+                       ecgLengthInSeconds: int,
+                       ecgType:            int,
+                       generatorModel:     str,
+                       seed:               float | None) -> typing.AsyncIterator[GalleryUpdate]:
+
+   # ====== Check the total length ==========================================
+   if numberOfECGs * ecgLengthInSeconds > maxTotalLength:
+      log(f'Session "{session.ID}": Rejected, {numberOfECGs} ECGs of ' +
+          f'{ecgLengthInSeconds} s exceed the total length of {maxTotalLength} s')
+      raise gradio.Error(f'The total length of the ECGs is limited to {maxTotalLength} s. ' +
+                         'Please generate fewer or shorter ECGs!')
+
+   # The generator model is loaded once and kept resident in the model pool.
+   # It may still be loaded by the warm-up.
+   model = await asyncio.to_thread(Models.get, generatorModel, ecgType, runOnDevice)
+
+   # ====== Split long ECGs into segments ===================================
+   segments = 1
+   if ecgLengthInSeconds > modelpool.SegmentLengthInSeconds:
+      segments           = -(-ecgLengthInSeconds // modelpool.SegmentLengthInSeconds)
+      ecgLengthInSeconds = segments * modelpool.SegmentLengthInSeconds
+   segmentLengthInSeconds = ecgLengthInSeconds // segments
+
+   # ====== Check the disk budget for long ECGs =============================
+   # Long ECGs are written into the temporary directory, and copied into
+   # the session store, if there is one.
+   if (segments > 1) and (sessionDisk > 0):
+      neededBytes = ecgresults.resultsSize(ecgType, numberOfECGs,
+                                           ecgLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE,
+                                           compactResults)
+      if Store is not None:
+         neededBytes = 2 * neededBytes
+      if neededBytes > sessionDisk * 1048576:
+         log(f'Session "{session.ID}": Rejected, {neededBytes / 1048576:.1f} MiB of ' +
+             f'results exceed the session disk limit of {sessionDisk} MiB')
+         raise gradio.Error('The ECGs would need too much disk space. ' +
+                            'Please generate fewer or shorter ECGs!')
+
+   # ====== Look up the result cache ========================================
+   # With a seed, each ECG is generated from its own seed, derived from the
+   # seed and its index (see modelpool.ecgSeeds()). Then, it is reproducible
+   # and can be taken from the result cache. Long ECGs are not cached.
+   keys   : list[str] | None       = None
+   seeds  : list[int] | None       = None
+   cached : dict[int,torch.Tensor] = { }
+   if (seed is not None) and (segments > 1):
+      seeds = [ segmentSeed
+                for index in range(0, numberOfECGs)
+                for segmentSeed in modelpool.segmentSeeds(modelpool.ecgSeeds(int(seed), index, 1)[0],
+                                                          segments) ]
+   elif seed is not None:
+      keys = [ resultcache.cacheKey(generatorModel, runOnDevice, ecgType, ecgLengthInSeconds,
+                                    deepfakeecg.ECG_DEFAULT_SCALE_FACTOR, int(seed), index)
+               for index in range(0, numberOfECGs) ]
+      if Cache is not None:
+         signals = await asyncio.to_thread(lambda: [ Cache.getSignal(key) for key in keys ])
+         for index, signal in enumerate(signals):
+            if signal is not None:
+               cached[index] = signal
+      seeds = [ modelpool.ecgSeeds(int(seed), index, 1)[0]
+                for index in range(0, numberOfECGs) if not index in cached ]
+
+   # ====== Queue the generation job ========================================
+   # Only one generation per session at a time. The scheduler splits the
+   # job into chunks and interleaves them with the jobs of other sessions.
+   async with session.Lock:
+      job : scheduler.GenerationJob | None = None
+      if len(cached) < numberOfECGs:
+         try:
+            # Admission may block, until other jobs have made progress:
+            job = await asyncio.to_thread(Scheduler.submit,
+                                          session.ID, model,
+                                          (numberOfECGs - len(cached)) * segments,
+                                          ecgLengthInSeconds = segmentLengthInSeconds,
+                                          ecgScaleFactor     = deepfakeecg.ECG_DEFAULT_SCALE_FACTOR,
+                                          seeds              = seeds)
+         except scheduler.SchedulerBusy as error:
+            log(f'Session "{session.ID}": Rejected, scheduler busy ({error})')
+            raise gradio.Error('The server is busy. Please try again later!')
+
+      # The cached analyses belong to the previous results. Removing the
+      # files of the previous batch, creating the memory-mapped results file
+      # and appending to it may block on the disk, so they run in threads:
+      session.Analysis.clear()
+      await asyncio.to_thread(session.newBatch)
+      session.Selected = 0
+      session.Results  = await asyncio.to_thread(
+                           lambda: ecgresults.ECGResults(
+                              ecgType, numberOfECGs,
+                              ecgLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE,
+                              compactResults, deepfakeecg.ECG_DEFAULT_SCALE_FACTOR,
+                              fileName = session.exportDirectory() / 'Results.npy'
+                                            if segments > 1 else None))
+      session.CacheKeys = keys
+      with session.ImageLock:
+         session.Images.clear()
+
+      # The gallery shows the first page of long ECGs:
+      thumbnailLengthInSeconds = min(ecgLengthInSeconds, ecgresults.PageLengthInSeconds)
+
+      plotList      : list[tuple[PIL.Image.Image,str]]                        = [ ]
+      firstECG      : int                                                     = 0
+      firstAnalysis : concurrent.futures.Future[analysis.AnalysisResult] | None = None
+      try:
+         async for results in mergeCachedECGs(job, cached, numberOfECGs * segments):
+            await asyncio.to_thread(session.Results.append, results)
+            if len(session.Results) == firstECG:
+               continue   # Only segments of an ECG, which is not complete yet
+            indices = range(firstECG, len(session.Results))
+            if (keys is not None) and (Cache is not None):
+               for index, signal in zip(indices, results):
+                  if not index in cached:
+                     Cache.putSignal(keys[index], signal)
+
+            # ====== Create a list of image/label tuples for gradio.Gallery ====
+            # The results are stored as (leads, samples) arrays in mV:
+            ecgs = [ session.Results.page(index, 0) for index in indices ]
+
+            # The gallery only shows thumbnails, which are cheap to draw. The
+            # full-resolution image is rendered when an ECG is selected.
+            # Thumbnails of seeded ECGs may be in the result cache:
+            images : list[PIL.Image.Image | None] = [ None ] * len(indices)
+            if (keys is not None) and (Cache is not None):
+               images = await asyncio.to_thread(
+                           lambda: [ Cache.getImage(keys[index], 'thumbnail') for index in indices ])
+            missing   = [ i for i, image in enumerate(images) if image is None ]
+            startTime = time.monotonic()
+            rendered  = await Renderer.render([ ecgs[i] for i in missing ],
+                                              ecgType, thumbnailLengthInSeconds, asThumbnails = True)
+            Metrics.observe('rendering', time.monotonic() - startTime)
+            for i, renderedImage in zip(missing, rendered):
+               images[i] = renderedImage
+               if (keys is not None) and (Cache is not None):
+                  Cache.putImage(keys[firstECG + i], 'thumbnail', renderedImage)
+            for ecgNumber, image in enumerate(images, start = firstECG + 1):
+               plotList.append( (typing.cast(PIL.Image.Image, image), f'ECG Number {ecgNumber}') )
+
+            # ====== Analyse the first ECG, the others in the background ====
+            if firstECG == 0:
+               firstAnalysis = Analyzer.analyze(session.Results.lead(0, 0))
+            for index in range(max(1, firstECG), firstECG + len(indices)):
+               session.Analysis.prefetch(Analyzer, index, session.Results.lead(index, 0))
+
+            # ====== Send the thumbnails ====================================
+            # The first update clears the analysis, the selection and the
+            # position slider. The analysis of the first ECG is sent with a
+            # later update, when it is ready.
+            if firstECG == 0:
+               firstECG = len(indices)
+               yield (plotList, None, None, gradio.Slider(value = 0, visible = False))
+            else:
+               firstECG = firstECG + len(indices)
+               figure : analysis.Figure | dict[str,Any] = gradio.skip()
+               if (firstAnalysis is not None) and firstAnalysis.done():
+                  figure        = firstAnalysisFigure(session, firstAnalysis.result())
+                  firstAnalysis = None
+               yield (plotList, figure, gradio.skip(), gradio.skip())
+
+         # ====== Send the analysis of the first ECG, if not done yet =======
+         if firstAnalysis is not None:
+            result = await asyncio.wrap_future(firstAnalysis)
+            yield (gradio.skip(), firstAnalysisFigure(session, result),
+                   gradio.skip(), gradio.skip())
+
+      finally:
+         # Drop the remaining chunks, if the client has gone away:
+         if job is not None:
+            Scheduler.cancel(job)
+         Scheduler.report()
+         log(f'Session "{session.ID}": {len(session.Results)} ECGs ' +
+             f'({len(cached)} from cache), ' +
+             f'{session.Results.nbytes() / 1048576:.1f} MiB of results')
 
 
 # ###### Generic download ###################################################
-def download(request:      gradio.Request,
-             outputFormat: int) -> pathlib.Path | None:
-
-   if outputFormat == deepfakeecg.OUTPUT_CSV:
-      ecgResult = Sessions[request.session_hash].Results[Sessions[request.session_hash].Selected]
-      ecgType   = Sessions[request.session_hash].Type
-      fileName  = pathlib.Path(Sessions[request.session_hash].TempDirectory.name) / \
-                     ('ECG-' + str(Sessions[request.session_hash].Selected + 1) + '.csv')
-      deepfakeecg.dataToCSV(ecgResult, ecgType, fileName)
-
-      log(f'Session "{request.session_hash}": Download CSV file {fileName}')
-      return fileName
-
-   elif ( (outputFormat == deepfakeecg.OUTPUT_PDF) or
-          (outputFormat == deepfakeecg.OUTPUT_PDF_ANALYSIS) ):
-
-      ecgResult = Sessions[request.session_hash].Results[Sessions[request.session_hash].Selected]
-      ecgType   = Sessions[request.session_hash].Type
-      fileName  = pathlib.Path(Sessions[request.session_hash].TempDirectory.name) / \
-                     ('ECG-' + str(Sessions[request.session_hash].Selected + 1) + '.pdf')
-      if ecgType == deepfakeecg.DATA_ECG12:
-         outputLeads = [ 'I', 'II', 'III', 'aVL', 'aVR', 'aVF', 'V1', 'V2', 'V3', 'V4' , 'V5' , 'V6' ]
-      else:
-         outputLeads = [ 'I', 'II', 'V1', 'V2', 'V3', 'V4' , 'V5' , 'V6' ]
-
-      deepfakeecg.dataToPDF(ecgResult, ecgType, outputLeads, fileName, outputFormat,
-                            Sessions[request.session_hash].Selected + 1)
-
-      log(f'Session "{request.session_hash}": Download PDF file {fileName}')
+# The exported files are kept in the directory of the current batch, so
+# that repeated downloads reuse them. The files are written by the export
+# worker processes; the waiting for them is done in a thread. The paged PDF
+# of a long ECG gets the analysis shown in the GUI.
+async def download(request:      gradio.Request,
+                   outputFormat: int) -> pathlib.Path | None:
+
+   if outputFormat in export.FileSuffix:
+      async with usingSession(request) as session:
+         figure = None
+         if (outputFormat == deepfakeecg.OUTPUT_PDF_ANALYSIS) and (session.Results.pages() > 1):
+            figure = (await analysisResult(session, session.Selected)).Figure
+         fileName = await asyncio.to_thread(Exporter.exportSingle,
+                                            session.Results, session.Selected, outputFormat,
+                                            session.exportDirectory(), figure)
+      log(f'Session "{request.session_hash}": Download {export.FormatName[outputFormat]} file {fileName}')
       return fileName
 
    return None
 
 
 # ###### Download CSV #######################################################
-def downloadCSV(request: gradio.Request) -> pathlib.Path | None:
-   return download(request, deepfakeecg.OUTPUT_CSV)
+async def downloadCSV(request: gradio.Request) -> pathlib.Path | None:
+   return await download(request, deepfakeecg.OUTPUT_CSV)
 
 
 # ###### Download PDF #######################################################
-def downloadPDF(request: gradio.Request) -> pathlib.Path | None:
-   return download(request, deepfakeecg.OUTPUT_PDF)
+async def downloadPDF(request: gradio.Request) -> pathlib.Path | None:
+   return await download(request, deepfakeecg.OUTPUT_PDF)
 
 
 # ###### Download PDF #######################################################
-def downloadPDFwithAnalysis(request: gradio.Request) -> pathlib.Path | None:
-   return download(request, deepfakeecg.OUTPUT_PDF_ANALYSIS)
+async def downloadPDFwithAnalysis(request: gradio.Request) -> pathlib.Path | None:
+   return await download(request, deepfakeecg.OUTPUT_PDF_ANALYSIS)
+
+
+# ###### Download binary ####################################################
+async def downloadBinary(binaryFormat: str,
+                         request:      gradio.Request) -> pathlib.Path | None:
+
+   if not binaryFormat in export.availableBinaryFormats():
+      sys.stderr.write(f'WARNING: Invalid binaryFormat {binaryFormat}!\n')
+      return None
+
+   async with usingSession(request) as session:
+      fileName = await asyncio.to_thread(Exporter.exportBinary,
+                                         session.Results, binaryFormat,
+                                         session.exportDirectory(), session.Selected)
+   log(f'Session "{request.session_hash}": Download {binaryFormat} file {fileName}')
+   return fileName
+
+
+# ###### Download all ECGs ##################################################
+# The ZIP archives contain one file per ECG and output format. The multi-page
+# PDF has one ECG per page. The binary formats contain all ECGs in one file.
+DownloadAllFormats : Final[dict[str,list[int] | None]] = {
+   'CSV (ZIP)':               [ deepfakeecg.OUTPUT_CSV ],
+   'ECG PDF (ZIP)':           [ deepfakeecg.OUTPUT_PDF ],
+   'ECG+Analysis PDF (ZIP)':  [ deepfakeecg.OUTPUT_PDF_ANALYSIS ],
+   'CSV and ECG PDF (ZIP)':   [ deepfakeecg.OUTPUT_CSV, deepfakeecg.OUTPUT_PDF ],
+   'ECG PDF (multi-page)':    None
+}
 
+async def downloadAll(downloadFormat: str,
+                      request:        gradio.Request) -> pathlib.Path | None:
+
+   binaryFormats = export.availableBinaryFormats()
+   if ( (not downloadFormat in DownloadAllFormats) and
+        (not downloadFormat in binaryFormats) ):
+      sys.stderr.write(f'WARNING: Invalid downloadFormat {downloadFormat}!\n')
+      return None
+
+   # Wait for a running generation, to export the complete batch:
+   async with usingSession(request) as session, session.Lock:
+      if len(session.Results) == 0:
+         return None
+      outputFormats = DownloadAllFormats.get(downloadFormat)
+      if downloadFormat in binaryFormats:
+         fileName = await asyncio.to_thread(Exporter.exportBinary,
+                                            session.Results, downloadFormat,
+                                            session.exportDirectory())
+      elif outputFormats is None:
+         fileName = await asyncio.to_thread(Exporter.exportPDF,
+                                            session.Results, session.exportDirectory())
+      else:
+         fileName = await asyncio.to_thread(Exporter.exportZIP,
+                                            session.Results, outputFormats,
+                                            session.exportDirectory())
+
+   log(f'Session "{request.session_hash}": Download all ECGs as {fileName}')
+   return fileName
+
+
+# ###### Get the full-resolution image of an ECG ############################
+# It is rendered on demand, and kept for the ImageCacheSize most recently
+# selected ECGs (or pages of long ECGs) of the session. For seeded ECGs, it
+# is also stored in the result cache. Long ECGs are shown page by page, with
+# ecgresults.PageLengthInSeconds per page.
+async def fullImage(session: Session,
+                    index:   int,
+                    page:    int = 0) -> PIL.Image.Image:
+
+   with session.ImageLock:
+      image = session.Images.get( (index, page) )
+      if image is not None:
+         session.Images.move_to_end( (index, page) )
+         return image
+
+   # Long ECGs are not in the result cache:
+   key = session.CacheKeys[index] if session.CacheKeys is not None else None
+   if (key is not None) and (Cache is not None):
+      image = await asyncio.to_thread(Cache.getImage, key, 'plot')
+   if image is None:
+      ecg       = session.Results.page(index, page)
+      startTime = time.monotonic()
+      image = (await Renderer.render([ ecg ], session.Results.Type,
+                                     ecg.shape[1] // deepfakeecg.ECG_SAMPLING_RATE))[0]
+      Metrics.observe('full_rendering', time.monotonic() - startTime)
+      if (key is not None) and (Cache is not None):
+         Cache.putImage(key, 'plot', image)
+
+   with session.ImageLock:
+      session.Images[(index, page)] = image
+      while len(session.Images) > ImageCacheSize:
+         session.Images.popitem(last = False)
+   return image
+
+
+# ###### Get the analysis of an ECG #########################################
+# Looks up the analysis cache (or waits for the background analysis).
+async def analysisResult(session: Session,
+                         index:   int) -> analysis.AnalysisResult:
+
+   # The analyses of the demo batch are shared, not cached per session:
+   demo = demoBatch(session)
+   if demo is not None:
+      return demo.Analyses[index]
+
+   result = await session.Analysis.get(Analyzer, index)
+   if result is None:
+      result = await asyncio.wrap_future(Analyzer.analyze(session.Results.lead(index, 0)))
+      session.Analysis.put(index, result)
+   return result
 
-# ###### Analyze the selected ECG ###########################################
-def analyze(event:   gradio.SelectData,
-            request: gradio.Request) -> matplotlib.figure.Figure:
 
-   Sessions[request.session_hash].Selected = event.index
-   log(f'Session "{request.session_hash}": Analyze ECG #{Sessions[request.session_hash].Selected + 1}!')
+# ###### Analyze the selected ECG ###########################################
+# The full-resolution image and the analysis are prepared concurrently.
+# For long ECGs, the first page is shown, and the position slider is set up
+# to select the other pages.
+async def analyze(event:   gradio.SelectData,
+                  request: gradio.Request) -> tuple[PIL.Image.Image, analysis.Figure, Any]:
+
+   async with usingSession(request) as session:
+      session.Selected = event.index
+      log(f'Session "{request.session_hash}": Analyze ECG #{session.Selected + 1}!')
+      await asyncio.to_thread(storeSession, session, False)
+
+      image, result = await asyncio.gather(fullImage(session, session.Selected),
+                                           analysisResult(session, session.Selected))
+      pages = session.Results.pages()
+
+   # A slider with maximum 0 would be invalid, therefore it is only
+   # created for ECGs with several pages:
+   slider : Any = gradio.update(visible = False)
+   if pages > 1:
+      slider = gradio.Slider(maximum = (pages - 1) * ecgresults.PageLengthInSeconds,
+                             value   = 0,
+                             visible = True)
+   return (image, result.Figure, slider)
+
+
+# ###### Show another page of the selected ECG ##############################
+# position is the start of the page in seconds, from the position slider.
+async def showPage(position: float,
+                   request:  gradio.Request) -> PIL.Image.Image:
+
+   async with usingSession(request) as session:
+      page = max(0, min(int(position) // ecgresults.PageLengthInSeconds,
+                        session.Results.pages() - 1))
+      log(f'Session "{request.session_hash}": Show ECG #{session.Selected + 1} ' +
+          f'at {page * ecgresults.PageLengthInSeconds} s!')
+      return await fullImage(session, session.Selected, page)
+
+
+# ###### Prepare the demo batch #############################################
+# It is seeded, so that it is also taken from the result cache after a
+# restart.
+async def prepareDemo() -> DemoBatch:
+
+   session = Session('demo')
+   gallery : list[tuple[PIL.Image.Image,str]] = [ ]
+   async for update in generateECGs(session, DemoNumberOfECGs, 10,
+                                    deepfakeecg.DATA_ECG12, 'Default', DemoSeed):
+      if isinstance(update[0], list):
+         gallery = update[0]
+
+   # The session is not closed, since this would close the figures:
+   analyses = [ await analysisResult(session, index)
+                for index in range(0, len(session.Results)) ]
+   return DemoBatch(session.Results, session.CacheKeys, gallery, analyses)
+
+
+# ###### Warm up the services ###############################################
+# Runs in the background, so that the GUI is available immediately. The
+# handlers wait for the models and the demo batch, if necessary.
+def warmUp() -> None:
+
+   warmUpTimer = metrics.StartupTimer()
+   try:
+      Models.preload(runOnDevice)
+      warmUpTimer.phase('models')
+      Renderer.warmUp()
+      Analyzer.warmUp()
+      Exporter.warmUp()
+      importModule('matplotlib.pyplot')   # For analysis figures and paged PDFs
+      warmUpTimer.phase('workers')
+      Demo.set_result(asyncio.run(prepareDemo()))
+      warmUpTimer.phase('demo')
+   except Exception as error:
+      log(f'Warm-up failed: {error}')
+      Demo.set_exception(error)
+   warmUpTimer.report('Warm-up')
+
+
+# ###### Start the background services ######################################
+# Also used by benchmark.py, to drive the handlers without the GUI.
+def startServices() -> None:
+   global TempDirectory, Cache, Store
+
+   # ====== Prepare temporary directory =====================================
+   TempDirectory = tempfile.TemporaryDirectory(prefix = 'DeepFakeECGPlus-')
+   log(f'Prepared temporary directory {TempDirectory.name}')
 
-   data = Sessions[request.session_hash].Results[Sessions[request.session_hash].Selected]
-   if Sessions[request.session_hash].Analysis:
-      matplotlib.pyplot.close(Sessions[request.session_hash].Analysis)
-   Sessions[request.session_hash].Analysis = plotAnalysis(data)
-   return Sessions[request.session_hash].Analysis
+   # ====== Open the result cache ===========================================
+   if cacheSize > 0:
+      Cache = resultcache.ResultCache(pathlib.Path(cacheDirectory), cacheSize * 1048576)
+   Startup.phase('result_cache')
+
+   # ====== Open the session store ==========================================
+   if sessionStoreURL is not None:
+      Store = sessionstore.openSessionStore(sessionStoreURL, sessionTimeout)
+      Startup.phase('session_store')
+
+   # ====== Start the rendering, analysis and export worker processes =======
+   Renderer.start()
+   Analyzer.start()
+   Exporter.start()
+   Startup.phase('worker_processes')
+
+   # ====== Start the session manager and scheduler =========================
+   # The generator models are loaded by the warm-up, in the background.
+   Sessions.start()
+   Scheduler.start()
+
+   # ====== Register the metrics ============================================
+   # The metrics endpoint is served by the GUI, see gui.launch() below.
+   Metrics.gauge('active_sessions',            lambda: len(Sessions))
+   Metrics.gauge('session_memory_bytes',       Sessions.memoryUsage)
+   Metrics.gauge('session_disk_bytes',         Sessions.diskUsage)
+   Metrics.gauge('temporary_directory_bytes',  lambda: directorySize(TempDirectory.name))
+   Metrics.gauge('scheduler_queued_ecgs',      lambda: Scheduler.statistics()['queued_ecgs'])
+   Metrics.gauge('analysis_queued_ecgs',       lambda: Analyzer.Queued)
+   Metrics.gauge('result_cache_bytes',         lambda: Cache.Bytes if Cache is not None else 0)
+   if profileFile is not None:
+      Metrics.Profiler = metrics.Profiler()
+   Startup.phase('services')
+   Startup.report('Startup')
+
+   # ====== Warm up in the background =======================================
+   threading.Thread(target = warmUp, name = 'WarmUp', daemon = True).start()
+
+
+# ###### Stop the background services #######################################
+def stopServices() -> None:
+   if (Metrics.Profiler is not None) and (profileFile is not None):
+      Metrics.Profiler.dump(profileFile)
+   Sessions.shutdown()
+   Scheduler.shutdown()
+   if Cache is not None:
+      Cache.shutdown()
+   Analyzer.shutdown()
+   Exporter.shutdown()
+   Renderer.shutdown()
+   log(f'Cleaning up temporary directory {TempDirectory.name}')
+   TempDirectory.cleanup()
 
 
 # ###### Print usage and exit ###############################################
 def usage(exitCode : int = 0) -> str:
-   sys.stdout.write('Usage: ' + sys.argv[0] + ' [-d|--device cpu|cuda] [-v|--version]\n')
+   sys.stdout.write('Usage: ' + sys.argv[0] + ' [-d|--device cpu|cuda] [-w|--render-workers workers] [-a|--analysis-workers workers] [-e|--export-workers workers] [-j|--max-device-jobs jobs] [-i|--max-inflight-ecgs ecgs] [-b|--max-batch-size ecgs] [-t|--max-batch-wait ms] [-c|--compact-results] [-C|--cache-directory directory] [-S|--cache-size MiB] [-m|--metrics] [-p|--profile file] [-T|--session-timeout s] [-M|--session-memory MiB] [-D|--session-disk MiB] [-s|--session-store directory|redis://host[:port]] [-H|--host address] [-P|--port port] [-L|--max-length s] [-N|--max-total-length s] [-v|--version]\n')
    sys.exit(exitCode)
 
 
@@ -280,7 +871,27 @@ def usage(exitCode : int = 0) -> str:
 # ###### Main program #######################################################
 
 # ====== Initialise =========================================================
-runOnDevice: str = 'cuda' if torch.cuda.is_available() else 'cpu'
+runOnDevice:     str = 'cuda' if torch.cuda.is_available() else 'cpu'
+renderWorkers:   int = os.cpu_count() or 1
+analysisWorkers: int = 1
+exportWorkers:   int = os.cpu_count() or 1
+maxDeviceJobs:   int = 1
+maxInFlightECGs: int = 1000
+maxBatchSize:    int = 32
+maxBatchWait:    int = 5
+compactResults:  bool = False
+cacheDirectory:  str  = os.path.join(tempfile.gettempdir(), 'DeepFakeECGPlus-Cache')
+cacheSize:       int  = 1024
+metricsEnabled:  bool = False
+profileFile:     str | None = None
+sessionTimeout:  int  = 3600
+sessionMemory:   int  = 4096
+sessionDisk:     int  = 4096
+sessionStoreURL: str | None = None
+serverHost:      str | None = None
+serverPort:      int | None = None
+maxECGLength:    int  = 3600
+maxTotalLength:  int  = 14400
 css = r"""
 div {
    background-image: url("https://www.nntb.no/~dreibh/graphics/backgrounds/background-essen.png");
@@ -350,14 +961,74 @@ img.program-logo-image {
 try:
    options, args = getopt.gnu_getopt(
       sys.argv[1:],
-      'd:v',
+      'd:w:a:e:j:i:b:t:cC:S:mp:T:M:D:s:H:P:L:N:v',
       [
          'device=',
+         'render-workers=',
+         'analysis-workers=',
+         'export-workers=',
+         'max-device-jobs=',
+         'max-inflight-ecgs=',
+         'max-batch-size=',
+         'max-batch-wait=',
+         'compact-results',
+         'cache-directory=',
+         'cache-size=',
+         'metrics',
+         'profile=',
+         'session-timeout=',
+         'session-memory=',
+         'session-disk=',
+         'session-store=',
+         'host=',
+         'port=',
+         'max-length=',
+         'max-total-length=',
          'version'
       ])
    for option, optarg in options:
       if option in ( '-d', '--device' ):
          runOnDevice = optarg
+      elif option in ( '-w', '--render-workers' ):
+         renderWorkers = int(optarg)
+      elif option in ( '-a', '--analysis-workers' ):
+         analysisWorkers = int(optarg)
+      elif option in ( '-e', '--export-workers' ):
+         exportWorkers = int(optarg)
+      elif option in ( '-j', '--max-device-jobs' ):
+         maxDeviceJobs = int(optarg)
+      elif option in ( '-i', '--max-inflight-ecgs' ):
+         maxInFlightECGs = int(optarg)
+      elif option in ( '-b', '--max-batch-size' ):
+         maxBatchSize = int(optarg)
+      elif option in ( '-t', '--max-batch-wait' ):
+         maxBatchWait = int(optarg)
+      elif option in ( '-c', '--compact-results' ):
+         compactResults = True
+      elif option in ( '-C', '--cache-directory' ):
+         cacheDirectory = optarg
+      elif option in ( '-S', '--cache-size' ):
+         cacheSize = int(optarg)
+      elif option in ( '-m', '--metrics' ):
+         metricsEnabled = True
+      elif option in ( '-p', '--profile' ):
+         profileFile = optarg
+      elif option in ( '-T', '--session-timeout' ):
+         sessionTimeout = int(optarg)
+      elif option in ( '-M', '--session-memory' ):
+         sessionMemory = int(optarg)
+      elif option in ( '-D', '--session-disk' ):
+         sessionDisk = int(optarg)
+      elif option in ( '-s', '--session-store' ):
+         sessionStoreURL = optarg
+      elif option in ( '-H', '--host' ):
+         serverHost = optarg
+      elif option in ( '-P', '--port' ):
+         serverPort = int(optarg)
+      elif option in ( '-L', '--max-length' ):
+         maxECGLength = int(optarg)
+      elif option in ( '-N', '--max-total-length' ):
+         maxTotalLength = int(optarg)
       elif option in ( '-v', '--version' ):
          sys.stdout.write('PyTorch version: ' + torch.__version__ + '\n')
          sys.stdout.write('CUDA version:    ' + torch.version.cuda + '\n')
@@ -371,9 +1042,23 @@ try:
 except getopt.GetoptError as error:
    sys.stderr.write('ERROR: ' + str(error) + '\n')
    usage(1)
+except ValueError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
 if len(args) > 0:
    usage(1)
 
+Renderer  : renderer.RenderPool      = renderer.RenderPool(renderWorkers)
+Analyzer  : analysis.AnalysisWorkers = analysis.AnalysisWorkers(analysisWorkers)
+Exporter  : export.ExportPool        = export.ExportPool(exportWorkers)
+Scheduler : scheduler.Scheduler      = scheduler.Scheduler(StreamChunkSize, maxDeviceJobs, maxInFlightECGs,
+                                                          maxBatchSize, maxBatchWait / 1000.0)
+Sessions  : sessionmanager.SessionManager[Session] = \
+   sessionmanager.SessionManager(sessionTimeout,
+                                 sessionMemory * 1048576, sessionDisk * 1048576)
+Demo      : concurrent.futures.Future[DemoBatch] = concurrent.futures.Future()
+Startup.phase('options')
+
 
 # ====== Create GUI =========================================================
 with gradio.Blocks(css               = css,
@@ -384,7 +1069,7 @@ with gradio.Blocks(css               = css,
 
    # ====== Session handling ================================================
    # Session initialization, to be called when page is loaded
-   gui.load(initializeSession)
+   gui.load(initializeSession, concurrency_limit = None)
    # Session clean-up, to be called when page is closed/refreshed
    gui.unload(cleanUpSession)
 
@@ -405,10 +1090,12 @@ with gradio.Blocks(css               = css,
    # gradio.Markdown('## Settings')
 
    with gradio.Row(height = '10vh', min_height = '10vh', max_height = '10vh'):
-      sliderNumberOfECGs     = gradio.Slider(1, 100, label="Number of ECGs", step = 1, value = 4, interactive = True)
-      # sliderLengthInSeconds = gradio.Slider(5, 60, label="Length (s)", step = 5, value = 10, interactive = True)
+      sliderNumberOfECGs     = gradio.Slider(1, 100, label="Number of ECGs", step = 1, value = DemoNumberOfECGs, interactive = True)
+      sliderLengthInSeconds  = gradio.Slider(10, max(10, maxECGLength), label="Length (s)", step = 10, value = 10, interactive = True,
+                                             info = f'Number × length: at most {maxTotalLength} s')
       dropdownType           = gradio.Dropdown( [ 'ECG-12', 'ECG-8' ], label = 'ECG Type', interactive = True)
-      dropdownGeneratorModel = gradio.Dropdown( [ 'Default' ], label = 'Generator Model', interactive = True)
+      dropdownGeneratorModel = gradio.Dropdown(list(modelpool.GeneratorModels.keys()), label = 'Generator Model', interactive = True)
+      numberSeed             = gradio.Number(label = 'Seed (optional)', value = None, precision = 0, minimum = 0, interactive = True)
       with gradio.Column():
          buttonGenerate = gradio.Button("Generate ECGs!")
          # buttonAnalyze  = gradio.Button("Analyze this ECG!")
@@ -419,6 +1106,14 @@ with gradio.Blocks(css               = css,
             buttonPDF_hidden = gradio.DownloadButton(visible=False, elem_id="download_pdf_hidden")
             buttonPDFwAnalysis = gradio.DownloadButton("Download ECG+Analysis PDF")
             buttonPDFwAnalysis_hidden = gradio.DownloadButton(visible=False, elem_id="download_pdfwanalysis_hidden")
+         with gradio.Row():
+            dropdownBinary = gradio.Dropdown(export.availableBinaryFormats(), show_label = False, interactive = True)
+            buttonBinary = gradio.DownloadButton("Download Binary")
+            buttonBinary_hidden = gradio.DownloadButton(visible=False, elem_id="download_binary_hidden")
+            dropdownDownloadAll = gradio.Dropdown(list(DownloadAllFormats.keys()) + export.availableBinaryFormats(),
+                                                  show_label = False, interactive = True)
+            buttonDownloadAll = gradio.DownloadButton("Download All ECGs")
+            buttonDownloadAll_hidden = gradio.DownloadButton(visible=False, elem_id="download_all_hidden")
 
    # gradio.Markdown('## Output')
 
@@ -433,63 +1128,101 @@ with gradio.Blocks(css               = css,
                                      preview       = False
                                     )
 
+   with gradio.Row():
+      selectedImage = gradio.Image(label = 'Selected ECG', type = 'pil', interactive = False)
+
+   with gradio.Row():
+      # The maximum is set for the selected ECG by analyze():
+      sliderPosition = gradio.Slider(0, max(maxECGLength, 2 * ecgresults.PageLengthInSeconds),
+                                     label = 'Position (s)', step = ecgresults.PageLengthInSeconds,
+                                     value = 0, interactive = True, visible = False)
+
    with gradio.Row(): # height = '24vh', min_height = '24vh', max_height = '24vh'):
       analysisOutput = gradio.Plot(label = 'Analysis')
 
    # ====== Add click event handling for "Generate" button ==================
    buttonGenerate.click(predict,
                         inputs  = [ sliderNumberOfECGs,
-                                    # sliderLengthInSeconds,
+                                    sliderLengthInSeconds,
                                     dropdownType,
-                                    dropdownGeneratorModel ],
-                        outputs = [ outputGallery, analysisOutput ]
+                                    dropdownGeneratorModel,
+                                    numberSeed ],
+                        outputs = [ outputGallery, analysisOutput, selectedImage, sliderPosition ],
+                        # Admission control is done by the scheduler:
+                        concurrency_limit = None
                      )
 
    # ====== Add click event handling for "Analyze" button ===================
    outputGallery.select(analyze,
                         inputs  = [ ],
-                        outputs = [ analysisOutput ]
+                        outputs = [ selectedImage, analysisOutput, sliderPosition ],
+                        # The handler does not occupy a thread while waiting:
+                        concurrency_limit = None
                        )
 
+   # ====== Add event handling for the position slider ======================
+   sliderPosition.release(showPage,
+                          inputs  = [ sliderPosition ],
+                          outputs = [ selectedImage ],
+                          concurrency_limit = None
+                         )
+
    # ====== Add click event handling for download buttons ===================
    # Using hidden button and JavaScript, to generate download file on-the-fly:
    # https://github.com/gradio-app/gradio/issues/9230#issuecomment-2323771634
    buttonCSV.click(fn      = downloadCSV,
                    inputs  = None,
-                   outputs = [ buttonCSV_hidden ]).then(
+                   outputs = [ buttonCSV_hidden ],
+                   concurrency_limit = None).then(
                       fn = None, inputs = None, outputs = None,
                       js = "() => document.querySelector('#download_csv_hidden').click()")
    buttonPDF.click(fn      = downloadPDF,
                    inputs  = None,
-                   outputs = [ buttonPDF_hidden ]).then(
+                   outputs = [ buttonPDF_hidden ],
+                   concurrency_limit = None).then(
                       fn = None, inputs = None, outputs = None,
                       js = "() => document.querySelector('#download_pdf_hidden').click()")
    buttonPDFwAnalysis.click(fn      = downloadPDFwithAnalysis,
                             inputs  = None,
-                            outputs = [ buttonPDFwAnalysis_hidden ]).then(
+                            outputs = [ buttonPDFwAnalysis_hidden ],
+                            concurrency_limit = None).then(
                                fn = None, inputs = None, outputs = None,
                                js = "() => document.querySelector('#download_pdfwanalysis_hidden').click()")
+   buttonBinary.click(fn      = downloadBinary,
+                      inputs  = [ dropdownBinary ],
+                      outputs = [ buttonBinary_hidden ],
+                      concurrency_limit = None).then(
+                         fn = None, inputs = None, outputs = None,
+                         js = "() => document.querySelector('#download_binary_hidden').click()")
+   buttonDownloadAll.click(fn      = downloadAll,
+                           inputs  = [ dropdownDownloadAll ],
+                           outputs = [ buttonDownloadAll_hidden ],
+                           concurrency_limit = None).then(
+                              fn = None, inputs = None, outputs = None,
+                              js = "() => document.querySelector('#download_all_hidden').click()")
 
    # ====== Run on startup ==================================================
-   gui.load(predict,
-            inputs  = [ sliderNumberOfECGs,
-                        # sliderLengthInSeconds,
-                        dropdownType,
-                        dropdownGeneratorModel ],
-            outputs = [ outputGallery, analysisOutput ]
+   gui.load(loadDemo,
+            inputs  = [ ],
+            outputs = [ outputGallery, analysisOutput, selectedImage, sliderPosition ],
+            concurrency_limit = None
            )
 
+Startup.phase('gui')
+
+
 # ====== Run the GUI ========================================================
 if __name__ == "__main__":
 
-   # ------ Prepare temporary directory -------------------------------------
-   TempDirectory = tempfile.TemporaryDirectory(prefix = 'DeepFakeECGPlus-')
-   log(f'Prepared temporary directory {TempDirectory.name}')
+   # ------ Start the background services -----------------------------------
+   startServices()
 
    # ------ Run the GUI, with downloads from temporary directory allowed ----
-   gui.launch(allowed_paths = [ TempDirectory.name ], debug = True)
+   # The metrics endpoint is added to the FastAPI application of the GUI.
+   gui.launch(allowed_paths = [ TempDirectory.name ], debug = True,
+              server_name = serverHost, server_port = serverPort,
+              app_kwargs = { 'routes': [ metrics.metricsRoute() ] } if metricsEnabled else None)
 
    # ------ Clean up --------------------------------------------------------
-   log(f'Cleaning up temporary directory {TempDirectory.name}')
-   TempDirectory.cleanup()
+   stopServices()
    log('Done!')
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import asyncio
+import collections
+import deepfakeecg
+import getopt
+import importlib
+import json
+import modelpool
+import neurokit2
+import renderer
+import resource
+import scheduler
+import sys
+import threading
+import time
+import torch
+import types
+import typing
+
+from typing import Any
+from utilities import log
+
+
+# ###### Get percentiles of a list of durations #############################
+def percentiles(values : list[float]) -> dict[str,float]:
+   values = sorted(values)
+   return {
+      'p50':  values[len(values) // 2],
+      'p90':  values[(len(values) * 90) // 100],
+      'p99':  values[(len(values) * 99) // 100],
+      'mean': sum(values) / len(values)
+   }
+
+
+# ###### Get the peak resident set size in MiB ##############################
+# The rendering worker processes are accounted as children.
+def peakRSS() -> dict[str,float]:
+   return {
+      'self':     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+      'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+   }
+
+
+# ###### Benchmark the generation throughput for one batch size #############
+# clients threads submit requests of ecgsPerRequest ECGs each, one after
+# the other, like concurrent GUI sessions clicking "Generate ECGs!".
+def benchmarkBatching(model          : modelpool.GeneratorModel,
+                      maxBatchSize   : int,
+                      maxBatchWait   : float,
+                      clients        : int,
+                      requests       : int,
+                      ecgsPerRequest : int) -> dict[str,Any]:
+
+   generationScheduler = scheduler.Scheduler(chunkSize       = ecgsPerRequest,
+                                             maxInFlightECGs = clients * ecgsPerRequest,
+                                             maxBatchSize    = maxBatchSize,
+                                             maxBatchWait    = maxBatchWait)
+   generationScheduler.start()
+
+   latencies : list[float] = [ ]
+   lock = threading.Lock()
+
+   # ====== Client thread ===================================================
+   def client(clientID : int) -> None:
+      for request in range(0, requests):
+         startTime = time.monotonic()
+         job = generationScheduler.submit(f'client-{clientID}', model, ecgsPerRequest,
+                                          ecgLengthInSeconds = 10,
+                                          ecgScaleFactor     = 6000)
+         for results in job:
+            pass
+         with lock:
+            latencies.append(time.monotonic() - startTime)
+
+   # ====== Run the clients =================================================
+   startTime = time.monotonic()
+   threads   = [ threading.Thread(target = client, args = (i, )) for i in range(0, clients) ]
+   for thread in threads:
+      thread.start()
+   for thread in threads:
+      thread.join()
+   duration = time.monotonic() - startTime
+   statistics = generationScheduler.statistics()
+   generationScheduler.shutdown()
+
+   latencies.sort()
+   return {
+      'max_batch_size':   maxBatchSize,
+      'mean_batch_size':  statistics['batch_size'],
+      'ecgs_per_second':  clients * requests * ecgsPerRequest / duration,
+      'latency_p50':      latencies[len(latencies) // 2],
+      'latency_p99':      latencies[(len(latencies) * 99) // 100]
+   }
+
+
+# ###### Fake gradio.Request and gradio.SelectData ##########################
+# The handlers of app.py only use these attributes.
+class FakeRequest:
+   def __init__(self, sessionHash : str) -> None:
+      self.session_hash = sessionHash
+
+class FakeSelectData:
+   def __init__(self, index : int) -> None:
+      self.index = index
+
+
+# ###### Benchmark the pipeline for one configuration #######################
+# The handlers of app.py are called like by the GUI: predict() (the time
+# until the first gallery update, and until all ECGs are done), analyze()
+# of the last ECG (with full-resolution rendering, then cached) and the
+# downloads. The stages inside the handlers are also timed separately, on
+# the last ECG.
+async def benchmarkPipeline(app           : types.ModuleType,
+                            ecgTypeString : str,
+                            numberOfECGs  : int,
+                            threads       : int,
+                            requests      : int) -> dict[str,Any]:
+
+   torch.set_num_threads(threads)
+   ecgType = deepfakeecg.DATA_ECG12 if ecgTypeString == 'ECG-12' else deepfakeecg.DATA_ECG8
+   model   = app.Models.get('Default', ecgType, app.runOnDevice)
+   request = FakeRequest(f'benchmark-{ecgTypeString}-{numberOfECGs}-{threads}')
+   select  = FakeSelectData(numberOfECGs - 1)
+   app.initializeSession(request)
+   session = app.Sessions.get(request.session_hash)
+
+   stages : collections.defaultdict[str,list[float]] = collections.defaultdict(list)
+
+   # ====== Run a function (or handler coroutine), and record its duration ====
+   async def measure(stage : str, function : typing.Callable[..., Any], *args : Any) -> Any:
+      startTime = time.monotonic()
+      result    = function(*args)
+      if asyncio.iscoroutine(result):
+         result = await result
+      stages[stage].append(time.monotonic() - startTime)
+      return result
+
+   for iteration in range(0, requests):
+      # ====== Handlers =====================================================
+      startTime = time.monotonic()
+      async for update in app.predict(numberOfECGs, 10, ecgTypeString, 'Default', None, request):
+         if len(stages['predict_first_update']) <= iteration:
+            stages['predict_first_update'].append(time.monotonic() - startTime)
+      stages['predict'].append(time.monotonic() - startTime)
+
+      session.Analysis.clear()
+      session.Images.clear()
+      await measure('analyze',              app.analyze, select, request)
+      await measure('analyze_cached',       app.analyze, select, request)
+      await measure('download_csv',         app.downloadCSV, request)
+      await measure('download_pdf',         app.downloadPDF, request)
+      await measure('download_pdf_analysis', app.downloadPDFwithAnalysis, request)
+
+      # ====== Stages =======================================================
+      data = session.Results.ecg(numberOfECGs - 1)
+      await measure('inference', model.generate, numberOfECGs)
+      with renderer.PyplotLock:
+         await measure('ecg_plot',      renderer.plotECG, data, ecgType, 10)
+         await measure('webp_encoding', renderer.encodeFigure)
+      await measure('thumbnail',   renderer.renderThumbnail, data, ecgType, 10)
+      await measure('ecg_process', lambda: neurokit2.ecg_process(
+                                      data[0], sampling_rate = deepfakeecg.ECG_SAMPLING_RATE))
+
+   app.cleanUpSession(request)
+
+   return {
+      'ecg_type':        ecgTypeString,
+      'ecgs':            numberOfECGs,
+      'threads':         threads,
+      'ecgs_per_second': numberOfECGs * requests / sum(stages['predict']),
+      'stages':          { stage: percentiles(durations)
+                           for stage, durations in stages.items() },
+      'peak_rss_mib':    peakRSS()
+   }
+
+
+# ###### Print usage and exit ###############################################
+def usage(exitCode : int = 0) -> typing.NoReturn:
+   sys.stdout.write('Usage: ' + sys.argv[0] +
+                    ' [-m|--mode batching|pipeline]' +
+                    ' [-d|--device cpu|cuda] [-T|--ecg-types ECG-12,ECG-8]' +
+                    ' [-n|--ecgs ecgs,...] [-r|--requests requests]' +
+                    ' [-c|--clients clients] [-b|--batch-sizes size,...] [-t|--max-batch-wait ms]' +
+                    ' [-p|--threads threads,...] [-w|--render-workers workers]' +
+                    ' [-o|--output file]\n')
+   sys.exit(exitCode)
+
+
+
+# ###### Main program #######################################################
+
+# ====== Initialise =========================================================
+mode:           str        = 'batching'
+runOnDevice:    str        = 'cuda' if torch.cuda.is_available() else 'cpu'
+ecgTypeStrings: list[str]  = [ 'ECG-12' ]
+clients:        int        = 8
+requests:       int        = 4
+ecgCounts:      list[int]  = [ 1 ]
+batchSizes:     list[int]  = [ 1, 2, 4, 8, 16, 32 ]
+maxBatchWait:   int        = 5
+threadCounts:   list[int]  = [ torch.get_num_threads() ]
+renderWorkers:  int | None = None
+outputFile:     str | None = None
+
+# ====== Check arguments ====================================================
+try:
+   options, args = getopt.gnu_getopt(
+      sys.argv[1:],
+      'm:d:T:c:r:n:b:t:p:w:o:',
+      [
+         'mode=',
+         'device=',
+         'ecg-types=',
+         'clients=',
+         'requests=',
+         'ecgs=',
+         'batch-sizes=',
+         'max-batch-wait=',
+         'threads=',
+         'render-workers=',
+         'output='
+      ])
+   for option, optarg in options:
+      if option in ( '-m', '--mode' ):
+         mode = optarg
+      elif option in ( '-d', '--device' ):
+         runOnDevice = optarg
+      elif option in ( '-T', '--ecg-types' ):
+         ecgTypeStrings = optarg.split(',')
+      elif option in ( '-c', '--clients' ):
+         clients = int(optarg)
+      elif option in ( '-r', '--requests' ):
+         requests = int(optarg)
+      elif option in ( '-n', '--ecgs' ):
+         ecgCounts = [ int(ecgs) for ecgs in optarg.split(',') ]
+      elif option in ( '-b', '--batch-sizes' ):
+         batchSizes = [ int(size) for size in optarg.split(',') ]
+      elif option in ( '-t', '--max-batch-wait' ):
+         maxBatchWait = int(optarg)
+      elif option in ( '-p', '--threads' ):
+         threadCounts = [ int(threads) for threads in optarg.split(',') ]
+      elif option in ( '-w', '--render-workers' ):
+         renderWorkers = int(optarg)
+      elif option in ( '-o', '--output' ):
+         outputFile = optarg
+      else:
+         sys.stderr.write('ERROR: Invalid option ' + option + '!\n')
+         sys.exit(1)
+
+except getopt.GetoptError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
+except ValueError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
+if ( (len(args) > 0) or
+     (not mode in ( 'batching', 'pipeline' )) or
+     (not set(ecgTypeStrings) <= { 'ECG-12', 'ECG-8' }) or
+     (min(ecgCounts) < 1) ):
+   usage(1)
+
+results : list[dict[str,Any]] = [ ]
+
+# ====== Run the batching benchmark =========================================
+if mode == 'batching':
+   sys.stdout.write('ECG Type  ECGs  Max. Batch  Mean Batch   ECGs/s   Latency p50   Latency p99\n')
+   for ecgTypeString in ecgTypeStrings:
+      ecgType = deepfakeecg.DATA_ECG12 if ecgTypeString == 'ECG-12' else deepfakeecg.DATA_ECG8
+      model   = modelpool.ModelPool().get('Default', ecgType, runOnDevice)
+      model.generate(1)   # Warm-up
+
+      for ecgsPerRequest in ecgCounts:
+         for maxBatchSize in batchSizes:
+            result = benchmarkBatching(model, maxBatchSize, maxBatchWait / 1000.0,
+                                       clients, requests, ecgsPerRequest)
+            result = { 'ecg_type': ecgTypeString, 'ecgs': ecgsPerRequest } | result
+            results.append(result)
+            sys.stdout.write(f'{ecgTypeString:8s} {ecgsPerRequest:5d}' +
+                             f'  {result["max_batch_size"]:10d}  {result["mean_batch_size"]:10.1f}' +
+                             f' {result["ecgs_per_second"]:8.2f}' +
+                             f'  {result["latency_p50"]:10.3f} s  {result["latency_p99"]:10.3f} s\n')
+
+# ====== Run the pipeline benchmark =========================================
+else:
+   # app.py parses its options on import. The GUI is only launched when
+   # it is run as main program, so the handlers can be called directly.
+   sys.argv = [ 'app.py', '--device', runOnDevice ]
+   if renderWorkers is not None:
+      sys.argv += [ '--render-workers', str(renderWorkers) ]
+   app = importlib.import_module('app')
+   app.startServices()
+   # Do not measure the background warm-up:
+   app.Demo.exception()
+
+   sys.stdout.write('ECG Type  ECGs Threads   ECGs/s   First Update   Analysis     Peak RSS\n')
+   for ecgTypeString in ecgTypeStrings:
+      for numberOfECGs in ecgCounts:
+         for threads in threadCounts:
+            result = asyncio.run(benchmarkPipeline(app, ecgTypeString, numberOfECGs,
+                                                   threads, requests))
+            results.append(result)
+            sys.stdout.write(f'{ecgTypeString:8s} {numberOfECGs:5d} {threads:7d}' +
+                             f' {result["ecgs_per_second"]:8.2f}' +
+                             f'  {result["stages"]["predict_first_update"]["p50"]:11.3f} s' +
+                             f' {result["stages"]["analyze"]["p50"]:8.3f} s' +
+                             f' {result["peak_rss_mib"]["self"]:8.1f} MiB\n')
+
+   app.stopServices()
+
+# ====== Write the results ==================================================
+if outputFile is not None:
+   with open(outputFile, 'w', encoding = 'utf-8') as output:
+      json.dump({ 'mode':      mode,
+                  'device':    runOnDevice,
+                  'clients':   clients,
+                  'requests':  requests,
+                  'results':   results }, output, indent = 3)
+   log(f'Wrote results to {outputFile}')
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import deepfakeecg
+import numpy
+import numpy.lib.format
+import pathlib
+import torch
+import typing
+
+from typing import Final
+
+
+# Length of the pages (windows) in which long ECGs are shown and exported:
+PageLengthInSeconds : Final[int] = 10
+
+
+# ###### Get the size of results in bytes ###################################
+def resultsSize(ecgType      : int,
+                numberOfECGs : int,
+                samples      : int,
+                compact      : bool = False) -> int:
+   leads = 12 if ecgType == deepfakeecg.DATA_ECG12 else 8
+   return numberOfECGs * leads * samples * (2 if compact else 4)
+
+
+# ###### Generated ECGs of a session ########################################
+# The ECGs are stored once, in one contiguous (ECGs, leads, samples) array,
+# without the timestamp column (it is implied by the sampling rate):
+# * float32 in mV (default): ecg() returns views, without any copy.
+# * int16 in µV (compact):   half of the memory; ecg() converts to mV.
+# With data, the ECGs are taken from an existing array (e.g. memory-mapped
+# from a file), and numberOfECGs and samples are ignored. With fileName, the
+# array is memory-mapped from a new .npy file, so that long ECGs do not
+# have to be kept in memory.
+class ECGResults:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                ecgType      : int,
+                numberOfECGs : int,
+                samples      : int,
+                compact      : bool = False,
+                scaleFactor  : int  = deepfakeecg.ECG_DEFAULT_SCALE_FACTOR,
+                data         : numpy.ndarray | None = None,
+                fileName     : pathlib.Path | None  = None) -> None:
+      self.Type        : Final[int]  = ecgType
+      self.Compact     : Final[bool] = compact
+      self.ScaleFactor : Final[int]  = scaleFactor
+      self.Count       : int         = 0
+      self.Offset      : int         = 0   # Samples of ECG #Count appended
+      if data is None:
+         leads = 12 if ecgType == deepfakeecg.DATA_ECG12 else 8
+         shape = (numberOfECGs, leads, samples)
+         dtype = numpy.int16 if compact else numpy.float32
+         if fileName is not None:
+            data = numpy.lib.format.open_memmap(fileName, mode = 'w+',
+                                                dtype = dtype, shape = shape)
+         else:
+            data = numpy.empty(shape, dtype = dtype)
+      else:
+         self.Count = data.shape[0]
+      self.Data        : Final[numpy.ndarray] = data
+
+   # ###### Number of ECGs ##################################################
+   def __len__(self) -> int:
+      return self.Count
+
+   # ###### Size of the results in bytes ####################################
+   def nbytes(self) -> int:
+      return self.Data.nbytes
+
+   # ###### Memory usage in bytes ###########################################
+   # Memory-mapped results are in the page cache, which the kernel may
+   # reclaim, and are not counted.
+   def memoryBytes(self) -> int:
+      return 0 if isinstance(self.Data, numpy.memmap) else self.Data.nbytes
+
+   # ###### Length of the ECGs ##############################################
+   def lengthInSeconds(self) -> int:
+      return int(self.Data.shape[2] // deepfakeecg.ECG_SAMPLING_RATE)
+
+   # ###### Number of pages of PageLengthInSeconds per ECG ##################
+   def pages(self) -> int:
+      return max(1, -(-self.lengthInSeconds() // PageLengthInSeconds))
+
+   # ###### Append generator output #########################################
+   # The tensors have the layout of deepfakeecg.generateDeepfakeECGs() with
+   # OUTPUT_TENSOR: (samples, 1 + leads), timestamp in ms, leads in µV.
+   # They may also be consecutive segments of the ECGs, which are appended
+   # until an ECG is complete.
+   def append(self, results : list[torch.Tensor]) -> None:
+      for result in results:
+         leads = result[:, 1:].t().cpu().numpy()
+         start = self.Offset
+         stop  = min(start + leads.shape[1], self.Data.shape[2])
+         if self.Compact:
+            self.Data[self.Count, :, start:stop] = leads[:, 0:stop - start]
+         else:
+            numpy.multiply(leads[:, 0:stop - start], 0.001,
+                           out = self.Data[self.Count, :, start:stop], casting = 'unsafe')
+         if stop < self.Data.shape[2]:
+            self.Offset = stop
+         else:
+            self.Offset = 0
+            self.Count  = self.Count + 1
+
+   # ###### Get an ECG as (leads, samples) array in mV ######################
+   # With start and stop, only these samples of the ECG are returned.
+   def ecg(self,
+           index : int,
+           start : int = 0,
+           stop  : int | None = None) -> numpy.ndarray:
+      if index >= self.Count:
+         raise IndexError(f'ECG index {index} out of range')
+      ecg : numpy.ndarray
+      if self.Compact:
+         ecg = self.Data[index, :, start:stop] * numpy.float32(0.001)
+      else:
+         ecg = self.Data[index, :, start:stop]
+      return ecg
+
+   # ###### Get one page of an ECG as (leads, samples) array in mV ##########
+   def page(self, index : int, page : int) -> numpy.ndarray:
+      samples = PageLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE
+      return self.ecg(index, page * samples, (page + 1) * samples)
+
+   # ###### Iterate over the pages of an ECG ################################
+   # Only one page at a time is read from memory-mapped results.
+   def iteratePages(self, index : int) -> typing.Iterator[numpy.ndarray]:
+      for page in range(0, self.pages()):
+         yield self.page(index, page)
+
+   # ###### Get one lead of an ECG as array in mV ###########################
+   # The lead is copied, so that it can be passed to a worker process
+   # without the rest of the results.
+   def lead(self, index : int, lead : int) -> numpy.ndarray:
+      if index >= self.Count:
+         raise IndexError(f'ECG index {index} out of range')
+      signal : numpy.ndarray
+      if self.Compact:
+         signal = self.Data[index, lead] * numpy.float32(0.001)
+      else:
+         signal = numpy.array(self.Data[index, lead])
+      return signal
+
+   # ###### Get an ECG in the deepfakeecg tensor layout #####################
+   # Needed for deepfakeecg.dataToCSV() and deepfakeecg.dataToPDF(). With
+   # start and stop, only these samples of the ECG are returned, with their
+   # timestamps within the ECG.
+   def tensor(self,
+              index : int,
+              start : int = 0,
+              stop  : int | None = None) -> torch.Tensor:
+      if index >= self.Count:
+         raise IndexError(f'ECG index {index} out of range')
+      start, stop, _ = slice(start, stop).indices(self.Data.shape[2])
+      timestamps = numpy.arange(start, stop, dtype = numpy.int32) * \
+                      (1000 // deepfakeecg.ECG_SAMPLING_RATE)
+      if self.Compact:
+         leads = self.Data[index, :, start:stop].astype(numpy.int32)
+      else:
+         leads = numpy.rint(self.Data[index, :, start:stop] * 1000).astype(numpy.int32)
+      return torch.from_numpy(numpy.vstack( (timestamps, leads) ).T.copy())
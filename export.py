@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import analysis
+import collections
+import concurrent.futures
+import deepfakeecg
+import ecgresults
+import importlib.util
+import io
+import itertools
+import json
+import numpy
+import os
+import pathlib
+import renderer
+import threading
+import time
+import torch
+import typing
+import zipfile
+
+from metrics import Metrics
+from typing import Any, Final
+from utilities import importModule, log, startWorkerPool, waitForWorkerPool
+
+
+# ====== Leads in the PDF output ============================================
+OutputLeads : Final[dict[int,list[str]]] = {
+   deepfakeecg.DATA_ECG12: [ 'I', 'II', 'III', 'aVL', 'aVR', 'aVF', 'V1', 'V2', 'V3', 'V4' , 'V5' , 'V6' ],
+   deepfakeecg.DATA_ECG8:  [ 'I', 'II', 'V1', 'V2', 'V3', 'V4' , 'V5' , 'V6' ]
+}
+
+# ====== File name suffixes of the output formats ===========================
+FileSuffix : Final[dict[int,str]] = {
+   deepfakeecg.OUTPUT_CSV:          '.csv',
+   deepfakeecg.OUTPUT_PDF:          '.pdf',
+   deepfakeecg.OUTPUT_PDF_ANALYSIS: '-Analysis.pdf'
+}
+
+# ====== Names of the output formats in ZIP file names ======================
+FormatName : Final[dict[int,str]] = {
+   deepfakeecg.OUTPUT_CSV:          'CSV',
+   deepfakeecg.OUTPUT_PDF:          'PDF',
+   deepfakeecg.OUTPUT_PDF_ANALYSIS: 'PDF-Analysis'
+}
+
+# ====== Binary output formats and their file name suffixes =================
+# NPY is memory-mappable, but has no place for metadata. So, the metadata
+# is written into a JSON file next to it (see metadataFileName()). The
+# downloads of NPY are ZIP files with both.
+BinaryFormats : Final[dict[str,str]] = {
+   'NPY':     '.npy',
+   'NPZ':     '.npz',
+   'HDF5':    '.h5',
+   'Parquet': '.parquet',
+   'WFDB':    '-WFDB.zip'
+}
+
+# ====== Optional modules needed for binary output formats ==================
+BinaryFormatModules : Final[dict[str,str]] = {
+   'HDF5':    'h5py',
+   'Parquet': 'pyarrow'
+}
+
+# ====== Rows per row group of Parquet files ================================
+# The files are written row group by row group, so that long ECGs are not
+# converted into columns at once.
+ParquetRowGroupRows : Final[int] = 60 * ecgresults.PageLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE
+
+# ====== Names of the export stages in the metrics ==========================
+StageName : Final[dict[int,str]] = {
+   deepfakeecg.OUTPUT_CSV:          'csv_export',
+   deepfakeecg.OUTPUT_PDF:          'pdf_export',
+   deepfakeecg.OUTPUT_PDF_ANALYSIS: 'pdf_export'
+}
+
+
+# ###### Get the file name of an exported ECG ###############################
+# number is the ECG number, counted from 1.
+def exportFileName(directory    : pathlib.Path,
+                   outputFormat : int,
+                   number       : int) -> pathlib.Path:
+   return directory / ('ECG-' + str(number) + FileSuffix[outputFormat])
+
+
+# ###### Get a temporary name to write a file to ############################
+# The file is renamed when it is complete, so that a partially written file
+# is never reused. The suffix is kept, since it may define the file format.
+def partialFileName(fileName : pathlib.Path) -> pathlib.Path:
+   return fileName.with_name(f'.{os.getpid()}-{threading.get_ident()}-' + fileName.name)
+
+
+# ###### Export one ECG into CSV or PDF #####################################
+# This may run in the worker processes. Therefore, the time needed is
+# returned, to be accounted in the metrics of the server process.
+def exportECG(ecgResult    : torch.Tensor,
+              ecgType      : int,
+              outputFormat : int,
+              fileName     : pathlib.Path,
+              number       : int) -> float:
+
+   startTime   = time.monotonic()
+   partialName = partialFileName(fileName)
+   if outputFormat == deepfakeecg.OUTPUT_CSV:
+      deepfakeecg.dataToCSV(ecgResult, ecgType, partialName)
+   else:
+      deepfakeecg.dataToPDF(ecgResult, ecgType, OutputLeads[ecgType], partialName,
+                            outputFormat, number)
+   os.replace(partialName, fileName)
+   return time.monotonic() - startTime
+
+
+# ###### Copy a CSV file, without its first skipLines lines #################
+# Returns the number of header lines, i.e. the lines before the first line
+# of numbers.
+def copyCSV(source    : typing.BinaryIO,
+            output    : typing.BinaryIO,
+            skipLines : int = 0) -> int:
+   headerLines = 0
+   header      = True
+   for number, line in enumerate(source):
+      if header:
+         try:
+            float(line.split(b',')[0])
+            header = False
+         except ValueError:
+            headerLines = headerLines + 1
+      if number >= skipLines:
+         output.write(line)
+   return headerLines
+
+
+# ###### Export ECGs into one multi-page PDF ################################
+# One ECG (or page of a long ECG) per page, plotted like in the gallery.
+# The ECGs may come from an iterator, which reads them one by one. With
+# figure, e.g. an analysis, it is added as first page.
+def exportPDFPages(ecgs               : typing.Iterable[numpy.ndarray],
+                   ecgType            : int,
+                   ecgLengthInSeconds : int,
+                   fileName           : pathlib.Path,
+                   figure             : analysis.Figure | None = None) -> float:
+
+   # pyplot is only imported when needed, since it takes long to import:
+   import matplotlib.backends.backend_pdf
+   import matplotlib.pyplot
+
+   startTime   = time.monotonic()
+   partialName = partialFileName(fileName)
+   with renderer.PyplotLock:
+      with matplotlib.backends.backend_pdf.PdfPages(partialName) as pdf:
+         if figure is not None:
+            pdf.savefig(figure)
+         for ecg in ecgs:
+            renderer.plotECG(ecg, ecgType, ecgLengthInSeconds)
+            pdf.savefig()
+            matplotlib.pyplot.close()
+   os.replace(partialName, fileName)
+   return time.monotonic() - startTime
+
+
+# ###### Get the binary output formats supported by the installed modules ####
+def availableBinaryFormats() -> list[str]:
+   return [ binaryFormat for binaryFormat in BinaryFormats
+            if ( (not binaryFormat in BinaryFormatModules) or
+                 (importlib.util.find_spec(BinaryFormatModules[binaryFormat]) is not None) ) ]
+
+
+# ###### Get the metadata of exported ECGs ##################################
+def binaryMetadata(results : ecgresults.ECGResults,
+                   numbers : list[int]) -> dict[str,Any]:
+   return {
+      'ecg_type':      'ECG-12' if results.Type == deepfakeecg.DATA_ECG12 else 'ECG-8',
+      'sampling_rate': deepfakeecg.ECG_SAMPLING_RATE,
+      'scale_factor':  results.ScaleFactor,
+      'lead_names':    renderer.LeadIndex[results.Type],
+      'units':         'uV' if results.Compact else 'mV',
+      'ecg_numbers':   numbers
+   }
+
+
+# ###### Get the file name of the metadata of an NPY file ###################
+def metadataFileName(fileName : pathlib.Path) -> pathlib.Path:
+   return fileName.with_suffix('.json')
+
+
+# ###### Write ECGs into a binary file ######################################
+# data is an (ECGs, leads, samples) array, straight from the results. It is
+# written as it is, i.e. float32 in mV or int16 in µV (compact results).
+def writeBinary(data         : numpy.ndarray,
+                metadata     : dict[str,Any],
+                binaryFormat : str,
+                fileName     : pathlib.Path) -> None:
+
+   partialName = partialFileName(fileName)
+
+   # ====== NumPy ===========================================================
+   if binaryFormat == 'NPY':
+      # The metadata is written first, so that it exists with the data:
+      metadataName        = metadataFileName(fileName)
+      metadataPartialName = partialFileName(metadataName)
+      metadataPartialName.write_text(json.dumps(metadata, indent = 3), encoding = 'utf-8')
+      os.replace(metadataPartialName, metadataName)
+      numpy.save(partialName, data)
+   elif binaryFormat == 'NPZ':
+      # Not compressed, so that the members can be read quickly:
+      numpy.savez(partialName, ecgs = data, metadata = json.dumps(metadata))
+
+   # ====== HDF5 ============================================================
+   elif binaryFormat == 'HDF5':
+      import h5py
+      with h5py.File(partialName, 'w') as hdf5:
+         dataset = hdf5.create_dataset('ecgs', data = data,
+                                       chunks = (1, ) + data.shape[1:])
+         for key, value in metadata.items():
+            dataset.attrs[key] = value
+
+   # ====== Parquet =========================================================
+   # One row per sample, with the ECG number, the time and one column
+   # per lead. Each row group has several short ECGs, or a part of a long
+   # ECG, with at most ParquetRowGroupRows rows.
+   elif binaryFormat == 'Parquet':
+      import pyarrow
+      import pyarrow.parquet
+      ecgs, leads, samples = data.shape
+      ecgsPerGroup    = max(1, ParquetRowGroupRows // samples)
+      samplesPerGroup = min(samples, ParquetRowGroupRows)
+      writer : pyarrow.parquet.ParquetWriter | None = None
+      try:
+         for first in range(0, ecgs, ecgsPerGroup):
+            numbers = metadata['ecg_numbers'][first:first + ecgsPerGroup]
+            for start in range(0, samples, samplesPerGroup):
+               block   = data[first:first + ecgsPerGroup, :, start:start + samplesPerGroup]
+               columns = {
+                  'ecg':     numpy.repeat(numpy.array(numbers, dtype = numpy.int32), block.shape[2]),
+                  'time_ms': numpy.tile(numpy.arange(start, start + block.shape[2], dtype = numpy.int32) *
+                                           (1000 // deepfakeecg.ECG_SAMPLING_RATE), block.shape[0])
+               }
+               for lead, leadName in enumerate(metadata['lead_names']):
+                  columns[leadName] = block[:, lead, :].reshape(-1)
+               table = pyarrow.table(columns).replace_schema_metadata(
+                          { 'deepfakeecg': json.dumps(metadata) })
+               if writer is None:
+                  writer = pyarrow.parquet.ParquetWriter(partialName, table.schema)
+               writer.write_table(table)
+      finally:
+         if writer is not None:
+            writer.close()
+
+   # ====== WFDB ============================================================
+   # One record (header and signal file, format 16 in µV) per ECG, in a
+   # ZIP archive with a RECORDS list. The metadata is in header comments.
+   elif binaryFormat == 'WFDB':
+      with zipfile.ZipFile(partialName, 'w') as archive:
+         records : list[str] = [ ]
+         for ecg, number in zip(data, metadata['ecg_numbers']):
+            if ecg.dtype != numpy.int16:
+               ecg = numpy.rint(ecg * 1000).astype(numpy.int16)
+            record = 'ECG-' + str(number)
+            header = io.StringIO()
+            header.write(f'{record} {ecg.shape[0]} {metadata["sampling_rate"]} {ecg.shape[1]}\n')
+            for signal, leadName in zip(ecg, metadata['lead_names']):
+               checksum = ((int(signal.sum(dtype = numpy.int64)) + 32768) % 65536) - 32768
+               header.write(f'{record}.dat 16 1000/mV 16 0 {signal[0]} {checksum} 0 {leadName}\n')
+            for key, value in metadata.items():
+               if key != 'ecg_numbers':
+                  header.write(f'# {key}: {value}\n')
+            archive.writestr(record + '.hea', header.getvalue())
+            archive.writestr(record + '.dat', ecg.T.astype('<i2').tobytes())
+            records.append(record)
+         archive.writestr('RECORDS', '\n'.join(records) + '\n')
+
+   else:
+      raise ValueError(f'Invalid binary format {binaryFormat}')
+
+   os.replace(partialName, fileName)
+
+
+# ###### Pool of export worker processes ####################################
+# The exported files are written into a directory per batch of results,
+# and reused as long as the batch exists.
+class ExportPool:
+
+   # ###### Constructor #####################################################
+   # At most maxPending files are queued for the worker processes, since
+   # each queued file holds a copy of its ECG.
+   def __init__(self, workers : int, maxPending : int | None = None) -> None:
+      self.Workers    : Final[int] = workers
+      self.MaxPending : Final[int] = maxPending if maxPending is not None else 2 * max(1, workers)
+      self.Executor   : concurrent.futures.ProcessPoolExecutor | None = None
+
+   # ###### Start the worker processes ######################################
+   # Like for the rendering workers, this should be done early. Each worker
+   # imports pyplot when it starts.
+   def start(self) -> None:
+      if self.Workers > 1:
+         self.Executor = startWorkerPool(self.Workers, importModule, ('matplotlib.pyplot', ))
+         log(f'Started {self.Workers} export worker processes')
+
+   # ###### Stop the worker processes #######################################
+   def shutdown(self) -> None:
+      if self.Executor is not None:
+         self.Executor.shutdown(wait = True, cancel_futures = True)
+         self.Executor = None
+
+   # ###### Wait until the worker processes have imported pyplot ############
+   def warmUp(self) -> None:
+      if self.Executor is not None:
+         waitForWorkerPool(self.Executor)
+
+   # ###### Export a long ECG into a PDF with one page per window ###########
+   # It is written in the calling thread, reading one page at a time from
+   # the (memory-mapped) results, since passing the whole ECG to a worker
+   # process would copy it. Without analysis figure, the analysis for
+   # OUTPUT_PDF_ANALYSIS is made here.
+   def exportLongPDF(self,
+                     results      : ecgresults.ECGResults,
+                     index        : int,
+                     outputFormat : int,
+                     fileName     : pathlib.Path,
+                     figure       : analysis.Figure | None = None) -> float:
+
+      result = None
+      if (outputFormat == deepfakeecg.OUTPUT_PDF_ANALYSIS) and (figure is None):
+         result = analysis.analyzeECG(results.lead(index, 0))
+         figure = result.Figure
+      try:
+         return exportPDFPages(results.iteratePages(index), results.Type,
+                               ecgresults.PageLengthInSeconds, fileName,
+                               figure if outputFormat == deepfakeecg.OUTPUT_PDF_ANALYSIS else None)
+      finally:
+         if result is not None:
+            result.close()
+
+   # ###### Export a long ECG into CSV, page by page ########################
+   # Like exportLongPDF(), it is written in the calling thread, converting
+   # one page at a time. Each page is written by deepfakeecg.dataToCSV();
+   # the rows of the pages are appended to the first page, without the
+   # header lines of the following pages.
+   def exportLongCSV(self,
+                     results  : ecgresults.ECGResults,
+                     index    : int,
+                     fileName : pathlib.Path) -> float:
+
+      startTime   = time.monotonic()
+      samples     = ecgresults.PageLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE
+      partialName = partialFileName(fileName)
+      pageName    = partialFileName(fileName.with_name('Page-' + fileName.name))
+      headerLines = 0
+      try:
+         with open(partialName, 'wb') as output:
+            for page in range(0, results.pages()):
+               deepfakeecg.dataToCSV(results.tensor(index, page * samples, (page + 1) * samples),
+                                     results.Type, pageName)
+               with open(pageName, 'rb') as source:
+                  headerLines = copyCSV(source, output, headerLines if page > 0 else 0)
+         os.replace(partialName, fileName)
+      finally:
+         pageName.unlink(missing_ok = True)
+         partialName.unlink(missing_ok = True)
+      return time.monotonic() - startTime
+
+   # ###### Export one ECG, or reuse the existing file ######################
+   # Long ECGs are exported page by page, into CSV or into paged PDFs with
+   # the analysis figure for OUTPUT_PDF_ANALYSIS, if given. They are never
+   # passed to the worker processes, since this would copy them.
+   def exportSingle(self,
+                    results      : ecgresults.ECGResults,
+                    index        : int,
+                    outputFormat : int,
+                    directory    : pathlib.Path,
+                    figure       : analysis.Figure | None = None) -> pathlib.Path:
+
+      fileName = exportFileName(directory, outputFormat, index + 1)
+      if not fileName.exists():
+         if (results.pages() > 1) and (outputFormat == deepfakeecg.OUTPUT_CSV):
+            duration = self.exportLongCSV(results, index, fileName)
+         elif results.pages() > 1:
+            duration = self.exportLongPDF(results, index, outputFormat, fileName, figure)
+         elif self.Executor is not None:
+            duration = self.Executor.submit(exportECG, results.tensor(index), results.Type,
+                                            outputFormat, fileName, index + 1).result()
+         else:
+            duration = exportECG(results.tensor(index), results.Type, outputFormat,
+                                 fileName, index + 1)
+         Metrics.observe(StageName[outputFormat], duration)
+      return fileName
+
+   # ###### Export all ECGs, yielding the files in order ####################
+   # The missing files are written in parallel by the worker processes. At
+   # most MaxPending files are queued at a time, so that only a bounded
+   # number of ECGs is copied for the workers.
+   def exportAll(self,
+                 results       : ecgresults.ECGResults,
+                 outputFormats : list[int],
+                 directory     : pathlib.Path) -> typing.Iterator[pathlib.Path]:
+
+      files = iter([ (index, outputFormat, exportFileName(directory, outputFormat, index + 1))
+                     for index in range(0, len(results)) for outputFormat in outputFormats ])
+      exports : collections.deque[tuple[int,int,pathlib.Path,concurrent.futures.Future[float] | None]] = \
+         collections.deque()
+      try:
+         while True:
+            # ====== Queue the next missing files ===========================
+            while len(exports) < self.MaxPending:
+               nextFile = next(files, None)
+               if nextFile is None:
+                  break
+               index, outputFormat, fileName = nextFile
+               future = None
+               if (self.Executor is not None) and (not fileName.exists()) and \
+                  (results.pages() == 1):
+                  future = self.Executor.submit(exportECG, results.tensor(index),
+                                                results.Type, outputFormat,
+                                                fileName, index + 1)
+               exports.append( (index, outputFormat, fileName, future) )
+            if len(exports) == 0:
+               break
+
+            # ====== Yield the next file, as soon as it is written ==========
+            index, outputFormat, fileName, future = exports.popleft()
+            if future is not None:
+               Metrics.observe(StageName[outputFormat], future.result())
+            else:
+               self.exportSingle(results, index, outputFormat, directory)
+            yield fileName
+
+      finally:
+         # Do not leave work behind, if the caller stops early:
+         for index, outputFormat, fileName, future in exports:
+            if future is not None:
+               future.cancel()
+
+   # ###### Export all ECGs into a ZIP file #################################
+   # The files are added to the archive one by one, as soon as they are
+   # written, without holding the archive in memory.
+   def exportZIP(self,
+                 results       : ecgresults.ECGResults,
+                 outputFormats : list[int],
+                 directory     : pathlib.Path) -> pathlib.Path:
+
+      fileName = directory / ('ECGs-' + '+'.join(FormatName[outputFormat]
+                                                  for outputFormat in outputFormats) + '.zip')
+      if not fileName.exists():
+         with Metrics.span('zip_export'):
+            partialName = partialFileName(fileName)
+            with zipfile.ZipFile(partialName, 'w') as archive:
+               for ecgFile in self.exportAll(results, outputFormats, directory):
+                  # PDF is already compressed:
+                  archive.write(ecgFile, arcname = ecgFile.name,
+                                compress_type = zipfile.ZIP_DEFLATED
+                                   if ecgFile.suffix == '.csv' else zipfile.ZIP_STORED)
+            os.replace(partialName, fileName)
+         log(f'Exported {len(results)} ECGs into {fileName}')
+      return fileName
+
+   # ###### Export all ECGs into one multi-page PDF file ####################
+   # Long ECGs are exported page by page, in the calling thread.
+   def exportPDF(self,
+                 results   : ecgresults.ECGResults,
+                 directory : pathlib.Path) -> pathlib.Path:
+
+      fileName = directory / 'ECGs.pdf'
+      if not fileName.exists():
+         if results.pages() > 1:
+            pages    = itertools.chain.from_iterable(results.iteratePages(index)
+                                                     for index in range(0, len(results)))
+            duration = exportPDFPages(pages, results.Type,
+                                      ecgresults.PageLengthInSeconds, fileName)
+         else:
+            ecgs               = [ results.ecg(index) for index in range(0, len(results)) ]
+            ecgLengthInSeconds = results.lengthInSeconds()
+            if self.Executor is not None:
+               duration = self.Executor.submit(exportPDFPages, ecgs, results.Type,
+                                               ecgLengthInSeconds, fileName).result()
+            else:
+               duration = exportPDFPages(ecgs, results.Type, ecgLengthInSeconds, fileName)
+         Metrics.observe('pdf_pages_export', duration)
+         log(f'Exported {len(results)} ECGs into {fileName}')
+      return fileName
+
+   # ###### Export one ECG or all ECGs into a binary file ###################
+   # The file is written directly from the results array, in the server
+   # process, since passing the array to a worker process would copy it.
+   def exportBinary(self,
+                    results      : ecgresults.ECGResults,
+                    binaryFormat : str,
+                    directory    : pathlib.Path,
+                    index        : int | None = None) -> pathlib.Path:
+
+      if index is None:
+         fileName = directory / ('ECGs' + BinaryFormats[binaryFormat])
+         data     = results.Data[0:len(results)]
+         numbers  = list(range(1, len(results) + 1))
+      else:
+         fileName = directory / ('ECG-' + str(index + 1) + BinaryFormats[binaryFormat])
+         data     = results.Data[index:index + 1]
+         numbers  = [ index + 1 ]
+      if not fileName.exists():
+         with Metrics.span('binary_export'):
+            writeBinary(data, binaryMetadata(results, numbers), binaryFormat, fileName)
+
+      # ====== Bundle NPY data and metadata =================================
+      # Not compressed, so that the extracted NPY file is the same.
+      if binaryFormat == 'NPY':
+         archiveName = fileName.with_name(fileName.stem + '-NPY.zip')
+         if not archiveName.exists():
+            partialName = partialFileName(archiveName)
+            with zipfile.ZipFile(partialName, 'w') as archive:
+               archive.write(fileName, arcname = fileName.name)
+               archive.write(metadataFileName(fileName),
+                             arcname = metadataFileName(fileName).name)
+            os.replace(partialName, archiveName)
+         return archiveName
+      return fileName
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import collections
+import concurrent.futures
+import deepfakeecg
+import ecgresults
+import export
+import getopt
+import json
+import modelpool
+import os
+import pathlib
+import random
+import sys
+import time
+import torch
+import typing
+
+from typing import Any
+from utilities import log, startWorkerPool
+
+
+# ###### Print usage and exit ###############################################
+def usage(exitCode : int = 0) -> typing.NoReturn:
+   sys.stdout.write('Usage: ' + sys.argv[0] +
+                    ' -o|--output directory [-n|--ecgs ecgs] [-T|--ecg-type ECG-12|ECG-8]' +
+                    ' [-m|--generator-model model] [-s|--seed seed] [-d|--device cpu|cuda]' +
+                    ' [-b|--batch-size ecgs] [-S|--shard-size ecgs] [-w|--workers workers]' +
+                    ' [-f|--format ' + '|'.join(export.availableBinaryFormats()) + ']' +
+                    ' [-F|--float]\n')
+   sys.exit(exitCode)
+
+
+
+# ###### Main program #######################################################
+
+# ====== Initialise =========================================================
+outputDirectory: pathlib.Path | None = None
+numberOfECGs:    int        = 1000
+ecgTypeString:   str        = 'ECG-12'
+generatorModel:  str        = 'Default'
+seed:            int | None = None
+runOnDevice:     str        = 'cuda' if torch.cuda.is_available() else 'cpu'
+batchSize:       int        = 32
+shardSize:       int        = 1000
+workers:         int        = os.cpu_count() or 1
+binaryFormat:    str        = 'NPZ'
+compact:         bool       = True
+
+# ====== Check arguments ====================================================
+try:
+   options, args = getopt.gnu_getopt(
+      sys.argv[1:],
+      'o:n:T:m:s:d:b:S:w:f:F',
+      [
+         'output=',
+         'ecgs=',
+         'ecg-type=',
+         'generator-model=',
+         'seed=',
+         'device=',
+         'batch-size=',
+         'shard-size=',
+         'workers=',
+         'format=',
+         'float'
+      ])
+   for option, optarg in options:
+      if option in ( '-o', '--output' ):
+         outputDirectory = pathlib.Path(optarg)
+      elif option in ( '-n', '--ecgs' ):
+         numberOfECGs = int(optarg)
+      elif option in ( '-T', '--ecg-type' ):
+         ecgTypeString = optarg
+      elif option in ( '-m', '--generator-model' ):
+         generatorModel = optarg
+      elif option in ( '-s', '--seed' ):
+         seed = int(optarg)
+      elif option in ( '-d', '--device' ):
+         runOnDevice = optarg
+      elif option in ( '-b', '--batch-size' ):
+         batchSize = int(optarg)
+      elif option in ( '-S', '--shard-size' ):
+         shardSize = int(optarg)
+      elif option in ( '-w', '--workers' ):
+         workers = int(optarg)
+      elif option in ( '-f', '--format' ):
+         binaryFormat = optarg
+      elif option in ( '-F', '--float' ):
+         compact = False
+      else:
+         sys.stderr.write('ERROR: Invalid option ' + option + '!\n')
+         sys.exit(1)
+
+except getopt.GetoptError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
+except ValueError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
+if ( (len(args) > 0) or (outputDirectory is None) or
+     (not ecgTypeString in ( 'ECG-12', 'ECG-8' )) or
+     (not generatorModel in modelpool.GeneratorModels) or
+     (not binaryFormat in export.availableBinaryFormats()) or
+     (numberOfECGs < 1) or (batchSize < 1) or (shardSize < 1) or (workers < 1) ):
+   usage(1)
+
+ecgType            = deepfakeecg.DATA_ECG12 if ecgTypeString == 'ECG-12' else deepfakeecg.DATA_ECG8
+ecgLengthInSeconds = 10
+
+# ====== Check or write the manifest ========================================
+# A run is resumed with the parameters of the manifest. Only the missing
+# shards are generated, with the same seeds as in the original run.
+outputDirectory.mkdir(parents = True, exist_ok = True)
+manifestFile = outputDirectory / 'manifest.json'
+previousManifest : dict[str,Any] | None = None
+if manifestFile.exists():
+   with open(manifestFile, 'r', encoding = 'utf-8') as manifestInput:
+      previousManifest = json.load(manifestInput)
+   if seed is None:
+      seed = previousManifest['seed']
+elif seed is None:
+   seed = random.randrange(0, 1 << 32)
+
+manifest = { 'ecgs':            numberOfECGs,
+             'ecg_type':        ecgTypeString,
+             'generator_model': generatorModel,
+             'seed':            seed,
+             'seed_derivation': modelpool.SeedDerivation,
+             'shard_size':      shardSize,
+             'format':          binaryFormat,
+             'compact':         compact }
+if previousManifest is not None:
+   if previousManifest != manifest:
+      sys.stderr.write(f'ERROR: {outputDirectory} contains a different run: {previousManifest}\n')
+      sys.exit(1)
+   log(f'Resuming the run in {outputDirectory}, with seed {seed}')
+else:
+   partialName = export.partialFileName(manifestFile)
+   with open(partialName, 'w', encoding = 'utf-8') as manifestOutput:
+      json.dump(manifest, manifestOutput, indent = 3)
+   os.replace(partialName, manifestFile)
+   log(f'Starting a new run in {outputDirectory}, with seed {seed}')
+
+# ====== Start the export worker processes ==================================
+# The workers are forked before the generator model is loaded.
+executor = startWorkerPool(workers)
+
+model = modelpool.ModelPool().get(generatorModel, ecgType, runOnDevice)
+
+# ====== Generate the shards ================================================
+# While a shard is written by the export workers, the next one is generated.
+# At most one shard per worker is queued, to limit the memory usage.
+pending   : collections.deque[concurrent.futures.Future[None]] = collections.deque()
+generated = 0
+startTime = time.monotonic()
+shards    = (numberOfECGs + shardSize - 1) // shardSize
+for shard in range(0, shards):
+   fileName = outputDirectory / (f'shard-{shard:06d}' + export.BinaryFormats[binaryFormat])
+   first    = shard * shardSize
+   count    = min(shardSize, numberOfECGs - first)
+   if fileName.exists():
+      continue
+
+   # ====== Generate the ECGs of the shard ==================================
+   results = ecgresults.ECGResults(ecgType, count,
+                                   ecgLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE,
+                                   compact)
+   for start in range(first, first + count, batchSize):
+      batch = min(batchSize, first + count - start)
+      results.append(model.generate(batch, ecgLengthInSeconds,
+                                    seeds = modelpool.ecgSeeds(seed, start, batch)))
+   generated = generated + count
+
+   # ====== Queue the shard for export ======================================
+   while len(pending) >= workers:
+      pending.popleft().result()
+   metadata = export.binaryMetadata(results, list(range(first + 1, first + count + 1))) | \
+                 { 'seed': seed }
+   pending.append(executor.submit(export.writeBinary, results.Data, metadata,
+                                  binaryFormat, fileName))
+   log(f'Shard {shard + 1}/{shards}: {count} ECGs generated, ' +
+       f'{generated / (time.monotonic() - startTime):.1f} ECGs/s')
+
+# ====== Wait for the remaining exports =====================================
+while len(pending) > 0:
+   pending.popleft().result()
+executor.shutdown()
+duration = time.monotonic() - startTime
+log(f'Generated {generated} ECGs in {duration:.1f} s: {generated / max(duration, 1e-9):.1f} ECGs/s, ' +
+    f'{numberOfECGs - generated} ECGs already present')
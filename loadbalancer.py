@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import contextlib
+import hashlib
+import httpx
+import json
+import math
+import starlette.applications
+import starlette.requests
+import starlette.responses
+import starlette.routing
+import time
+import typing
+
+from typing import Final
+from utilities import log
+
+
+# Headers of a single connection, which are not forwarded. The content
+# length is set again for the forwarded content.
+HopByHopHeaders : Final[frozenset[bytes]] = frozenset([
+   b'connection', b'keep-alive', b'proxy-authenticate', b'proxy-authorization',
+   b'te', b'trailer', b'transfer-encoding', b'upgrade', b'content-length'
+])
+
+# Cookie with the backend of a client, for sticky routing:
+BackendCookie : Final[str] = 'DeepFakeECGPlus-Backend'
+
+
+# ###### Load balancer for several server processes #########################
+# Forwards the HTTP requests to the backends (server processes of app.py,
+# local or on other nodes), streaming the responses (the Gradio queue uses
+# server-sent events). The backend is chosen by the routing:
+# * sticky: all requests of a client go to the same backend, remembered by
+#           a cookie. Requests without cookie are routed like for hash.
+# * hash:   requests of a Gradio session (with its session hash in the
+#           query, path or JSON body) are routed by rendezvous hashing of
+#           the session hash. The load balancer keeps no state, so several
+#           load balancers can be used.
+# The queue requests of a Gradio session must reach the same backend, which
+# both routings ensure. Requests without session hash, e.g. for the files
+# (gallery images, downloads) that only the backend having created them
+# serves, follow the cookie with the backend of the client's last request;
+# without cookie, they are routed round-robin. Backends that are not reachable are skipped for
+# retryInterval seconds; their sessions continue on other backends, from
+# the session store.
+class LoadBalancer:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                backends      : list[str],
+                routing       : str   = 'sticky',
+                retryInterval : float = 10.0) -> None:
+      if not routing in ( 'sticky', 'hash' ):
+         raise ValueError(f'Invalid routing {routing}')
+      self.Backends      : Final[list[str]] = [ backend.rstrip('/') for backend in backends ]
+      self.Routing       : Final[str]       = routing
+      self.RetryInterval : Final[float]     = retryInterval
+      self.Failed        : dict[str,float]  = { }
+      self.Next          : int              = 0
+      self.Client = httpx.AsyncClient(timeout = httpx.Timeout(None, connect = 5.0))
+      self.App    = starlette.applications.Starlette(
+                       routes = [
+                          starlette.routing.Route(
+                             '/{path:path}', self.handle,
+                             methods = [ 'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS' ])
+                       ],
+                       lifespan = self.lifespan)
+
+   # ###### Close the client connections on shutdown ########################
+   @contextlib.asynccontextmanager
+   async def lifespan(self, app : starlette.applications.Starlette) -> typing.AsyncIterator[None]:
+      yield
+      await self.Client.aclose()
+
+   # ###### Get the Gradio session hash of a request ########################
+   def sessionHash(self,
+                   request : starlette.requests.Request,
+                   body    : bytes) -> str | None:
+      sessionHash = request.query_params.get('session_hash')
+      if (sessionHash is None) and ('/heartbeat/' in request.url.path):
+         sessionHash = request.url.path.rsplit('/', 1)[-1]
+      if (sessionHash is None) and \
+         request.headers.get('content-type', '').startswith('application/json'):
+         try:
+            value = json.loads(body).get('session_hash')
+         except (ValueError, AttributeError):
+            value = None
+         if isinstance(value, str):
+            sessionHash = value
+      return sessionHash
+
+   # ###### Get the backends for a request, in order of preference ##########
+   def candidates(self,
+                  request     : starlette.requests.Request,
+                  sessionHash : str | None) -> list[str]:
+      now       = time.monotonic()
+      available = [ backend for backend in self.Backends
+                    if now - self.Failed.get(backend, -math.inf) >= self.RetryInterval ]
+      if len(available) == 0:
+         available = list(self.Backends)   # Try again, rather than failing
+
+      if sessionHash is not None:
+         candidates = sorted(available,
+                             key = lambda backend: hashlib.sha256(
+                                      (backend + '|' + sessionHash).encode('utf-8')).digest(),
+                             reverse = True)
+      else:
+         self.Next  = (self.Next + 1) % len(available)
+         candidates = available[self.Next:] + available[0:self.Next]
+
+      if (self.Routing == 'sticky') or (sessionHash is None):
+         try:
+            backend = self.Backends[int(request.cookies.get(BackendCookie, ''))]
+         except (ValueError, IndexError):
+            backend = None
+         if backend in candidates:
+            candidates.remove(backend)
+            candidates.insert(0, backend)
+      return candidates
+
+   # ###### Forward a request ###############################################
+   # When the request fails before a response (the backend has gone away),
+   # it is retried with the next backend.
+   async def handle(self, request : starlette.requests.Request) -> starlette.responses.Response:
+      body        = await request.body()
+      sessionHash = self.sessionHash(request, body)
+      headers     = [ (name, value) for name, value in request.headers.raw
+                      if not name.lower() in HopByHopHeaders ]
+      if request.client is not None:
+         headers.append( (b'x-forwarded-for', request.client.host.encode('utf-8')) )
+      url = request.url.path + ('?' + request.url.query if request.url.query else '')
+
+      for backend in self.candidates(request, sessionHash):
+         try:
+            response = await self.Client.send(
+                          self.Client.build_request(request.method, backend + url,
+                                                    headers = headers, content = body),
+                          stream = True)
+         except httpx.TransportError as error:
+            if not backend in self.Failed:
+               log(f'Load balancer: Backend {backend} failed ({error})')
+            self.Failed[backend] = time.monotonic()
+            continue
+         if self.Failed.pop(backend, None) is not None:
+            log(f'Load balancer: Backend {backend} is available again')
+
+         streamingResponse = starlette.responses.StreamingResponse(
+                                self.stream(backend, response), status_code = response.status_code)
+         streamingResponse.raw_headers = [ (name, value) for name, value in response.headers.raw
+                                           if not name.lower() in HopByHopHeaders ]
+         index = str(self.Backends.index(backend))
+         if request.cookies.get(BackendCookie) != index:
+            streamingResponse.set_cookie(BackendCookie, index, httponly = True, samesite = 'lax')
+         return streamingResponse
+
+      return starlette.responses.PlainTextResponse('No backend available!', status_code = 502)
+
+   # ###### Stream the response of a backend ################################
+   # If the backend goes away meanwhile, the response just ends.
+   async def stream(self,
+                    backend  : str,
+                    response : httpx.Response) -> typing.AsyncIterator[bytes]:
+      try:
+         async for chunk in response.aiter_raw():
+            yield chunk
+      except httpx.TransportError as error:
+         log(f'Load balancer: Backend {backend} failed during response ({error})')
+      finally:
+         await response.aclose()
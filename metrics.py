@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import contextlib
+import cProfile
+import pstats
+import threading
+import time
+import typing
+
+from typing import Callable, Final
+from utilities import log
+
+if typing.TYPE_CHECKING:
+   import fastapi.responses
+   import fastapi.routing
+
+
+# Upper bounds of the stage duration histogram buckets, in seconds:
+DurationBuckets : Final[tuple[float, ...]] = \
+   ( 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0 )
+
+
+# ###### Duration histogram of a stage ######################################
+class Histogram:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      self.Buckets : list[int] = [ 0 ] * len(DurationBuckets)
+      self.Sum     : float     = 0.0
+      self.Count   : int       = 0
+
+   # ###### Add a duration ##################################################
+   def observe(self, seconds : float) -> None:
+      for i, upperBound in enumerate(DurationBuckets):
+         if seconds <= upperBound:
+            self.Buckets[i] = self.Buckets[i] + 1
+      self.Sum   = self.Sum + seconds
+      self.Count = self.Count + 1
+
+
+# ###### Profiler for the instrumented stages ###############################
+# cProfile only profiles the thread that enabled it. Therefore, the
+# outermost span of each thread is profiled separately, and the results are
+# merged. The output can be examined with pstats or snakeviz.
+class Profiler:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      self.Lock  = threading.Lock()
+      self.Stats : pstats.Stats | None = None
+      self.Local = threading.local()
+
+   # ###### Profile a span ##################################################
+   @contextlib.contextmanager
+   def profile(self) -> typing.Iterator[None]:
+      depth = getattr(self.Local, 'Depth', 0)
+      self.Local.Depth = depth + 1
+      try:
+         if depth > 0:
+            yield
+         else:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+               yield
+            finally:
+               profile.disable()
+               with self.Lock:
+                  if self.Stats is None:
+                     self.Stats = pstats.Stats(profile)
+                  else:
+                     self.Stats.add(profile)
+      finally:
+         self.Local.Depth = depth
+
+   # ###### Write the merged profile ########################################
+   def dump(self, fileName : str) -> None:
+      with self.Lock:
+         if self.Stats is not None:
+            self.Stats.dump_stats(fileName)
+            log(f'Wrote profile to {fileName}')
+
+
+# ###### Registry of the metrics ############################################
+class Registry:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      self.Lock     = threading.Lock()
+      self.Stages   : dict[str,Histogram]              = { }
+      self.Counters : dict[str,float]                  = { }
+      self.Gauges   : dict[str,Callable[[], float]]    = { }
+      self.Profiler : Profiler | None                  = None
+
+   # ###### Add the duration of a stage #####################################
+   def observe(self, stage : str, seconds : float) -> None:
+      with self.Lock:
+         histogram = self.Stages.get(stage)
+         if histogram is None:
+            histogram = Histogram()
+            self.Stages[stage] = histogram
+         histogram.observe(seconds)
+
+   # ###### Time a stage ####################################################
+   @contextlib.contextmanager
+   def span(self, stage : str) -> typing.Iterator[None]:
+      startTime = time.monotonic()
+      try:
+         if self.Profiler is not None:
+            with self.Profiler.profile():
+               yield
+         else:
+            yield
+      finally:
+         self.observe(stage, time.monotonic() - startTime)
+
+   # ###### Increment a counter #############################################
+   def increment(self, counter : str, value : float = 1) -> None:
+      with self.Lock:
+         self.Counters[counter] = self.Counters.get(counter, 0) + value
+
+   # ###### Register a gauge, which is queried on export ####################
+   def gauge(self, name : str, function : Callable[[], float]) -> None:
+      with self.Lock:
+         self.Gauges[name] = function
+
+   # ###### Export in Prometheus text format ################################
+   def exposition(self) -> str:
+      with self.Lock:
+         stages   = { stage: ( list(histogram.Buckets), histogram.Sum, histogram.Count )
+                      for stage, histogram in self.Stages.items() }
+         counters = dict(self.Counters)
+         gauges   = dict(self.Gauges)
+
+      # ====== Stage durations ==============================================
+      lines = [ '# TYPE deepfakeecg_stage_duration_seconds histogram' ]
+      for stage, ( buckets, total, count ) in sorted(stages.items()):
+         for upperBound, bucket in zip(DurationBuckets, buckets):
+            lines.append(f'deepfakeecg_stage_duration_seconds_bucket{{stage="{stage}",le="{upperBound}"}} {bucket}')
+         lines.append(f'deepfakeecg_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+         lines.append(f'deepfakeecg_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+         lines.append(f'deepfakeecg_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+      # ====== Counters =====================================================
+      for counter, value in sorted(counters.items()):
+         lines.append(f'# TYPE deepfakeecg_{counter}_total counter')
+         lines.append(f'deepfakeecg_{counter}_total {value}')
+
+      # ====== Gauges =======================================================
+      # The gauges are queried outside of the lock, since they may take
+      # other locks.
+      for name, function in sorted(gauges.items()):
+         lines.append(f'# TYPE deepfakeecg_{name} gauge')
+         lines.append(f'deepfakeecg_{name} {function()}')
+
+      return '\n'.join(lines) + '\n'
+
+
+# ###### Metrics endpoint ###################################################
+# Serves /metrics for Prometheus by the FastAPI application of the GUI, i.e.
+# on the port of the GUI. So, each server process of scale-out.py provides
+# its own metrics on its own port. The endpoint runs in the thread pool of
+# the server, since the gauges may take locks.
+def metricsRoute() -> 'fastapi.routing.APIRoute':
+   import fastapi.responses   # Already imported by Gradio
+   import fastapi.routing
+
+   def getMetrics() -> fastapi.responses.PlainTextResponse:
+      return fastapi.responses.PlainTextResponse(
+                Metrics.exposition(),
+                media_type = 'text/plain; version=0.0.4; charset=utf-8')
+
+   return fastapi.routing.APIRoute('/metrics', getMetrics, methods = [ 'GET' ],
+                                   include_in_schema = False)
+
+
+# The metrics of the process:
+Metrics : Final[Registry] = Registry()
+
+
+# ###### Timing of the startup phases #######################################
+# phase() ends a phase, which started at the end of the previous one. The
+# durations are logged by report(), and provided as "startup_<phase>" stages.
+class StartupTimer:
+
+   # ###### Constructor #####################################################
+   def __init__(self, startTime : float | None = None) -> None:
+      self.StartTime : Final[float]             = \
+         startTime if startTime is not None else time.monotonic()
+      self.LastTime  : float                    = self.StartTime
+      self.Phases    : list[tuple[str,float]]   = [ ]
+
+   # ###### End a phase #####################################################
+   def phase(self, name : str) -> None:
+      now      = time.monotonic()
+      duration = now - self.LastTime
+      self.Phases.append( (name, duration) )
+      self.LastTime = now
+      Metrics.observe('startup_' + name, duration)
+
+   # ###### Log the durations ###############################################
+   def report(self, title : str) -> None:
+      log(f'{title}: ' +
+          ', '.join(f'{name} {duration:.3f} s' for name, duration in self.Phases) +
+          f' => {self.LastTime - self.StartTime:.3f} s')
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import deepfakeecg
+import pathlib
+import threading
+import time
+import torch
+
+from typing import Final
+from utilities import log
+
+
+# Longer ECGs are generated as a sequence of segments of this length (see
+# segmentSeeds()). Then, the generator always runs on inputs of the usual
+# size, and the scheduler interleaves long ECGs with the other jobs.
+SegmentLengthInSeconds : Final[int] = 10
+
+# Derivation of the seeds of the ECGs from the seed of a run (see ecgSeeds()),
+# recorded in the manifests of generate-dataset.py:
+SeedDerivation : Final[str] = 'splitmix64'
+
+# Available generator models (name -> checkpoint file). New models only
+# need an entry here; they are loaded once and then kept resident.
+GeneratorModels : Final[dict[str,pathlib.Path]] = {
+   'Default': pathlib.Path(deepfakeecg.__file__).parent / 'checkpoints' / 'g_stat.pt'
+}
+
+
+# ###### Loaded generator network ###########################################
+class GeneratorNetwork:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                generatorModel : str,
+                checkpoint     : pathlib.Path,
+                device         : str) -> None:
+      self.Name   : Final[str] = generatorModel
+      self.Device : Final[str] = device
+
+      startTime = time.monotonic()
+      self.Network : torch.nn.Module = deepfakeecg.Generator()
+      checkpointData = torch.load(checkpoint, map_location = device)
+      self.Network.load_state_dict(checkpointData['stat_dict'])
+      self.Network.to(device)
+      self.Network.eval()
+      for parameter in self.Network.parameters():
+         parameter.requires_grad_(False)
+      self.LoadTime : Final[float] = time.monotonic() - startTime
+
+      # ====== Resident memory of weights and buffers =======================
+      self.ResidentBytes : Final[int] = \
+         sum(tensor.numel() * tensor.element_size()
+             for tensor in list(self.Network.parameters()) + list(self.Network.buffers()))
+
+
+# ###### Generator model for a given ECG type ###############################
+class GeneratorModel:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                network : GeneratorNetwork,
+                ecgType : int) -> None:
+      self.Network : Final[GeneratorNetwork] = network
+      self.Type    : Final[int]              = ecgType
+
+   # ###### Generate ECGs ###################################################
+   # Returns the same layout as deepfakeecg.generateDeepfakeECGs() with
+   # OUTPUT_TENSOR: one (samples, 1 + leads) tensor per ECG, column 0 is the
+   # timestamp in ms, the other columns are the leads in µV.
+   # With seeds, the noise of each ECG is drawn from its own seed. Then,
+   # an ECG does not depend on the other ECGs in the same batch (apart from
+   # rounding differences of 1 µV of the batched inference).
+   def generate(self,
+                numberOfECGs       : int,
+                ecgLengthInSeconds : int   = 10,
+                ecgScaleFactor     : float = deepfakeecg.ECG_DEFAULT_SCALE_FACTOR,
+                seeds              : list[int] | None = None) -> list[torch.Tensor]:
+
+      samples = ecgLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE
+      device  = self.Network.Device
+
+      with torch.inference_mode():
+         # ====== Run the generator =========================================
+         noise = torch.empty(numberOfECGs, 8, samples, device = device)
+         if seeds is None:
+            noise.uniform_(-1, 1)
+         else:
+            if len(seeds) != numberOfECGs:
+               raise ValueError(f'{len(seeds)} seeds for {numberOfECGs} ECGs')
+            for i, seed in enumerate(seeds):
+               generator = torch.Generator(device = device)
+               generator.manual_seed(seed)
+               noise[i].uniform_(-1, 1, generator = generator)
+         leads = self.Network.Network(noise) * ecgScaleFactor
+
+         # ====== Derive limb leads III, aVR, aVL, aVF for ECG-12 ===========
+         if self.Type == deepfakeecg.DATA_ECG12:
+            leadI   = leads[:, 0:1, :]
+            leadII  = leads[:, 1:2, :]
+            leads   = torch.cat( (leads,
+                                  leadII - leadI,
+                                  -(leadI + leadII) / 2,
+                                  leadI - leadII / 2,
+                                  leadII - leadI / 2), dim = 1)
+
+         # Truncated to integer µV, like by generateDeepfakeECGs():
+         leads = leads.int()
+
+         # ====== Add timestamp column ======================================
+         timestamps = (torch.arange(samples, device = device, dtype = torch.int32) *
+                       (1000 // deepfakeecg.ECG_SAMPLING_RATE))
+         timestamps = timestamps.expand(numberOfECGs, 1, samples)
+         results    = torch.cat( (timestamps, leads), dim = 1).transpose(1, 2).contiguous().cpu()
+
+      return list(results.unbind(0))
+
+
+# ###### Get the seeds of a range of ECGs ###################################
+# ECG number n (counted from 0) of a run with the given seed gets its own
+# seed, so that it can be reproduced independently of the other ECGs. The
+# seed and n are mixed into all 64 bits by the SplitMix64 finalizer, since
+# the random number generator of the CPU only uses the lower 32 bits.
+def ecgSeeds(seed : int, first : int, count : int) -> list[int]:
+   seeds : list[int] = [ ]
+   for n in range(first, first + count):
+      x = (seed * 0x9E3779B97F4A7C15 + n) & 0xffffffffffffffff
+      x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xffffffffffffffff
+      x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xffffffffffffffff
+      seeds.append(x ^ (x >> 31))
+   return seeds
+
+
+# ###### Get the seeds of the segments of a long ECG ########################
+# Long ECGs are generated as consecutive segments of SegmentLengthInSeconds.
+# The first segment uses the seed of the ECG itself, so that the first
+# segment of a long ECG is the same as the ECG of the same seed with the
+# segment length.
+def segmentSeeds(ecgSeed : int, segments : int) -> list[int]:
+   return [ (ecgSeed + n * 0x9E3779B97F4A7C15) & 0xffffffffffffffff for n in range(0, segments) ]
+
+
+# ###### Process-level generator model registry #############################
+class ModelPool:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      self.Lock     = threading.Lock()
+      self.Networks : dict[tuple[str,str],GeneratorNetwork]   = { }
+      self.Models   : dict[tuple[str,int,str],GeneratorModel] = { }
+
+   # ###### Get model (loading it on first use) #############################
+   def get(self,
+           generatorModel : str,
+           ecgType        : int,
+           device         : str) -> GeneratorModel:
+
+      key = (generatorModel, ecgType, device)
+      with self.Lock:
+         model = self.Models.get(key)
+         if model is None:
+            network = self.Networks.get( (generatorModel, device) )
+            if network is None:
+               network = GeneratorNetwork(generatorModel,
+                                          GeneratorModels[generatorModel], device)
+               self.Networks[(generatorModel, device)] = network
+               log(f'Loaded generator model "{generatorModel}" on {device} in ' +
+                   f'{network.LoadTime:.3f} s, {network.ResidentBytes / 1048576:.1f} MiB resident')
+            model = GeneratorModel(network, ecgType)
+            self.Models[key] = model
+      return model
+
+   # ###### Load all models for a device ####################################
+   def preload(self, device : str) -> None:
+      for generatorModel in GeneratorModels:
+         for ecgType in ( deepfakeecg.DATA_ECG12, deepfakeecg.DATA_ECG8 ):
+            self.get(generatorModel, ecgType, device)
+      self.report()
+
+   # ###### Report loaded models ############################################
+   def report(self) -> None:
+      with self.Lock:
+         for (generatorModel, device), network in self.Networks.items():
+            log(f'Generator model "{generatorModel}" on {device}: ' +
+                f'load time {network.LoadTime:.3f} s, ' +
+                f'{network.ResidentBytes / 1048576:.1f} MiB resident')
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import asyncio
+import concurrent.futures
+import deepfakeecg
+import functools
+import io
+import math
+import numpy
+import os
+import PIL
+import PIL.Image
+import PIL.ImageDraw
+import threading
+import time
+
+from metrics import Metrics
+from typing import Final
+from utilities import importModule, log, startWorkerPool, waitForWorkerPool
+
+
+# matplotlib takes long to import. So, it is only imported where it is used,
+# mostly in the worker processes. The backend is set in the environment, so
+# that the non-interactive backend is also used when matplotlib is imported
+# indirectly (by ecg_plot and neurokit2, or when unpickling a figure):
+os.environ['MPLBACKEND'] = 'Agg'
+
+
+# pyplot keeps global state. Rendering inside the server process therefore
+# has to be serialised; the worker processes have their own pyplot state.
+PyplotLock : Final[threading.RLock] = threading.RLock()
+
+
+# Lead names and display order (column by column, as in ecg_plot.plot()):
+LeadIndex : Final[dict[int,list[str]]] = {
+   deepfakeecg.DATA_ECG12: [ 'I', 'II', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6', 'III', 'aVR', 'aVL', 'aVF' ],
+   deepfakeecg.DATA_ECG8:  [ 'I', 'II', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6' ]
+}
+LeadOrder : Final[dict[int,list[int]]] = {
+   deepfakeecg.DATA_ECG12: [ 0, 1, 8, 9, 10, 11, 2, 3, 4, 5, 6, 7 ],
+   deepfakeecg.DATA_ECG8:  [ 0, 1, 2, 3, 4, 5, 6, 7 ]
+}
+
+# Thumbnail layout: 25 mm/s, 10 mm/mV, 2 columns, 30 mm per row
+ThumbnailColumns     : Final[int]   = 2
+ThumbnailRowHeight   : Final[float] = 3.0   # mV
+ThumbnailPixelsPerMM : Final[int]   = 2
+
+
+# ###### Plot one ECG with ecg_plot into the current pyplot figure ##########
+# data is the (leads, samples) array in mV. The caller must hold PyplotLock.
+def plotECG(data               : numpy.ndarray,
+            ecgType            : int,
+            ecgLengthInSeconds : int) -> None:
+
+   # ecg_plot is only imported when needed, since it takes long to import:
+   import ecg_plot
+   import matplotlib.ticker
+
+   info : Final[str] = '25 mm/sec, 1 mV/10 mm'
+
+   # ====== Raise Locator.MAXTICKS, if necessary ============================
+   matplotlib.ticker.Locator.MAXTICKS = \
+       max(1000, ecgLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE)
+
+   # ------ ECG-12 ----------------------------------------------------------
+   if ecgType == deepfakeecg.DATA_ECG12:
+      ecg_plot.plot(data,
+                    title       = 'ECG-12 – ' + info,
+                    sample_rate = deepfakeecg.ECG_SAMPLING_RATE,
+                    lead_index  = LeadIndex[deepfakeecg.DATA_ECG12],
+                    lead_order  = LeadOrder[deepfakeecg.DATA_ECG12],
+                    show_grid   = True)
+   # ------ ECG-8 -----------------------------------------------------------
+   else:
+      ecg_plot.plot(data,
+                    title       = 'ECG-8 – ' + info,
+                    sample_rate = deepfakeecg.ECG_SAMPLING_RATE,
+                    lead_index  = LeadIndex[deepfakeecg.DATA_ECG8],
+                    lead_order  = LeadOrder[deepfakeecg.DATA_ECG8],
+                    show_grid   = True)
+
+
+# ###### Encode the current pyplot figure into WebP, and close it ###########
+# The caller must hold PyplotLock.
+def encodeFigure() -> bytes:
+   import matplotlib.pyplot as plt
+
+   imageBuffer = io.BytesIO()
+   plt.savefig(imageBuffer, format = 'webp')
+   plt.close()
+   return imageBuffer.getvalue()
+
+
+# ###### Render one ECG with ecg_plot into WebP #############################
+# data is the (leads, samples) array in mV. Since this runs in the worker
+# processes, the plotting and encoding times are returned with the image,
+# to be accounted in the metrics of the server process.
+def renderECG(data               : numpy.ndarray,
+              ecgType            : int,
+              ecgLengthInSeconds : int) -> tuple[bytes, float, float]:
+
+   with PyplotLock:
+      startTime = time.monotonic()
+      plotECG(data, ecgType, ecgLengthInSeconds)
+      plotTime  = time.monotonic()
+      image     = encodeFigure()
+      return ( image, plotTime - startTime, time.monotonic() - plotTime )
+
+
+# ###### Get the grid background for a thumbnail ############################
+# The grid only depends on the layout, so it is drawn once and cached.
+@functools.lru_cache(maxsize = 32)
+def thumbnailBackground(rows               : int,
+                        ecgLengthInSeconds : int,
+                        pixelsPerMM        : int) -> PIL.Image.Image:
+
+   width  = ThumbnailColumns * ecgLengthInSeconds * 25 * pixelsPerMM
+   height = int(rows * ThumbnailRowHeight * 10 * pixelsPerMM)
+   grid   = numpy.full( (height, width, 3), 255, dtype = numpy.uint8)
+
+   # ====== Minor grid (1 mm, if not too dense), then major grid (5 mm) =====
+   for step, colour in ( (1, (255, 179, 179)), (5, (255, 140, 140)) ):
+      if step * pixelsPerMM < 3:
+         continue
+      grid[:, ::step * pixelsPerMM] = colour
+      grid[::step * pixelsPerMM, :] = colour
+
+   return PIL.Image.fromarray(grid, mode = 'RGB')
+
+
+# ###### Render one ECG thumbnail directly into an image ####################
+# A fast alternative to renderECG() for previews: the grid comes from the
+# cached background, the leads are drawn as polylines. data is the
+# (leads, samples) array in mV.
+def renderThumbnail(data               : numpy.ndarray,
+                    ecgType            : int,
+                    ecgLengthInSeconds : int,
+                    pixelsPerMM        : int = ThumbnailPixelsPerMM) -> PIL.Image.Image:
+
+   leadIndex = LeadIndex[ecgType]
+   leadOrder = LeadOrder[ecgType]
+   rows      = int(math.ceil(len(leadOrder) / ThumbnailColumns))
+   image     = thumbnailBackground(rows, ecgLengthInSeconds, pixelsPerMM).copy()
+   draw      = PIL.ImageDraw.Draw(image)
+
+   samples     = data.shape[1]
+   pixelsPerS  = 25 * pixelsPerMM
+   pixelsPerMV = 10 * pixelsPerMM
+   rowPixels   = ThumbnailRowHeight * pixelsPerMV
+   x           = numpy.arange(samples) * (pixelsPerS / deepfakeecg.ECG_SAMPLING_RATE)
+
+   for column in range(0, ThumbnailColumns):
+      for row in range(0, rows):
+         if column * rows + row < len(leadOrder):
+            lead     = leadOrder[column * rows + row]
+            xOffset  = column * ecgLengthInSeconds * pixelsPerS
+            baseline = (row + 0.5) * rowPixels
+            points   = numpy.empty( (samples, 2) )
+            points[:, 0] = x + xOffset
+            points[:, 1] = baseline - data[lead] * pixelsPerMV
+            draw.line(points.ravel().tolist(), fill = (0, 0, 179), width = 1)
+            draw.text( (xOffset + 4, baseline + 4), leadIndex[lead], fill = (0, 0, 0))
+
+   return image
+
+
+# ###### Draw one ECG thumbnail (in a worker process) #######################
+# Returns the image and the drawing duration.
+def drawThumbnail(data               : numpy.ndarray,
+                  ecgType            : int,
+                  ecgLengthInSeconds : int) -> tuple[PIL.Image.Image, float]:
+   startTime = time.monotonic()
+   image     = renderThumbnail(data, ecgType, ecgLengthInSeconds)
+   return ( image, time.monotonic() - startTime )
+
+
+# ###### Pool of rendering worker processes #################################
+class RenderPool:
+
+   # ###### Constructor #####################################################
+   def __init__(self, workers : int) -> None:
+      self.Workers  : Final[int] = workers
+      self.Executor : concurrent.futures.ProcessPoolExecutor | None = None
+
+   # ###### Start the worker processes ######################################
+   # The workers should be started early, before the server process starts
+   # further threads, so that forking them is safe. Each worker imports
+   # ecg_plot when it starts.
+   def start(self) -> None:
+      if self.Workers > 1:
+         self.Executor = startWorkerPool(self.Workers, importModule, ('ecg_plot', ))
+         log(f'Started {self.Workers} rendering worker processes')
+
+   # ###### Stop the worker processes #######################################
+   def shutdown(self) -> None:
+      if self.Executor is not None:
+         self.Executor.shutdown(wait = True, cancel_futures = True)
+         self.Executor = None
+
+   # ###### Wait until the worker processes have imported ecg_plot ##########
+   def warmUp(self) -> None:
+      if self.Executor is not None:
+         waitForWorkerPool(self.Executor)
+
+   # ###### Render ECGs, returning the images in the same order #############
+   # The ECGs are rendered by the worker processes (or, without workers, by
+   # threads), to keep the event loop of the server process free for the
+   # GUI. With asThumbnails, the ECGs are drawn by renderThumbnail() instead
+   # of ecg_plot.
+   async def render(self,
+                    ecgs               : list[numpy.ndarray],
+                    ecgType            : int,
+                    ecgLengthInSeconds : int,
+                    asThumbnails       : bool = False) -> list[PIL.Image.Image]:
+
+      loop = asyncio.get_running_loop()
+      if asThumbnails:
+         thumbnails = await asyncio.gather(*[
+                         loop.run_in_executor(self.Executor, drawThumbnail,
+                                              ecg, ecgType, ecgLengthInSeconds)
+                         for ecg in ecgs ])
+         for thumbnail, drawTime in thumbnails:
+            Metrics.observe('thumbnail', drawTime)
+         return [ thumbnail for thumbnail, drawTime in thumbnails ]
+
+      images = await asyncio.gather(*[
+                  loop.run_in_executor(self.Executor, renderECG,
+                                       ecg, ecgType, ecgLengthInSeconds)
+                  for ecg in ecgs ])
+      results : list[PIL.Image.Image] = [ ]
+      for image, plotTime, encodeTime in images:
+         Metrics.observe('plotting', plotTime)
+         Metrics.observe('encoding', encodeTime)
+         results.append(PIL.Image.open(io.BytesIO(image)))
+      return results
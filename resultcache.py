@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import collections
+import concurrent.futures
+import hashlib
+import modelpool
+import numpy
+import os
+import pathlib
+import PIL
+import PIL.Image
+import threading
+import time
+import torch
+
+from metrics import Metrics
+from typing import Callable, Final
+from utilities import log
+
+
+# ###### Get the cache key of a seeded ECG ##################################
+# The key addresses the content: the same parameters always give the same
+# ECG. Therefore, it contains the seed of the ECG itself (see
+# modelpool.ecgSeeds()), instead of the seed of the run and the index. The
+# seeded noise differs between the random number generators of the device
+# types (e.g. CPU and CUDA). So, the device type is part of the key, for
+# caches shared by several devices.
+def cacheKey(generatorModel     : str,
+             device             : str,
+             ecgType            : int,
+             ecgLengthInSeconds : int,
+             ecgScaleFactor     : float,
+             seed               : int,
+             index              : int) -> str:
+   deviceType = torch.device(device).type
+   ecgSeed    = modelpool.ecgSeeds(seed, index, 1)[0]
+   return hashlib.sha256(
+             f'{generatorModel}|{deviceType}|{ecgType}|{ecgLengthInSeconds}|{ecgScaleFactor}|{ecgSeed}'.encode('utf-8')
+          ).hexdigest()
+
+
+# ###### On-disk cache of generated ECGs and their images ###################
+# Each entry consists of the generator output (<key>.npy) and the gallery
+# images (<key>-<kind>.png, kind is "plot" or "thumbnail"). When the cache
+# is larger than maxBytes, the least recently used entries are removed. The
+# usage order is kept in the file modification times, so that it survives
+# a restart. Files are written in the background, by a writer thread.
+class ResultCache:
+
+   # Partially written files of other processes (on any node sharing the
+   # directory) are only removed at startup when they are older than this
+   # number of seconds, since their writers may still be running:
+   PartialFileAge : Final[float] = 3600.0
+
+   # ###### Constructor #####################################################
+   def __init__(self, directory : pathlib.Path, maxBytes : int) -> None:
+      self.Lock      = threading.Lock()
+      self.Directory : Final[pathlib.Path] = directory
+      self.MaxBytes  : Final[int]          = maxBytes
+      self.Entries   : collections.OrderedDict[str,int] = collections.OrderedDict()
+      self.Bytes     : int = 0
+      self.Writer    = concurrent.futures.ThreadPoolExecutor(
+                          max_workers = 1, thread_name_prefix = 'ResultCache')
+
+      # ====== Find the existing entries ====================================
+      self.Directory.mkdir(parents = True, exist_ok = True)
+      entries : dict[str,tuple[float,int]] = { }
+      expiry  = time.time() - self.PartialFileAge
+      for fileName in self.Directory.glob('*/*'):
+         try:
+            status = fileName.stat()
+         except OSError:
+            continue   # Renamed or removed in the meantime
+         if fileName.name.startswith('.'):
+            if status.st_mtime < expiry:
+               fileName.unlink(missing_ok = True)   # Left over partial file
+            continue
+         key    = fileName.name[0:64]
+         mtime, size = entries.get(key, (0.0, 0))
+         entries[key] = ( max(mtime, status.st_mtime), size + status.st_size )
+      for key, (mtime, size) in sorted(entries.items(), key = lambda entry: entry[1][0]):
+         self.Entries[key] = size
+         self.Bytes        = self.Bytes + size
+      with self.Lock:
+         self.evict()
+      log(f'Result cache {self.Directory}: {len(self.Entries)} entries, ' +
+          f'{self.Bytes / 1048576:.1f} of {self.MaxBytes / 1048576:.1f} MiB')
+
+   # ###### Stop the writer thread ##########################################
+   def shutdown(self) -> None:
+      self.Writer.shutdown(wait = True)
+
+   # ###### Get the file name of an entry's file ############################
+   def fileName(self, key : str, suffix : str) -> pathlib.Path:
+      return self.Directory / key[0:2] / (key + suffix)
+
+   # ###### Get the generator output of an ECG ##############################
+   def getSignal(self, key : str) -> torch.Tensor | None:
+      try:
+         signal = torch.from_numpy(numpy.load(self.fileName(key, '.npy')))
+      except (OSError, ValueError):
+         Metrics.increment('result_cache_misses')
+         return None
+      self.touch(key)
+      Metrics.increment('result_cache_hits')
+      return signal
+
+   # ###### Get a gallery image of an ECG ###################################
+   def getImage(self, key : str, kind : str) -> PIL.Image.Image | None:
+      try:
+         image = PIL.Image.open(self.fileName(key, '-' + kind + '.png'))
+         image.load()
+      except (OSError, ValueError):
+         return None
+      self.touch(key)
+      return image
+
+   # ###### Store the generator output of an ECG ############################
+   def putSignal(self, key : str, signal : torch.Tensor) -> None:
+      self.Writer.submit(self.write, key, '.npy',
+                         lambda fileName: numpy.save(fileName, signal.numpy()))
+
+   # ###### Store a gallery image of an ECG #################################
+   # The image is copied, since it is also used by the GUI meanwhile.
+   def putImage(self, key : str, kind : str, image : PIL.Image.Image) -> None:
+      image = image.copy()
+      self.Writer.submit(self.write, key, '-' + kind + '.png',
+                         lambda fileName: image.save(fileName, format = 'PNG'))
+
+   # ###### Write a file of an entry (in the writer thread) #################
+   def write(self,
+             key    : str,
+             suffix : str,
+             writer : Callable[[pathlib.Path], None]) -> None:
+      fileName = self.fileName(key, suffix)
+      if fileName.exists():
+         return
+      try:
+         fileName.parent.mkdir(exist_ok = True)
+         # The process ID keeps processes sharing the cache apart. The
+         # suffix is kept, since numpy.save() and PIL use it:
+         partialName = fileName.with_name('.' + str(os.getpid()) + '-' + fileName.name)
+         writer(partialName)
+         os.replace(partialName, fileName)
+         size = fileName.stat().st_size
+      except OSError as error:
+         log(f'Result cache: Unable to write {fileName}: {error}')
+         return
+      with self.Lock:
+         self.Entries[key] = self.Entries.get(key, 0) + size
+         self.Entries.move_to_end(key)
+         self.Bytes = self.Bytes + size
+         self.evict()
+
+   # ###### Mark an entry as recently used ##################################
+   def touch(self, key : str) -> None:
+      with self.Lock:
+         if key in self.Entries:
+            self.Entries.move_to_end(key)
+      try:
+         os.utime(self.fileName(key, '.npy'))
+      except OSError:
+         pass
+
+   # ###### Remove least recently used entries (Lock must be held) ##########
+   def evict(self) -> None:
+      while (self.Bytes > self.MaxBytes) and (len(self.Entries) > 0):
+         key, size = self.Entries.popitem(last = False)
+         self.Bytes = self.Bytes - size
+         for fileName in (self.Directory / key[0:2]).glob(key + '*'):
+            fileName.unlink(missing_ok = True)
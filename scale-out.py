@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import getopt
+import httpx
+import loadbalancer
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+import uvicorn
+
+from utilities import log
+
+
+# ###### Wait until a local worker accepts requests #########################
+def waitForWorker(process : subprocess.Popen[bytes], backend : str) -> None:
+   while process.poll() is None:
+      try:
+         httpx.get(backend + '/', timeout = 5.0)
+         return
+      except httpx.TransportError:
+         time.sleep(1.0)
+   sys.stderr.write(f'ERROR: Worker {backend} exited with code {process.returncode}!\n')
+   sys.exit(1)
+
+
+# ###### Print usage and exit ###############################################
+def usage(exitCode : int = 0) -> typing.NoReturn:
+   sys.stdout.write('Usage: ' + sys.argv[0] +
+                    ' [-H|--host address] [-P|--port port] [-n|--workers workers]' +
+                    ' [-b|--backend URL] [-r|--routing sticky|hash]' +
+                    ' [-s|--session-store directory|redis://host[:port]]' +
+                    ' [-- app.py options]\n')
+   sys.exit(exitCode)
+
+
+
+# ###### Main program #######################################################
+
+# ====== Initialise =========================================================
+serverHost:      str       = '127.0.0.1'
+serverPort:      int       = 7860
+workers:         int       = 2
+backends:        list[str] = [ ]
+routing:         str       = 'sticky'
+sessionStoreURL: str       = os.path.join(tempfile.gettempdir(), 'DeepFakeECGPlus-Sessions')
+
+# ====== Check arguments ====================================================
+# The arguments after "--" are passed to the local workers (app.py).
+try:
+   options, args = getopt.gnu_getopt(
+      sys.argv[1:],
+      'H:P:n:b:r:s:',
+      [
+         'host=',
+         'port=',
+         'workers=',
+         'backend=',
+         'routing=',
+         'session-store='
+      ])
+   for option, optarg in options:
+      if option in ( '-H', '--host' ):
+         serverHost = optarg
+      elif option in ( '-P', '--port' ):
+         serverPort = int(optarg)
+      elif option in ( '-n', '--workers' ):
+         workers = int(optarg)
+      elif option in ( '-b', '--backend' ):
+         backends.append(optarg)
+      elif option in ( '-r', '--routing' ):
+         routing = optarg
+      elif option in ( '-s', '--session-store' ):
+         sessionStoreURL = optarg
+      else:
+         sys.stderr.write('ERROR: Invalid option ' + option + '!\n')
+         sys.exit(1)
+
+except getopt.GetoptError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
+except ValueError as error:
+   sys.stderr.write('ERROR: ' + str(error) + '\n')
+   usage(1)
+if ( (workers < 0) or (workers + len(backends) < 1) or
+     (not routing in ( 'sticky', 'hash' )) ):
+   usage(1)
+
+# ====== Start the local workers ============================================
+# Each worker is a server process of app.py, on the next ports after the
+# load balancer. All workers use the same session store.
+application = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+processes : list[tuple[subprocess.Popen[bytes],str]] = [ ]
+try:
+   for worker in range(0, workers):
+      port    = serverPort + 1 + worker
+      backend = f'http://127.0.0.1:{port}'
+      process = subprocess.Popen([ sys.executable, application,
+                                   '--host', '127.0.0.1', '--port', str(port),
+                                   '--session-store', sessionStoreURL ] + args)
+      processes.append( (process, backend) )
+   for process, backend in processes:
+      waitForWorker(process, backend)
+      log(f'Worker {backend} is ready')
+      backends.append(backend)
+
+   # ====== Run the load balancer ===========================================
+   log(f'Load balancer on http://{serverHost}:{serverPort}/ with {routing} routing ' +
+       f'to {len(backends)} backends: ' + ', '.join(backends))
+   balancer = loadbalancer.LoadBalancer(backends, routing)
+   uvicorn.run(balancer.App, host = serverHost, port = serverPort, log_level = 'warning',
+               server_header = False, date_header = False)
+
+# ====== Stop the local workers =============================================
+finally:
+   for process, backend in processes:
+      process.terminate()
+   for process, backend in processes:
+      process.wait()
+   log('Done!')
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import asyncio
+import collections
+import concurrent.futures
+import modelpool
+import threading
+import time
+import torch
+import typing
+
+from metrics import Metrics
+from typing import Final
+from utilities import log
+
+
+# ###### Scheduler is over its admission limit ##############################
+class SchedulerBusy(Exception):
+   pass
+
+
+# ###### Generation job of a session ########################################
+# The ECGs are generated chunk by chunk; iterating over the job returns the
+# chunks in order, as soon as they are ready. Async handlers iterate with
+# "async for", which does not block the event loop. With seeds, each ECG of the
+# job is generated from its own seed (see GeneratorModel.generate()).
+class GenerationJob:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                sessionID          : str,
+                model              : modelpool.GeneratorModel,
+                numberOfECGs       : int,
+                ecgLengthInSeconds : int,
+                ecgScaleFactor     : float,
+                chunkSize          : int,
+                seeds              : list[int] | None = None) -> None:
+      self.SessionID          : Final[str]                      = sessionID
+      self.Model              : Final[modelpool.GeneratorModel] = model
+      self.NumberOfECGs       : Final[int]                      = numberOfECGs
+      self.ECGLengthInSeconds : Final[int]                      = ecgLengthInSeconds
+      self.ECGScaleFactor     : Final[float]                    = ecgScaleFactor
+      self.Seeds              : Final[list[int] | None]         = seeds
+      self.Chunks             : collections.deque[int]          = \
+         collections.deque(min(chunkSize, numberOfECGs - firstECG)
+                           for firstECG in range(0, numberOfECGs, chunkSize))
+      self.NumberOfChunks     : Final[int]                      = len(self.Chunks)
+      self.Running            : bool                            = False
+      self.GeneratedECGs      : int                             = 0
+      self.Cancelled          : bool                            = False
+      self.SubmitTime         : Final[float]                    = time.monotonic()
+      self.StartTime          : float | None                    = None
+      self.Outputs            : Final[list[concurrent.futures.Future[list[torch.Tensor]]]] = \
+         [ concurrent.futures.Future() for chunk in range(0, self.NumberOfChunks) ]
+      self.FinishedChunks     : int                             = 0
+
+   # ###### Number of ECGs not yet generated ################################
+   def pendingECGs(self) -> int:
+      return sum(self.Chunks)
+
+   # ###### Get the generated chunks, in order ##############################
+   def __iter__(self) -> typing.Iterator[list[torch.Tensor]]:
+      for output in self.Outputs:
+         yield output.result()
+
+   async def __aiter__(self) -> typing.AsyncIterator[list[torch.Tensor]]:
+      for output in self.Outputs:
+         # Shielded, so that a cancelled handler does not cancel the output:
+         yield await asyncio.shield(asyncio.wrap_future(output))
+
+   # ###### Set the output of the next chunk (by the worker) ################
+   def finishChunk(self, output : list[torch.Tensor] | BaseException) -> None:
+      future = self.Outputs[self.FinishedChunks]
+      self.FinishedChunks = self.FinishedChunks + 1
+      if isinstance(output, BaseException):
+         future.set_exception(output)
+      else:
+         future.set_result(output)
+
+
+# ###### Fair scheduler for ECG generation ##################################
+# Jobs are split into chunks, which are taken round-robin from the sessions
+# with pending jobs. At most maxDeviceJobs batches are generated at the same
+# time, and at most maxInFlightECGs ECGs may be in flight. Only the next
+# chunk of each job is in flight, i.e. its ECGs are charged chunk by chunk,
+# as they are produced. So, a job of many (or long, segmented) ECGs cannot
+# block the admission of the other sessions' jobs.
+# Chunks of different sessions for the same model, ECG type and length are
+# merged into one inference batch of up to maxBatchSize ECGs, collected
+# within maxBatchWait seconds.
+class Scheduler:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                chunkSize        : int   = 8,
+                maxDeviceJobs    : int   = 1,
+                maxInFlightECGs  : int   = 1000,
+                maxBatchSize     : int   = 32,
+                maxBatchWait     : float = 0.005,
+                admissionTimeout : float = 30.0) -> None:
+      self.ChunkSize        : Final[int]   = chunkSize
+      self.MaxDeviceJobs    : Final[int]   = maxDeviceJobs
+      self.MaxInFlightECGs  : Final[int]   = maxInFlightECGs
+      self.MaxBatchSize     : Final[int]   = maxBatchSize
+      self.MaxBatchWait     : Final[float] = maxBatchWait
+      self.AdmissionTimeout : Final[float] = admissionTimeout
+
+      self.Condition        = threading.Condition()
+      self.Queue            : collections.OrderedDict[str,collections.deque[GenerationJob]] = \
+                                 collections.OrderedDict()
+      self.InFlightECGs     : int                      = 0
+      self.RunningChunks    : int                      = 0
+      self.BatchSizes       : collections.deque[int]   = collections.deque(maxlen = 1000)
+      self.WaitTimes        : collections.deque[float] = collections.deque(maxlen = 1000)
+      self.GeneratedECGs    : collections.Counter[str] = collections.Counter()
+      self.Stopped          : bool                     = False
+
+      self.Workers : list[threading.Thread] = [
+         threading.Thread(target = self.work, name = f'Generator-{i}', daemon = True)
+         for i in range(0, maxDeviceJobs) ]
+
+   # ###### Start the workers ###############################################
+   def start(self) -> None:
+      for worker in self.Workers:
+         worker.start()
+
+   # ###### Stop the workers ################################################
+   def shutdown(self) -> None:
+      with self.Condition:
+         self.Stopped = True
+         self.Condition.notify_all()
+      for worker in self.Workers:
+         worker.join()
+
+   # ###### Submit a job ####################################################
+   # Blocks while the in-flight limit is reached; raises SchedulerBusy if
+   # the first chunk of the job cannot be admitted within the admission
+   # timeout.
+   def submit(self,
+              sessionID          : str,
+              model              : modelpool.GeneratorModel,
+              numberOfECGs       : int,
+              ecgLengthInSeconds : int,
+              ecgScaleFactor     : float,
+              seeds              : list[int] | None = None) -> GenerationJob:
+
+      job = GenerationJob(sessionID, model, numberOfECGs,
+                          ecgLengthInSeconds, ecgScaleFactor, self.ChunkSize, seeds)
+      firstChunk = job.Chunks[0]
+      with self.Condition:
+         # A chunk larger than the limit is admitted on an idle server:
+         if not self.Condition.wait_for(
+                   lambda: ( (self.InFlightECGs == 0) or
+                             (self.InFlightECGs + firstChunk <= self.MaxInFlightECGs) ),
+                   timeout = self.AdmissionTimeout):
+            raise SchedulerBusy(f'{self.InFlightECGs} ECGs in flight')
+         self.InFlightECGs = self.InFlightECGs + firstChunk
+         if not sessionID in self.Queue:
+            self.Queue[sessionID] = collections.deque()
+         self.Queue[sessionID].append(job)
+         self.Condition.notify_all()
+      return job
+
+   # ###### Cancel the remaining chunks of a job ############################
+   def cancel(self, job : GenerationJob) -> None:
+      with self.Condition:
+         if not job.Cancelled:
+            # A chunk that is currently running is accounted for by its worker.
+            # Otherwise, the next chunk is in flight:
+            job.Cancelled = True
+            if (not job.Running) and (len(job.Chunks) > 0):
+               self.InFlightECGs = self.InFlightECGs - job.Chunks[0]
+            job.Chunks.clear()
+            self.removeJob(job)
+            self.Condition.notify_all()
+
+   # ###### Remove a job from the queue (Condition must be held) ############
+   def removeJob(self, job : GenerationJob) -> None:
+      jobs = self.Queue.get(job.SessionID)
+      if (jobs is not None) and (job in jobs):
+         jobs.remove(job)
+         if len(jobs) == 0:
+            del self.Queue[job.SessionID]
+
+   # ###### Check whether two jobs can share an inference batch #############
+   @staticmethod
+   def batchable(job1 : GenerationJob, job2 : GenerationJob) -> bool:
+      return ( (job1.Model is job2.Model) and
+               (job1.ECGLengthInSeconds == job2.ECGLengthInSeconds) and
+               (job1.ECGScaleFactor == job2.ECGScaleFactor) and
+               ((job1.Seeds is None) == (job2.Seeds is None)) )
+
+   # ###### Get the next chunk, round-robin (Condition must be held) ########
+   # With batchWith, only a chunk that fits into the batch is returned.
+   def nextChunk(self,
+                 batchWith : GenerationJob | None = None,
+                 maxECGs   : int | None           = None) -> tuple[GenerationJob,int] | None:
+      for sessionID, jobs in self.Queue.items():
+         job = jobs[0]
+         if batchWith is not None:
+            if ( (not self.batchable(job, batchWith)) or
+                 ((maxECGs is not None) and (job.Chunks[0] > maxECGs)) ):
+               continue
+         if not job.Running:   # Chunks of a job are generated in order
+            job.Running = True
+            chunk       = job.Chunks.popleft()
+            if len(job.Chunks) == 0:
+               self.removeJob(job)
+            elif sessionID in self.Queue:
+               self.Queue.move_to_end(sessionID)
+            if job.StartTime is None:
+               job.StartTime = time.monotonic()
+               self.WaitTimes.append(job.StartTime - job.SubmitTime)
+            return (job, chunk)
+      return None
+
+   # ###### Collect a batch of chunks (Condition must be held) ##############
+   def nextBatch(self) -> list[tuple[GenerationJob,int]] | None:
+      scheduled = self.nextChunk()
+      while (scheduled is None) and (not self.Stopped):
+         self.Condition.wait()
+         scheduled = self.nextChunk()
+      if scheduled is None:
+         return None
+
+      # ====== Add chunks of other sessions arriving within the window ======
+      batch     = [ scheduled ]
+      batchSize = scheduled[1]
+      deadline  = time.monotonic() + self.MaxBatchWait
+      while (batchSize < self.MaxBatchSize) and (not self.Stopped):
+         scheduled = self.nextChunk(batchWith = batch[0][0],
+                                    maxECGs   = self.MaxBatchSize - batchSize)
+         if scheduled is not None:
+            batch.append(scheduled)
+            batchSize = batchSize + scheduled[1]
+         else:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.0:
+               break
+            self.Condition.wait(remaining)
+      return batch
+
+   # ###### Worker thread ###################################################
+   def work(self) -> None:
+      while True:
+         with self.Condition:
+            batch = self.nextBatch()
+            if batch is None:
+               return
+            batchSize = sum(chunk for job, chunk in batch)
+            self.RunningChunks = self.RunningChunks + len(batch)
+            self.BatchSizes.append(batchSize)
+
+         # ====== Generate the batch, split it into the chunks ==============
+         outputs : list[list[torch.Tensor] | BaseException]
+         try:
+            # The chunks of a job are generated in order, one at a time:
+            first = batch[0][0]
+            seeds : list[int] | None = None
+            if first.Seeds is not None:
+               seeds = [ ]
+               for job, chunk in batch:
+                  jobSeeds = typing.cast(list[int], job.Seeds)   # See batchable()
+                  seeds.extend(jobSeeds[job.GeneratedECGs : job.GeneratedECGs + chunk])
+            with Metrics.span('generation'):
+               results = first.Model.generate(batchSize,
+                                              ecgLengthInSeconds = first.ECGLengthInSeconds,
+                                              ecgScaleFactor     = first.ECGScaleFactor,
+                                              seeds              = seeds)
+            Metrics.increment('ecgs_generated', batchSize)
+            outputs = [ ]
+            offset  = 0
+            for job, chunk in batch:
+               outputs.append(results[offset : offset + chunk])
+               offset = offset + chunk
+         except Exception as exception:
+            outputs = [ exception ] * len(batch)
+
+         with self.Condition:
+            self.RunningChunks = self.RunningChunks - len(batch)
+            for (job, chunk), output in zip(batch, outputs):
+               self.InFlightECGs = self.InFlightECGs - chunk
+               job.Running       = False
+               job.GeneratedECGs = job.GeneratedECGs + chunk
+               self.GeneratedECGs[job.SessionID] += chunk
+               if not job.Cancelled:
+                  if isinstance(output, BaseException):
+                     # The job has failed, drop its remaining chunks:
+                     job.Chunks.clear()
+                     self.removeJob(job)
+                  elif len(job.Chunks) > 0:
+                     # The next chunk of the job is in flight now:
+                     self.InFlightECGs = self.InFlightECGs + job.Chunks[0]
+            self.Condition.notify_all()
+         for (job, chunk), output in zip(batch, outputs):
+            job.finishChunk(output)
+
+   # ###### Forget a session ################################################
+   def removeSession(self, sessionID : str) -> None:
+      with self.Condition:
+         del self.GeneratedECGs[sessionID]
+
+   # ###### Get statistics ##################################################
+   def statistics(self) -> dict[str,typing.Any]:
+      with self.Condition:
+         waitTimes = sorted(self.WaitTimes)
+         total     = sum(self.GeneratedECGs.values())
+         return {
+            'queued_jobs':    sum(len(jobs) for jobs in self.Queue.values()),
+            'batch_size':     sum(self.BatchSizes) / len(self.BatchSizes) if self.BatchSizes else 0.0,
+            'queued_ecgs':    self.InFlightECGs,
+            'running_chunks': self.RunningChunks,
+            'wait_time_p50':  waitTimes[len(waitTimes) // 2] if waitTimes else 0.0,
+            'wait_time_p99':  waitTimes[(len(waitTimes) * 99) // 100] if waitTimes else 0.0,
+            'session_share':  { sessionID: generated / total
+                                for sessionID, generated in self.GeneratedECGs.items() }
+         }
+
+   # ###### Log statistics ##################################################
+   def report(self) -> None:
+      statistics = self.statistics()
+      log(f'Scheduler: {statistics["queued_jobs"]} jobs queued, ' +
+          f'{statistics["queued_ecgs"]} ECGs in flight, ' +
+          f'{statistics["running_chunks"]} chunks running, ' +
+          f'mean batch size {statistics["batch_size"]:.1f}, ' +
+          f'wait time p50={statistics["wait_time_p50"]:.3f} s ' +
+          f'p99={statistics["wait_time_p99"]:.3f} s')
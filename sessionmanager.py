@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import collections
+import threading
+import time
+import typing
+
+from metrics import Metrics
+from typing import Final
+from utilities import log
+
+
+# ###### Interface of a managed session #####################################
+class ManagedSession(typing.Protocol):
+   # Release everything: figures, results, temporary files.
+   def close(self) -> None: ...
+   # True while a request is working on the session.
+   def busy(self) -> bool: ...
+   # Memory and disk usage in bytes.
+   def memoryUsage(self) -> int: ...
+   def diskUsage(self) -> int: ...
+
+
+SessionType = typing.TypeVar('SessionType', bound = ManagedSession)
+
+
+# ###### Session manager ####################################################
+# Keeps the sessions in least-recently used order. A background thread
+# closes sessions that have been idle for more than idleTimeout seconds,
+# and evicts the least-recently used ones while the sessions use more than
+# maxMemory bytes of memory or maxDisk bytes of temporary files. Busy
+# sessions and the most recently used session are never evicted. A limit
+# of 0 means no limit.
+class SessionManager(typing.Generic[SessionType]):
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                idleTimeout   : float = 3600.0,
+                maxMemory     : int   = 0,
+                maxDisk       : int   = 0,
+                checkInterval : float = 10.0) -> None:
+      self.IdleTimeout   : Final[float] = idleTimeout
+      self.MaxMemory     : Final[int]   = maxMemory
+      self.MaxDisk       : Final[int]   = maxDisk
+      self.CheckInterval : Final[float] = checkInterval
+
+      self.Lock     = threading.Lock()
+      self.Sessions : collections.OrderedDict[str,SessionType] = collections.OrderedDict()
+      self.LastUsed : dict[str,float] = { }
+      self.Stop     = threading.Event()
+      self.Thread   = threading.Thread(target = self.run, name = 'SessionManager',
+                                       daemon = True)
+
+   # ###### Number of sessions ##############################################
+   def __len__(self) -> int:
+      with self.Lock:
+         return len(self.Sessions)
+
+   # ###### Start the background thread #####################################
+   def start(self) -> None:
+      self.Thread.start()
+
+   # ###### Stop the background thread, close all sessions ##################
+   def shutdown(self) -> None:
+      self.Stop.set()
+      if self.Thread.is_alive():
+         self.Thread.join()
+      with self.Lock:
+         sessions = list(self.Sessions.values())
+         self.Sessions.clear()
+         self.LastUsed.clear()
+      for session in sessions:
+         session.close()
+
+   # ###### Add a session ###################################################
+   # An existing session of the same ID is kept, since requests may already
+   # be working on it; then, the new session is closed. Returns the session
+   # that is in use.
+   def add(self, sessionID : str, session : SessionType) -> SessionType:
+      with self.Lock:
+         existing = self.Sessions.get(sessionID)
+         if existing is None:
+            self.Sessions[sessionID] = session
+         self.LastUsed[sessionID] = time.monotonic()
+      if existing is not None:
+         session.close()
+         return existing
+      return session
+
+   # ###### Get a session, marking it as used ###############################
+   # Returns None if the session does not exist (any more).
+   def get(self, sessionID : str) -> SessionType | None:
+      with self.Lock:
+         session = self.Sessions.get(sessionID)
+         if session is not None:
+            self.Sessions.move_to_end(sessionID)
+            self.LastUsed[sessionID] = time.monotonic()
+         return session
+
+   # ###### Remove and close a session ######################################
+   def remove(self, sessionID : str) -> bool:
+      with self.Lock:
+         session = self.Sessions.pop(sessionID, None)
+         self.LastUsed.pop(sessionID, None)
+      if session is None:
+         return False
+      session.close()
+      return True
+
+   # ###### Memory and disk usage of all sessions ###########################
+   def memoryUsage(self) -> int:
+      with self.Lock:
+         sessions = list(self.Sessions.values())
+      return sum(session.memoryUsage() for session in sessions)
+
+   def diskUsage(self) -> int:
+      with self.Lock:
+         sessions = list(self.Sessions.values())
+      return sum(session.diskUsage() for session in sessions)
+
+   # ###### Background thread ###############################################
+   def run(self) -> None:
+      while not self.Stop.wait(self.CheckInterval):
+         try:
+            self.sweep()
+         except Exception as error:
+            log(f'Session manager: sweep failed: {error}')
+
+   # ###### Close idle sessions, evict sessions over the budgets ############
+   def sweep(self) -> None:
+      # ====== Close idle sessions ==========================================
+      now = time.monotonic()
+      expired : list[tuple[str,SessionType]] = [ ]
+      with self.Lock:
+         candidates = [ ( sessionID, session )
+                        for sessionID, session in list(self.Sessions.items())[:-1]
+                        if not session.busy() ]
+         if self.IdleTimeout > 0:
+            for sessionID, session in list(self.Sessions.items()):
+               if ( (now - self.LastUsed[sessionID] > self.IdleTimeout) and
+                    (not session.busy()) ):
+                  expired.append( ( sessionID, session ) )
+      for sessionID, session in expired:
+         self.expire(sessionID, session, 'idle')
+
+      # ====== Evict least-recently used sessions over the budgets ==========
+      if self.MaxMemory > 0:
+         self.evict(candidates, self.MaxMemory,
+                    lambda session: session.memoryUsage(), 'memory budget')
+      if self.MaxDisk > 0:
+         self.evict(candidates, self.MaxDisk,
+                    lambda session: session.diskUsage(), 'disk budget')
+
+   # ###### Evict sessions, until the usage is within the limit #############
+   def evict(self,
+             candidates : list[tuple[str,SessionType]],
+             limit      : int,
+             usage      : typing.Callable[[SessionType], int],
+             reason     : str) -> None:
+      with self.Lock:
+         sessions = list(self.Sessions.values())
+      total = sum(usage(session) for session in sessions)
+      for sessionID, session in candidates:
+         if total <= limit:
+            break
+         size = usage(session)
+         if self.expire(sessionID, session, reason):
+            total = total - size
+
+   # ###### Remove and close a session, if it is still unchanged ############
+   # The session may have become busy since it was selected. So, this is
+   # checked again, while holding the lock.
+   def expire(self, sessionID : str, session : SessionType, reason : str) -> bool:
+      with self.Lock:
+         if self.Sessions.get(sessionID) is not session:
+            return False   # Already removed, or replaced in the meantime
+         if session.busy():
+            return False
+         del self.Sessions[sessionID]
+         del self.LastUsed[sessionID]
+         remaining = len(self.Sessions)
+      session.close()
+      Metrics.increment('sessions_expired' if reason == 'idle' else 'sessions_evicted')
+      log(f'Session "{sessionID}" closed ({reason}) => {remaining} active sessions')
+      return True
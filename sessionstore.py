@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import io
+import json
+import numpy
+import os
+import pathlib
+import re
+import threading
+import time
+import typing
+
+from ecgresults import ECGResults
+from typing import Any, Final
+from utilities import log
+
+
+# ###### State of a session, as kept in the session store ###################
+# Results of None mean that the session shows the demo batch, which is not
+# stored with every session.
+class SessionState:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                counter   : int,
+                selected  : int,
+                cacheKeys : list[str] | None,
+                results   : ECGResults | None) -> None:
+      self.Counter   : Final[int]                = counter
+      self.Selected  : Final[int]                = selected
+      self.CacheKeys : Final[list[str] | None]   = cacheKeys
+      self.Results   : Final[ECGResults | None]  = results
+
+
+# ###### Encode the state, without the result data, as JSON #################
+def encodeState(state : SessionState) -> str:
+   metadata : dict[str,Any] = {
+      'counter':    state.Counter,
+      'selected':   state.Selected,
+      'cache_keys': state.CacheKeys,
+      'demo':       state.Results is None
+   }
+   if state.Results is not None:
+      metadata['type']         = state.Results.Type
+      metadata['compact']      = state.Results.Compact
+      metadata['scale_factor'] = state.Results.ScaleFactor
+   return json.dumps(metadata)
+
+
+# ###### Decode the state, with the result data #############################
+def decodeState(metadata : dict[str,Any], data : numpy.ndarray | None) -> SessionState:
+   results = None
+   if data is not None:
+      results = ECGResults(metadata['type'], 0, 0, metadata['compact'],
+                           metadata['scale_factor'], data = data)
+   return SessionState(metadata['counter'], metadata['selected'],
+                       metadata['cache_keys'], results)
+
+
+# ###### Interface of a session store #######################################
+# The session store keeps the state of the sessions outside of the server
+# process, so that any server process can continue a session. Entries
+# expire after timeout seconds without save() or load().
+class SessionStore(typing.Protocol):
+   # Store the state of a session. Without withResults, the stored results
+   # are kept.
+   def save(self,
+            sessionID   : str,
+            state       : SessionState,
+            withResults : bool = True) -> None: ...
+   # Get the state of a session. None if it is not in the store (any more).
+   def load(self, sessionID : str) -> SessionState | None: ...
+   # Remove a session.
+   def remove(self, sessionID : str) -> None: ...
+
+
+# ###### Interface of a Redis client ########################################
+# The subset of redis.Redis used by RedisSessionStore.
+class RedisClient(typing.Protocol):
+   def get(self, name : str) -> bytes | None: ...
+   def set(self, name : str, value : bytes | str, ex : int | None = None) -> Any: ...
+   def delete(self, *names : str) -> Any: ...
+   def expire(self, name : str, time : int) -> Any: ...
+
+
+# ###### Session store in a (shared) directory ##############################
+# Each session has its state (<session>.json) and its results
+# (<session>.<counter>.npy, numbered by the batch counter). The results are
+# memory-mapped on load, so that only the ECGs actually used are read. New
+# files are written under temporary names and renamed, so that other
+# processes never see partially written files. Expired entries are removed
+# by save(), at most once per SweepInterval seconds.
+class FileSessionStore:
+
+   SweepInterval : Final[float] = 60.0
+
+   # ###### Constructor #####################################################
+   def __init__(self, directory : pathlib.Path, timeout : int) -> None:
+      self.Timeout   : Final[int]          = timeout
+      self.Directory : Final[pathlib.Path] = directory
+      self.Lock      = threading.Lock()
+      self.LastSweep : float = 0.0
+      self.Directory.mkdir(parents = True, exist_ok = True)
+      log(f'Session store in {self.Directory}')
+
+   # ###### Get the file name of a session's file ###########################
+   # Session IDs must not contain ".", which separates the batch counter.
+   def fileName(self, sessionID : str, suffix : str) -> pathlib.Path:
+      if re.fullmatch(r'[A-Za-z0-9_-]+', sessionID) is None:
+         raise ValueError(f'Invalid session ID {sessionID}')
+      return self.Directory / (sessionID + suffix)
+
+   # ###### Get the temporary name to write a file to #######################
+   @staticmethod
+   def partialName(fileName : pathlib.Path) -> pathlib.Path:
+      return fileName.with_name('.' + fileName.name + '.' + str(os.getpid()))
+
+   # ###### Write a file under a temporary name, then rename it #############
+   def write(self, fileName : pathlib.Path, content : bytes) -> None:
+      partialName = self.partialName(fileName)
+      partialName.write_bytes(content)
+      os.replace(partialName, fileName)
+
+   # ###### Store the state of a session ####################################
+   def save(self,
+            sessionID   : str,
+            state       : SessionState,
+            withResults : bool = True) -> None:
+      stateFile = self.fileName(sessionID, '.json')
+      if withResults and (state.Results is not None):
+         # Written directly into the file, since long ECGs may be too large
+         # to be copied into memory:
+         resultsFile = self.fileName(sessionID, f'.{state.Counter}.npy')
+         partialName = self.partialName(resultsFile)
+         with open(partialName, 'wb') as output:
+            numpy.save(output, state.Results.Data[0:len(state.Results)])
+         os.replace(partialName, resultsFile)
+      self.write(stateFile, encodeState(state).encode('utf-8'))
+
+      # ====== Remove outdated results ======================================
+      # Processes having them memory-mapped can still use them.
+      if withResults:
+         for fileName in self.Directory.glob(sessionID + '.*.npy'):
+            if fileName.name != f'{sessionID}.{state.Counter}.npy':
+               fileName.unlink(missing_ok = True)
+
+      with self.Lock:
+         sweep = time.time() - self.LastSweep >= self.SweepInterval
+         if sweep:
+            self.LastSweep = time.time()
+      if sweep:
+         self.sweep()
+
+   # ###### Get the state of a session ######################################
+   def load(self, sessionID : str) -> SessionState | None:
+      stateFile = self.fileName(sessionID, '.json')
+      try:
+         metadata = json.loads(stateFile.read_text(encoding = 'utf-8'))
+         data     = None
+         if not metadata['demo']:
+            data = numpy.load(self.fileName(sessionID, f'.{metadata["counter"]}.npy'),
+                              mmap_mode = 'r')
+         os.utime(stateFile)
+      except (OSError, ValueError):
+         return None
+      return decodeState(metadata, data)
+
+   # ###### Remove a session ################################################
+   def remove(self, sessionID : str) -> None:
+      self.fileName(sessionID, '.json').unlink(missing_ok = True)
+      for fileName in self.Directory.glob(sessionID + '.*.npy'):
+         fileName.unlink(missing_ok = True)
+
+   # ###### Remove expired sessions #########################################
+   def sweep(self) -> None:
+      expiry = time.time() - self.Timeout
+      for stateFile in self.Directory.glob('*.json'):
+         try:
+            expired = stateFile.stat().st_mtime < expiry
+         except OSError:
+            continue   # Removed in the meantime
+         if expired:
+            log(f'Session store: Session "{stateFile.stem}" expired')
+            self.remove(stateFile.stem)
+
+
+# ###### Session store in Redis #############################################
+# Each session has its state (<prefix><session>:state) and its results
+# (<prefix><session>:results, in NumPy format), with the timeout as expiry
+# time. The client only needs the get(), set(), delete() and expire()
+# methods of redis.Redis. So, any Redis-compatible server can be used, and
+# a local stand-in can replace the client in tests. Redis values are held in
+# memory, by the server and when loaded. So, results of more than
+# maxResultsBytes (e.g. long ECGs) are not stored; such sessions cannot be
+# restored.
+class RedisSessionStore:
+
+   # ###### Constructor #####################################################
+   def __init__(self,
+                client          : RedisClient,
+                timeout         : int,
+                prefix          : str = 'DeepFakeECGPlus:',
+                maxResultsBytes : int = 64 * 1048576) -> None:
+      self.Timeout         : Final[int]         = timeout
+      self.Client          : Final[RedisClient] = client
+      self.Prefix          : Final[str]         = prefix
+      self.MaxResultsBytes : Final[int]         = maxResultsBytes
+
+   # ###### Store the state of a session ####################################
+   # The results are written first, so that the state never refers to
+   # missing results.
+   def save(self,
+            sessionID   : str,
+            state       : SessionState,
+            withResults : bool = True) -> None:
+      key = self.Prefix + sessionID
+      if (state.Results is not None) and \
+         (state.Results.Data[0:len(state.Results)].nbytes > self.MaxResultsBytes):
+         if withResults:
+            log(f'Session store: Results of session "{sessionID}" are too large to be stored')
+         self.Client.delete(key + ':state', key + ':results')
+         return
+      if withResults:
+         if state.Results is not None:
+            buffer = io.BytesIO()
+            numpy.save(buffer, state.Results.Data[0:len(state.Results)])
+            self.Client.set(key + ':results', buffer.getvalue(), ex = self.Timeout)
+         else:
+            self.Client.delete(key + ':results')
+      else:
+         self.Client.expire(key + ':results', self.Timeout)
+      self.Client.set(key + ':state', encodeState(state), ex = self.Timeout)
+
+   # ###### Get the state of a session ######################################
+   def load(self, sessionID : str) -> SessionState | None:
+      key   = self.Prefix + sessionID
+      state = self.Client.get(key + ':state')
+      if state is None:
+         return None
+      metadata = json.loads(state)
+      data     = None
+      if not metadata['demo']:
+         results = self.Client.get(key + ':results')
+         if results is None:
+            return None
+         data = numpy.load(io.BytesIO(results))
+      self.Client.expire(key + ':state',   self.Timeout)
+      self.Client.expire(key + ':results', self.Timeout)
+      return decodeState(metadata, data)
+
+   # ###### Remove a session ################################################
+   def remove(self, sessionID : str) -> None:
+      key = self.Prefix + sessionID
+      self.Client.delete(key + ':state', key + ':results')
+
+
+# ###### Open a session store ###############################################
+# redis://, rediss:// and unix:// URLs are Redis servers (needs the redis
+# module), anything else is a directory (optionally as file:// URL).
+def openSessionStore(url : str, timeout : int) -> SessionStore:
+   if url.startswith( ('redis://', 'rediss://', 'unix://') ):
+      import redis
+      log(f'Session store at {url}')
+      return RedisSessionStore(redis.Redis.from_url(url), timeout)
+   if url.startswith('file://'):
+      url = url[7:]
+   return FileSessionStore(pathlib.Path(url), timeout)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+
+import deepfakeecg
+import numpy
+import os
+import pathlib
+import pytest
+import sys
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ecgresults
+from ecgresults import ECGResults
+
+
+Samples : int = 25 * deepfakeecg.ECG_SAMPLING_RATE   # 3 pages, the last one half
+
+
+# ###### Create the leads of ECGs in µV #####################################
+def makeLeads(numberOfECGs : int, samples : int = Samples) -> numpy.ndarray:
+   generator = numpy.random.default_rng(1)
+   return generator.integers(-5000, 5000, (numberOfECGs, 8, samples), dtype = numpy.int32)
+
+
+# ###### Convert leads into the generator output layout #####################
+# (samples, 1 + leads), timestamp in ms, leads in µV.
+def generatorOutput(leads : numpy.ndarray, start : int = 0) -> torch.Tensor:
+   timestamps = numpy.arange(start, start + leads.shape[1], dtype = numpy.int32) * \
+                   (1000 // deepfakeecg.ECG_SAMPLING_RATE)
+   return torch.from_numpy(numpy.vstack( (timestamps, leads) ).T.copy())
+
+
+# ###### Create results from segments of 10 s ###############################
+# The last segment of each ECG is longer than needed, like from the
+# generator, and is cut.
+def makeResults(leads    : numpy.ndarray,
+                compact  : bool = False,
+                fileName : pathlib.Path | None = None) -> ECGResults:
+   results  = ECGResults(deepfakeecg.DATA_ECG8, leads.shape[0], Samples, compact,
+                         fileName = fileName)
+   segment  = 10 * deepfakeecg.ECG_SAMPLING_RATE
+   for ecg in leads:
+      padded = numpy.pad(ecg, ( (0, 0), (0, segment) ))
+      for start in range(0, Samples, segment):
+         results.append([ generatorOutput(padded[:, start:start + segment], start) ])
+   return results
+
+
+# ###### Segments are appended until an ECG is complete #####################
+@pytest.mark.parametrize('compact', [ False, True ])
+def testAppend(compact : bool) -> None:
+   leads   = makeLeads(2)
+   results = makeResults(leads, compact)
+   assert len(results) == 2
+   assert results.Data.dtype == (numpy.int16 if compact else numpy.float32)
+   for index in range(0, 2):
+      ecg = results.ecg(index)
+      assert ecg.dtype == numpy.float32
+      assert numpy.array_equal(numpy.rint(ecg * 1000), leads[index])
+      assert numpy.array_equal(numpy.rint(results.lead(index, 1) * 1000), leads[index, 1])
+   with pytest.raises(IndexError):
+      results.ecg(2)
+
+
+# ###### Long ECGs are read page by page ####################################
+def testPages() -> None:
+   leads   = makeLeads(1)
+   results = makeResults(leads)
+   pageSamples = ecgresults.PageLengthInSeconds * deepfakeecg.ECG_SAMPLING_RATE
+   assert results.lengthInSeconds() == 25
+   assert results.pages() == 3
+   assert results.page(0, 2).shape == (8, Samples - 2 * pageSamples)
+   assert numpy.array_equal(numpy.concatenate(list(results.iteratePages(0)), axis = 1),
+                            results.ecg(0))
+   assert numpy.array_equal(results.page(0, 1), results.ecg(0, pageSamples, 2 * pageSamples))
+
+
+# ###### Parts of an ECG keep their timestamps ##############################
+@pytest.mark.parametrize('compact', [ False, True ])
+def testTensor(compact : bool) -> None:
+   leads   = makeLeads(2)
+   results = makeResults(leads, compact)
+   assert torch.equal(results.tensor(1), generatorOutput(leads[1]))
+   assert torch.equal(results.tensor(1, 5000, 7500),
+                      generatorOutput(leads[1, :, 5000:7500], 5000))
+   assert torch.equal(results.tensor(0, 12000), generatorOutput(leads[0, :, 12000:], 12000))
+
+
+# ###### Long ECGs are memory-mapped from a file ############################
+def testMemoryMapped(tmp_path : pathlib.Path) -> None:
+   leads   = makeLeads(2)
+   results = makeResults(leads, compact = True, fileName = tmp_path / 'Results.npy')
+   assert isinstance(results.Data, numpy.memmap)
+   assert results.memoryBytes() == 0
+   assert results.nbytes() == ecgresults.resultsSize(deepfakeecg.DATA_ECG8, 2, Samples, True)
+   results.Data.flush()
+   assert numpy.array_equal(numpy.load(tmp_path / 'Results.npy', mmap_mode = 'r'), leads)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+
+import deepfakeecg
+import io
+import json
+import numpy
+import os
+import pathlib
+import pytest
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export
+import renderer
+from ecgresults import ECGResults
+
+
+# ###### Results to export ##################################################
+@pytest.fixture(params = [ False, True ], ids = [ 'mV', 'compact' ])
+def results(request : pytest.FixtureRequest) -> ECGResults:
+   compact   = request.param
+   results   = ECGResults(deepfakeecg.DATA_ECG12, 3, 1000, compact)
+   generator = numpy.random.default_rng(1)
+   values    = generator.integers(-5000, 5000, results.Data.shape)
+   results.Data[:] = values if compact else values * numpy.float32(0.001)
+   results.Count   = 3
+   return results
+
+
+# ###### Get the ECGs in µV #################################################
+def microvolts(data : numpy.ndarray) -> numpy.ndarray:
+   return data.astype(numpy.int32) if data.dtype == numpy.int16 else \
+             numpy.rint(data * 1000).astype(numpy.int32)
+
+
+# ###### NPY: ZIP with data and metadata ####################################
+def testNPY(results : ECGResults, tmp_path : pathlib.Path) -> None:
+   exporter = export.ExportPool(1)
+   for index, name, numbers in [ ( None, 'ECGs',  [ 1, 2, 3 ] ),
+                                 ( 1,    'ECG-2', [ 2 ] ) ]:
+      fileName = exporter.exportBinary(results, 'NPY', tmp_path, index)
+      assert fileName == tmp_path / (name + '-NPY.zip')
+      with zipfile.ZipFile(fileName) as archive:
+         assert sorted(archive.namelist()) == [ name + '.json', name + '.npy' ]
+         data     = numpy.load(io.BytesIO(archive.read(name + '.npy')))
+         metadata = json.loads(archive.read(name + '.json'))
+      first = numbers[0] - 1
+      assert data.dtype == results.Data.dtype
+      assert numpy.array_equal(data, results.Data[first:first + len(numbers)])
+      assert metadata == export.binaryMetadata(results, numbers)
+      assert metadata['lead_names'] == renderer.LeadIndex[deepfakeecg.DATA_ECG12]
+      assert metadata['units'] == ('uV' if results.Compact else 'mV')
+
+
+# ###### NPZ: data and metadata members #####################################
+def testNPZ(results : ECGResults, tmp_path : pathlib.Path) -> None:
+   fileName = export.ExportPool(1).exportBinary(results, 'NPZ', tmp_path)
+   with numpy.load(fileName) as npz:
+      assert numpy.array_equal(npz['ecgs'], results.Data)
+      assert json.loads(str(npz['metadata'])) == export.binaryMetadata(results, [ 1, 2, 3 ])
+
+
+# ###### HDF5: dataset with metadata attributes #############################
+def testHDF5(results : ECGResults, tmp_path : pathlib.Path) -> None:
+   h5py = pytest.importorskip('h5py')
+   fileName = export.ExportPool(1).exportBinary(results, 'HDF5', tmp_path)
+   with h5py.File(fileName, 'r') as hdf5:
+      assert numpy.array_equal(hdf5['ecgs'][:], results.Data)
+      assert list(hdf5['ecgs'].attrs['lead_names']) == renderer.LeadIndex[deepfakeecg.DATA_ECG12]
+      assert list(hdf5['ecgs'].attrs['ecg_numbers']) == [ 1, 2, 3 ]
+
+
+# ###### Parquet: one row per sample ########################################
+def testParquet(results : ECGResults,
+                tmp_path : pathlib.Path,
+                monkeypatch : pytest.MonkeyPatch) -> None:
+   pytest.importorskip('pyarrow')
+   import pyarrow.parquet
+   # Small row groups, so that ECGs are split over several groups:
+   monkeypatch.setattr(export, 'ParquetRowGroupRows', 400)
+   fileName = export.ExportPool(1).exportBinary(results, 'Parquet', tmp_path)
+   parquetFile = pyarrow.parquet.ParquetFile(fileName)
+   assert parquetFile.metadata.num_row_groups > 3
+   table = parquetFile.read()
+   assert json.loads(table.schema.metadata[b'deepfakeecg']) == \
+             export.binaryMetadata(results, [ 1, 2, 3 ])
+   ecg  = table.column('ecg').to_numpy()
+   time = table.column('time_ms').to_numpy()
+   for index in range(0, 3):
+      rows = (ecg == index + 1)
+      assert numpy.array_equal(time[rows], numpy.arange(0, 1000) * 2)
+      for lead, leadName in enumerate(renderer.LeadIndex[deepfakeecg.DATA_ECG12]):
+         assert numpy.array_equal(table.column(leadName).to_numpy()[rows],
+                                  results.Data[index, lead])
+
+
+# ###### WFDB: ZIP with one record per ECG ##################################
+def testWFDB(results : ECGResults, tmp_path : pathlib.Path) -> None:
+   fileName = export.ExportPool(1).exportBinary(results, 'WFDB', tmp_path)
+   with zipfile.ZipFile(fileName) as archive:
+      assert archive.read('RECORDS').decode('ascii').split() == [ 'ECG-1', 'ECG-2', 'ECG-3' ]
+      for index in range(0, 3):
+         record = 'ECG-' + str(index + 1)
+         header = archive.read(record + '.hea').decode('ascii').splitlines()
+         assert header[0] == f'{record} 12 {deepfakeecg.ECG_SAMPLING_RATE} 1000'
+         data = numpy.frombuffer(archive.read(record + '.dat'), dtype = '<i2').reshape(1000, 12)
+         assert numpy.array_equal(data.T, microvolts(results.Data[index]))
+      archive.extractall(tmp_path / 'WFDB')
+
+   # With the wfdb module, the records are read like from PhysioNet:
+   wfdb = pytest.importorskip('wfdb')
+   record = wfdb.rdrecord(str(tmp_path / 'WFDB' / 'ECG-2'), physical = False)
+   assert record.sig_name == renderer.LeadIndex[deepfakeecg.DATA_ECG12]
+   assert numpy.array_equal(record.d_signal.T, microvolts(results.Data[1]))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import httpx
+import os
+import sys
+import starlette.testclient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loadbalancer
+
+
+# ###### Create a streamed backend response #################################
+def respond(statusCode : int, text : str) -> httpx.Response:
+   return httpx.Response(statusCode, stream = httpx.ByteStream(text.encode('utf-8')))
+
+
+# ###### Create a load balancer with simulated backends #####################
+# Each backend answers with its own name; for Gradio file requests, only
+# the backend that has "created" the file answers (like Gradio does).
+def makeLoadBalancer(routing : str,
+                     files   : dict[str,str] | None = None) -> loadbalancer.LoadBalancer:
+
+   def handle(request : httpx.Request) -> httpx.Response:
+      backend = request.url.host
+      if (files is not None) and ('/file=' in request.url.path):
+         if files.get(request.url.path) != backend:
+            return respond(403, 'File not allowed')
+      return respond(200, backend)
+
+   balancer = loadbalancer.LoadBalancer([ 'http://backend0', 'http://backend1', 'http://backend2' ],
+                                        routing = routing)
+   balancer.Client = httpx.AsyncClient(transport = httpx.MockTransport(handle))
+   return balancer
+
+
+# ###### Requests of a session go to the same backend #######################
+def testSessionRequests() -> None:
+   for routing in ( 'sticky', 'hash' ):
+      client   = starlette.testclient.TestClient(makeLoadBalancer(routing).App)
+      backends = { client.get('/gradio_api/queue/data', params = { 'session_hash': 'abc' }).text
+                   for request in range(0, 6) }
+      assert len(backends) == 1
+
+
+# ###### Hash routing is stateless ##########################################
+# Different load balancers route a session to the same backend.
+def testHashRoutingStateless() -> None:
+   backends = { starlette.testclient.TestClient(makeLoadBalancer('hash').App).post(
+                   '/gradio_api/queue/join', json = { 'session_hash': 'xyz' }).text
+                for balancer in range(0, 4) }
+   assert len(backends) == 1
+
+
+# ###### Files are fetched from the backend of the session ##################
+# The requests for files have no session hash, and must follow the
+# session's backend.
+def testFileRequests() -> None:
+   for routing in ( 'sticky', 'hash' ):
+      for sessionHash in ( 'session-1', 'session-2', 'session-3' ):
+         files  : dict[str,str] = { }
+         client = starlette.testclient.TestClient(makeLoadBalancer(routing, files).App)
+         backend = client.post('/gradio_api/queue/join',
+                               json = { 'session_hash': sessionHash }).text
+         files['/gradio_api/file=/tmp/gradio/image.webp'] = backend
+         for request in range(0, 6):
+            response = client.get('/gradio_api/file=/tmp/gradio/image.webp')
+            assert response.status_code == 200
+            assert response.text == backend
+
+
+# ###### Failed backends are skipped ########################################
+def testFailover() -> None:
+
+   def handle(request : httpx.Request) -> httpx.Response:
+      if request.url.host == 'backend0':
+         raise httpx.ConnectError('Connection refused', request = request)
+      return respond(200, request.url.host)
+
+   balancer = loadbalancer.LoadBalancer([ 'http://backend0', 'http://backend1' ], routing = 'sticky')
+   balancer.Client = httpx.AsyncClient(transport = httpx.MockTransport(handle))
+   client = starlette.testclient.TestClient(balancer.App)
+   client.cookies.set(loadbalancer.BackendCookie, '0')
+   response = client.get('/', params = { 'session_hash': 'abc' })
+   assert response.status_code == 200
+   assert response.text == 'backend1'
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+
+import deepfakeecg
+import os
+import pytest
+import sys
+import torch
+import typing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modelpool
+
+
+# ###### Local stand-in for a loaded generator network ######################
+# A small random convolution instead of the checkpoint, with the same input
+# and output layout: (ECGs, 8 leads, samples).
+class Network:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      torch.manual_seed(0)
+      self.Device  = 'cpu'
+      self.Network = torch.nn.Sequential(torch.nn.Conv1d(8, 8, 5, padding = 2),
+                                         torch.nn.Tanh())
+
+
+# ###### Create a generator model ###########################################
+def makeModel(ecgType : int = deepfakeecg.DATA_ECG12) -> modelpool.GeneratorModel:
+   return modelpool.GeneratorModel(typing.cast(modelpool.GeneratorNetwork, Network()), ecgType)
+
+
+# ###### Each ECG of a run has its own seed #################################
+def testECGSeeds() -> None:
+   seeds = modelpool.ecgSeeds(42, 0, 5)
+   assert len(set(seeds)) == 5
+   assert modelpool.ecgSeeds(42, 3, 2) == seeds[3:5]
+   assert set(modelpool.ecgSeeds(43, 0, 5)).isdisjoint(seeds)
+   assert all(0 <= seed < 2**64 for seed in seeds)
+
+
+# ###### The first segment of a long ECG uses the seed of the ECG ###########
+def testSegmentSeeds() -> None:
+   seeds = modelpool.segmentSeeds(1234, 4)
+   assert seeds[0] == 1234
+   assert len(set(seeds)) == 4
+   assert all(0 <= seed < 2**64 for seed in seeds)
+
+
+# ###### Seeded ECGs are reproducible, independently of the batch ###########
+def testReproducibleECGs() -> None:
+   model = makeModel()
+   seeds = modelpool.ecgSeeds(7, 0, 4)
+   batch = model.generate(4, seeds = seeds)
+   again = model.generate(4, seeds = seeds)
+   assert all(torch.equal(a, b) for a, b in zip(batch, again))
+
+   # Batched inference may differ by rounding, i.e. by 1 µV:
+   single = model.generate(1, seeds = seeds[2:3])[0]
+   assert int((single - batch[2]).abs().max()) <= 1
+
+   other = model.generate(1, seeds = modelpool.ecgSeeds(8, 2, 1))[0]
+   assert not torch.equal(other, batch[2])
+
+   with pytest.raises(ValueError):
+      model.generate(2, seeds = seeds[0:1])
+
+
+# ###### Output layout, truncated to integer µV #############################
+def testOutputLayout() -> None:
+   model   = makeModel()
+   samples = 2 * deepfakeecg.ECG_SAMPLING_RATE
+   result  = model.generate(1, ecgLengthInSeconds = 2, seeds = [ 1 ])[0]
+   assert result.dtype == torch.int32
+   assert result.shape == (samples, 1 + 12)
+   assert torch.equal(result[:, 0], torch.arange(samples, dtype = torch.int32) *
+                                    (1000 // deepfakeecg.ECG_SAMPLING_RATE))
+
+   # Same noise as generate(), the leads are truncated towards zero:
+   generator = torch.Generator()
+   generator.manual_seed(1)
+   noise = torch.empty(1, 8, samples).uniform_(-1, 1, generator = generator)
+   with torch.inference_mode():
+      leads = model.Network.Network(noise)[0] * deepfakeecg.ECG_DEFAULT_SCALE_FACTOR
+   assert torch.equal(result[:, 1:9], leads.int().t())
+   assert torch.equal(result[:, 9], (leads[1] - leads[0]).int())   # III = II - I
+
+   ecg8 = makeModel(deepfakeecg.DATA_ECG8).generate(1, ecgLengthInSeconds = 2, seeds = [ 1 ])[0]
+   assert torch.equal(ecg8, result[:, 0:9])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resultcache
+
+
+# ###### The key depends on the parameters and the device type ##############
+def testCacheKey() -> None:
+   key = resultcache.cacheKey('Default', 'cpu', 12, 10, 6000, 1, 0)
+   assert key == resultcache.cacheKey('Default', 'cpu', 12, 10, 6000, 1, 0)
+   assert resultcache.cacheKey('Default', 'cuda:0', 12, 10, 6000, 1, 0) == \
+             resultcache.cacheKey('Default', 'cuda:1', 12, 10, 6000, 1, 0)
+   others = [ resultcache.cacheKey('Other',   'cpu',  12, 10, 6000, 1, 0),
+              resultcache.cacheKey('Default', 'cuda', 12, 10, 6000, 1, 0),
+              resultcache.cacheKey('Default', 'cpu',   8, 10, 6000, 1, 0),
+              resultcache.cacheKey('Default', 'cpu',  12, 20, 6000, 1, 0),
+              resultcache.cacheKey('Default', 'cpu',  12, 10, 5000, 1, 0),
+              resultcache.cacheKey('Default', 'cpu',  12, 10, 6000, 2, 0),
+              resultcache.cacheKey('Default', 'cpu',  12, 10, 6000, 1, 1) ]
+   assert len(set(others + [ key ])) == 8
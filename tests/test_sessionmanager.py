@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sessionmanager
+
+
+# ###### Session of a server process ########################################
+class Session:
+
+   # ###### Constructor #####################################################
+   def __init__(self, memory : int = 0) -> None:
+      self.Memory = memory
+      self.Users  = 0
+      self.Closed = False
+
+   def close(self) -> None:
+      self.Closed = True
+
+   def busy(self) -> bool:
+      return self.Users > 0
+
+   def memoryUsage(self) -> int:
+      return self.Memory
+
+   def diskUsage(self) -> int:
+      return 0
+
+
+# ###### Idle sessions are closed, busy ones are kept #######################
+def testIdleTimeout() -> None:
+   manager : sessionmanager.SessionManager[Session] = sessionmanager.SessionManager(idleTimeout = 0.001)
+   idle = manager.add('idle', Session())
+   busy = manager.add('busy', Session())
+   busy.Users = 1
+   manager.LastUsed['idle'] = manager.LastUsed['busy'] = 0.0
+   manager.sweep()
+   assert idle.Closed and (manager.get('idle') is None)
+   assert (not busy.Closed) and (manager.get('busy') is busy)
+
+
+# ###### Least-recently used sessions are evicted over the budget ###########
+def testEviction() -> None:
+   manager : sessionmanager.SessionManager[Session] = sessionmanager.SessionManager(idleTimeout = 0, maxMemory = 250)
+   sessions = [ manager.add(f'session-{number}', Session(100)) for number in range(0, 4) ]
+   manager.get('session-0')   # Now the most recently used session
+   manager.sweep()
+   assert [ session.Closed for session in sessions ] == [ False, True, True, False ]
+   assert manager.memoryUsage() == 200
+
+
+# ###### A session becoming busy after its selection is not closed ##########
+def testExpireBusy() -> None:
+   manager : sessionmanager.SessionManager[Session] = sessionmanager.SessionManager()
+   session = manager.add('session-1', Session())
+   session.Users = 1   # A request has started to use the session
+   assert not manager.expire('session-1', session, 'idle')
+   assert (not session.Closed) and (manager.get('session-1') is session)
+   session.Users = 0
+   assert manager.expire('session-1', session, 'idle')
+   assert session.Closed and (manager.get('session-1') is None)
+
+
+# ###### An existing session is not replaced ################################
+def testAddExisting() -> None:
+   manager : sessionmanager.SessionManager[Session] = sessionmanager.SessionManager()
+   first  = manager.add('session-1', Session())
+   second = Session()
+   assert manager.add('session-1', second) is first
+   assert second.Closed and (not first.Closed)
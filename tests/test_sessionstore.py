@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+
+import deepfakeecg
+import numpy
+import os
+import pathlib
+import pytest
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sessionmanager
+import sessionstore
+from ecgresults import ECGResults
+
+
+# ###### Local stand-in for a Redis client ##################################
+# Keeps the values in a dictionary, ignoring the expiry times.
+class FakeRedis:
+
+   # ###### Constructor #####################################################
+   def __init__(self) -> None:
+      self.Values  : dict[str,bytes]      = { }
+      self.Expires : dict[str,int | None] = { }
+
+   def get(self, name : str) -> bytes | None:
+      return self.Values.get(name)
+
+   def set(self, name : str, value : bytes | str, ex : int | None = None) -> bool:
+      self.Values[name]  = value.encode('utf-8') if isinstance(value, str) else value
+      self.Expires[name] = ex
+      return True
+
+   def delete(self, *names : str) -> int:
+      return sum(1 for name in names if self.Values.pop(name, None) is not None)
+
+   def expire(self, name : str, time : int) -> bool:
+      if name in self.Values:
+         self.Expires[name] = time
+         return True
+      return False
+
+
+# ###### Session of a server process ########################################
+# A minimal session for the session manager, holding the stored state.
+class Session:
+
+   # ###### Constructor #####################################################
+   def __init__(self, state : sessionstore.SessionState) -> None:
+      self.State  = state
+      self.Closed = False
+
+   def close(self) -> None:
+      self.Closed = True
+
+   def busy(self) -> bool:
+      return False
+
+   def memoryUsage(self) -> int:
+      return 0 if self.State.Results is None else self.State.Results.memoryBytes()
+
+   def diskUsage(self) -> int:
+      return 0
+
+
+# ###### Create some results ################################################
+def makeResults(numberOfECGs : int = 3, samples : int = 100) -> ECGResults:
+   results = ECGResults(deepfakeecg.DATA_ECG8, numberOfECGs, samples, compact = True)
+   data    = numpy.arange(numberOfECGs * 8 * samples, dtype = numpy.int16).reshape(
+                numberOfECGs, 8, samples)
+   results.Data[:] = data
+   results.Count   = numberOfECGs
+   return results
+
+
+# ###### Session store to test ##############################################
+@pytest.fixture(params = [ 'file', 'redis' ])
+def store(request : pytest.FixtureRequest,
+          tmp_path : pathlib.Path) -> sessionstore.SessionStore:
+   if request.param == 'file':
+      return sessionstore.FileSessionStore(tmp_path / 'sessions', 3600)
+   return sessionstore.RedisSessionStore(FakeRedis(), 3600)
+
+
+# ###### Save, load and remove a session ####################################
+def testRoundTrip(store : sessionstore.SessionStore) -> None:
+   results = makeResults()
+   store.save('session-1', sessionstore.SessionState(1, 2, [ 'a', 'b', 'c' ], results))
+
+   state = store.load('session-1')
+   assert state is not None
+   assert (state.Counter, state.Selected, state.CacheKeys) == (1, 2, [ 'a', 'b', 'c' ])
+   assert state.Results is not None
+   assert len(state.Results) == 3
+   assert state.Results.Type == deepfakeecg.DATA_ECG8
+   assert state.Results.Compact
+   assert state.Results.ScaleFactor == results.ScaleFactor
+   assert numpy.array_equal(state.Results.Data, results.Data)
+
+   store.remove('session-1')
+   assert store.load('session-1') is None
+   assert store.load('session-2') is None
+
+
+# ###### Save the state only, keeping the stored results ####################
+def testSaveWithoutResults(store : sessionstore.SessionStore) -> None:
+   results = makeResults()
+   store.save('session-1', sessionstore.SessionState(1, 0, None, results))
+   store.save('session-1', sessionstore.SessionState(1, 2, None, results),
+              withResults = False)
+
+   state = store.load('session-1')
+   assert state is not None
+   assert state.Selected == 2
+   assert state.Results is not None
+   assert numpy.array_equal(state.Results.Data, results.Data)
+
+
+# ###### A new batch replaces the results ###################################
+def testNewBatch(store : sessionstore.SessionStore) -> None:
+   store.save('session-1', sessionstore.SessionState(1, 0, None, makeResults(3)))
+   store.save('session-1', sessionstore.SessionState(2, 0, None, makeResults(5)))
+
+   state = store.load('session-1')
+   assert state is not None
+   assert state.Counter == 2
+   assert state.Results is not None
+   assert len(state.Results) == 5
+
+
+# ###### The demo batch is not stored #######################################
+def testDemo(store : sessionstore.SessionStore) -> None:
+   store.save('session-1', sessionstore.SessionState(0, 1, None, makeResults()))
+   store.save('session-1', sessionstore.SessionState(0, 1, None, None))
+
+   state = store.load('session-1')
+   assert state is not None
+   assert state.Results is None
+   assert state.Selected == 1
+
+
+# ###### Invalid session IDs are refused by the file store ##################
+def testInvalidSessionID(tmp_path : pathlib.Path) -> None:
+   store = sessionstore.FileSessionStore(tmp_path, 3600)
+   with pytest.raises(ValueError):
+      store.save('../session', sessionstore.SessionState(0, 0, None, None))
+
+
+# ###### Expired sessions are removed from the file store ###################
+def testFileStoreSweep(tmp_path : pathlib.Path) -> None:
+   store = sessionstore.FileSessionStore(tmp_path, 3600)
+   store.save('session-1', sessionstore.SessionState(1, 0, None, makeResults()))
+   os.utime(tmp_path / 'session-1.json', (0, 0))
+   store.sweep()
+   assert store.load('session-1') is None
+   assert list(tmp_path.iterdir()) == [ ]
+
+
+# ###### Too large results are not stored in Redis ##########################
+def testRedisResultsLimit() -> None:
+   client = FakeRedis()
+   store  = sessionstore.RedisSessionStore(client, 3600, maxResultsBytes = 4096)
+   store.save('session-1', sessionstore.SessionState(1, 0, None, makeResults(2)))
+   assert store.load('session-1') is not None
+   store.save('session-1', sessionstore.SessionState(2, 0, None, makeResults(3)))
+   assert store.load('session-1') is None
+   assert client.Values == { }
+
+
+# ###### Restore a session on another server process ########################
+# The session is created by the session manager of the first server process.
+# The second server process does not know the session and restores it from
+# the store, as after a failover of the load balancer.
+def testRestoreOnOtherBackend(store : sessionstore.SessionStore) -> None:
+   backend1 : sessionmanager.SessionManager[Session] = sessionmanager.SessionManager()
+   backend2 : sessionmanager.SessionManager[Session] = sessionmanager.SessionManager()
+
+   results = makeResults()
+   session = backend1.add('session-1', Session(sessionstore.SessionState(1, 2, None, results)))
+   store.save('session-1', session.State)
+   backend1.shutdown()
+   assert session.Closed
+
+   assert backend2.get('session-1') is None
+   state = store.load('session-1')
+   assert state is not None
+   restored = backend2.add('session-1', Session(state))
+   assert backend2.get('session-1') is restored
+   assert restored.State.Selected == 2
+   assert restored.State.Results is not None
+   assert numpy.array_equal(restored.State.Results.Data, results.Data)
+
+   # ====== Continue the session on the second server process ===============
+   store.save('session-1', sessionstore.SessionState(2, 0, None, makeResults(5)))
+   state = store.load('session-1')
+   assert state is not None
+   assert state.Counter == 2
+   assert (state.Results is not None) and (len(state.Results) == 5)
+   backend2.shutdown()
+   assert restored.Closed
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# ==========================================================================
+#         ____                   __       _          _____ ____ ____
+#        |  _ \  ___  ___ _ __  / _| __ _| | _____  | ____/ ___/ ___|
+#        | | | |/ _ \/ _ \ '_ \| |_ / _` | |/ / _ \ |  _|| |  | |  _
+#        | |_| |  __/  __/ |_) |  _| (_| |   <  __/ | |__| |__| |_| |
+#        |____/ \___|\___| .__/|_|  \__,_|_|\_\___| |_____\____\____|
+#                        |_|
+#
+#                       --- Deepfake ECG Generator ---
+#                https://github.com/vlbthambawita/deepfake-ecg
+# ==========================================================================
+#
+# DeepfakeECG GUI Application
+# Copyright (C) 2023-2025 by Vajira Thambawita
+# Copyright (C) 2025 by Thomas Dreibholz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# * Vajira Thambawita <vajira@simula.no>
+# * Thomas Dreibholz <dreibh@simula.no>
+
+
+import concurrent.futures
+import datetime
+import importlib
+import multiprocessing
+import os
+
+from typing import Any, Callable
+
+
+# ###### Print log message ##################################################
+def log(logstring : str) -> None:
+   print(('\x1b[34m' + datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f') +
+          ': ' + logstring + '\x1b[0m'));
+
+
+# ###### Get the total size of the files in a directory tree ################
+def directorySize(directory : str) -> int:
+   size = 0
+   for subdirectory, subdirectories, files in os.walk(directory):
+      for file in files:
+         try:
+            size = size + os.path.getsize(os.path.join(subdirectory, file))
+         except OSError:
+            pass   # The file has been removed in the meantime
+   return size
+
+
+# ###### Import a module ####################################################
+# Used as initializer of worker processes. Modules cannot be pickled, so
+# nothing is returned.
+def importModule(module : str) -> None:
+   importlib.import_module(module)
+
+
+# ###### Start a pool of worker processes ###################################
+# The workers are forked, if possible. This should be done early, before the
+# calling process starts further threads, so that forking is safe. With
+# "fork", all workers are forked by the first submission. Its result is not
+# awaited, since the workers run the initializer (e.g. importModule) first.
+def startWorkerPool(workers     : int,
+                    initializer : Callable[..., None] | None = None,
+                    initargs    : tuple[Any, ...] = ()) -> concurrent.futures.ProcessPoolExecutor:
+   context : multiprocessing.context.BaseContext
+   if 'fork' in multiprocessing.get_all_start_methods():
+      context = multiprocessing.get_context('fork')
+   else:
+      context = multiprocessing.get_context('spawn')
+   executor = concurrent.futures.ProcessPoolExecutor(
+                 max_workers = workers, mp_context = context,
+                 initializer = initializer, initargs = initargs)
+   executor.submit(int)
+   return executor
+
+
+# ###### Wait until a pool of worker processes is ready #####################
+# A submitted task only runs after its worker has run the initializer. With
+# "fork", all workers have been started together by startWorkerPool(), so
+# they are ready at about the same time.
+def waitForWorkerPool(executor : concurrent.futures.ProcessPoolExecutor) -> None:
+   executor.submit(int).result()